@@ -0,0 +1,299 @@
+"""
+Low-overhead server metrics: phase timings, counters and gauges.
+
+Recording is enabled when METRICS_PORT or METRICS_SIGNAL is set in the
+environment; otherwise span() returns a shared no-op context manager and the
+other recording functions return immediately.
+
+Every thread records into its own shard (a plain dict per metric kind), so
+recording takes no lock; render() merges the shards. When a thread ends its
+shard is folded into a shared one, so servers that start a thread per
+connection keep a bounded number of shards. Phase timings use the monotonic
+perf_counter clock and go into fixed-bucket histograms.
+
+The stats are exported in the Prometheus text format by start_exporter():
+  * METRICS_PORT: served over HTTP on METRICS_HOST (default 127.0.0.1)
+  * METRICS_SIGNAL: a signal name (e.g. USR1) that dumps them to stderr
+
+Both challenge servers import this one module: they find it in ../common
+when run from the repository, and their images copy it next to server.py.
+"""
+
+import bisect
+import contextlib
+import os
+import signal
+import sys
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+ENABLED = bool(os.environ.get("METRICS_PORT") or os.environ.get("METRICS_SIGNAL"))
+NAMESPACE = "server"
+# Upper bounds in seconds, 10us to about 42s in factors of 2
+BUCKETS = tuple(1e-5 * 2**i for i in range(23))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_NULL_SPAN = contextlib.nullcontext()
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+class _ShardOwner:
+    __slots__ = ("__weakref__",)
+
+
+class _Shard:
+    __slots__ = ("counters", "gauges", "histograms")
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        # phase -> [bucket counts (one more than BUCKETS for +Inf), sum]
+        self.histograms = {}
+
+
+# Counts of the threads that have ended
+_retired = _Shard()
+
+
+def _retire(shard):
+    with _shards_lock:
+        _shards.remove(shard)
+        _fold(_retired, shard)
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = _Shard()
+        # The owner only lives in the thread's local storage, which is
+        # dropped when the thread ends
+        _local.owner = owner = _ShardOwner()
+        weakref.finalize(owner, _retire, shard)
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def observe(phase, seconds):
+    """Record one duration of phase."""
+    if not ENABLED:
+        return
+    histograms = _shard().histograms
+    entry = histograms.get(phase)
+    if entry is None:
+        entry = histograms[phase] = [[0] * (len(BUCKETS) + 1), 0.0]
+    entry[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+    entry[1] += seconds
+
+
+class _Span:
+    __slots__ = ("phase", "start")
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.phase, perf_counter() - self.start)
+
+
+def span(phase):
+    """Context manager timing its body as one observation of phase."""
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(phase)
+
+
+def inc(name, amount=1):
+    """Add amount to the counter name (exported as name_total)."""
+    if not ENABLED:
+        return
+    counters = _shard().counters
+    counters[name] = counters.get(name, 0) + amount
+
+
+def gauge_add(name, delta):
+    """Add delta (possibly negative) to the gauge name."""
+    if not ENABLED:
+        return
+    gauges = _shard().gauges
+    gauges[name] = gauges.get(name, 0) + delta
+
+
+def _fold(target, shard):
+    """Add the counts of shard to target."""
+    counters = target.counters
+    gauges = target.gauges
+    histograms = target.histograms
+    # dict() copies in one step, so other threads may keep recording
+    for name, value in dict(shard.counters).items():
+        counters[name] = counters.get(name, 0) + value
+    for name, value in dict(shard.gauges).items():
+        gauges[name] = gauges.get(name, 0) + value
+    for phase, (counts, total) in dict(shard.histograms).items():
+        merged = histograms.setdefault(phase, [[0] * len(counts), 0.0])
+        for i, count in enumerate(list(counts)):
+            merged[0][i] += count
+        merged[1] += total
+
+
+def _merged():
+    merged = _Shard()
+    # Under the lock, so that a shard being retired is not counted twice
+    with _shards_lock:
+        _fold(merged, _retired)
+        for shard in _shards:
+            _fold(merged, shard)
+    return merged.counters, merged.gauges, merged.histograms
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format."""
+    counters, gauges, histograms = _merged()
+    lines = []
+    for name in sorted(counters):
+        metric = f"{NAMESPACE}_{name}_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {counters[name]}"]
+    for name in sorted(gauges):
+        metric = f"{NAMESPACE}_{name}"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {gauges[name]}"]
+    if histograms:
+        metric = f"{NAMESPACE}_phase_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+    for phase in sorted(histograms):
+        counts, total = histograms[phase]
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            le = bound if isinstance(bound, str) else f"{bound:.6g}"
+            lines.append(f'{metric}_bucket{{phase="{phase}",le="{le}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{phase="{phase}"}} {total:.9g}')
+        lines.append(f'{metric}_count{{phase="{phase}"}} {cumulative}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _dump_on_request(requested):
+    while True:
+        requested.wait()
+        requested.clear()
+        sys.stderr.write(render())
+
+
+def start_exporter(namespace):
+    """
+    Name the metrics namespace_* and export them as configured by the
+    environment. Must be called from the main thread (for the signal).
+    Returns the HTTP server, or None if there is none.
+    """
+    global NAMESPACE
+    NAMESPACE = namespace
+    signal_name = os.environ.get("METRICS_SIGNAL")
+    if signal_name:
+        signum = getattr(signal, "SIG" + signal_name.upper().removeprefix("SIG"))
+        # The handler runs in the main thread, possibly while it holds
+        # _shards_lock, so it must not render; a daemon thread does
+        requested = threading.Event()
+        threading.Thread(
+            target=_dump_on_request, args=(requested,), daemon=True
+        ).start()
+        signal.signal(signum, lambda *_: requested.set())
+    port = os.environ.get("METRICS_PORT")
+    if not port:
+        return None
+    host = os.environ.get("METRICS_HOST", "127.0.0.1")
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# -------------------- Tests --------------------
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        global ENABLED
+        self._was_enabled = ENABLED
+        ENABLED = True
+        # Retires this thread's shard, so clear it before saving
+        _local.__dict__.clear()
+        with _shards_lock:
+            self._saved_shards = list(_shards)
+            self._saved_retired = (
+                _retired.counters,
+                _retired.gauges,
+                _retired.histograms,
+            )
+            _shards.clear()
+            _retired.__init__()
+
+    def tearDown(self):
+        global ENABLED
+        ENABLED = self._was_enabled
+        _local.__dict__.clear()
+        with _shards_lock:
+            _shards[:] = self._saved_shards
+            _retired.counters, _retired.gauges, _retired.histograms = (
+                self._saved_retired
+            )
+
+    def test_shards_are_merged(self):
+        def work():
+            for _ in range(100):
+                inc("sessions_accepted")
+                observe("check", 3e-5)
+            gauge_add("sessions_active", 1)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with span("parse"):
+            pass
+        text = render()
+        # The shards of the joined threads were folded into _retired
+        self.assertEqual(len(_shards), 1)
+        self.assertIn(f"{NAMESPACE}_sessions_accepted_total 400\n", text)
+        self.assertIn(f"{NAMESPACE}_sessions_active 4\n", text)
+        self.assertIn(
+            f'{NAMESPACE}_phase_seconds_bucket{{phase="check",le="2e-05"}} 0\n', text
+        )
+        self.assertIn(
+            f'{NAMESPACE}_phase_seconds_bucket{{phase="check",le="4e-05"}} 400\n', text
+        )
+        self.assertIn(f'{NAMESPACE}_phase_seconds_count{{phase="parse"}} 1\n', text)
+
+    def test_disabled_records_nothing(self):
+        global ENABLED
+        ENABLED = False
+        self.assertIs(span("check"), _NULL_SPAN)
+        inc("sessions_accepted")
+        observe("check", 1.0)
+        self.assertEqual(render(), "\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Load generator for the challenge servers.
+
+Runs closed-loop workers that each open one session after another against
+underconstrained_circuit/server.py ("circuit") or weak_fiat_shamir/server.py
+("schnorr") and report throughput and p50/p95/p99 latency of every phase:
+
+  connect   TCP handshake
+  prompt    until the greeting (circuit prompt, or Schnorr A1) has arrived
+  submit    sending the payload, including deliberate pauses
+  verdict   from the end of the payload to the server's verdict
+
+Payloads are drawn from --mix: "valid" (an honest witness that satisfies
+the circuit, or a Schnorr proof the server accepts), "invalid" (rejected)
+and "partial" (a valid payload trickled in --chunk-bytes pieces every
+--chunk-delay seconds).
+
+Only loopback addresses are allowed. With --spawn the server is started
+inside this process, in a background thread.
+
+Usage:
+    python3 tools/loadgen.py circuit --sessions 500 --concurrency 50
+    python3 tools/loadgen.py schnorr --binary --spawn asyncio --json out.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib
+import ipaddress
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHALLENGE_DIRS = {
+    "circuit": os.path.join(ROOT, "underconstrained_circuit"),
+    "schnorr": os.path.join(ROOT, "weak_fiat_shamir"),
+}
+DEFAULT_PORTS = {"circuit": 1337, "schnorr": 1337}
+PHASES = ("connect", "prompt", "submit", "verdict")
+PERCENTILES = (50, 95, 99)
+PAYLOAD_KINDS = ("valid", "invalid", "partial")
+
+
+def _import_from(challenge, name):
+    directory = CHALLENGE_DIRS[challenge]
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    return importlib.import_module(name)
+
+
+def _check_loopback(host):
+    for info in socket.getaddrinfo(host, None):
+        if not ipaddress.ip_address(info[4][0]).is_loopback:
+            raise SystemExit(f"{host} is not a loopback address")
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+    return sorted_values[index]
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.durations = {}
+        self._start = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.durations[phase] = now - self._start
+        self._start = now
+
+    def skip(self):
+        """Leave the time since the last mark out of every phase."""
+        self._start = time.perf_counter()
+
+
+async def _send(writer, data, kind, chunk_bytes, chunk_delay):
+    if kind == "partial":
+        for offset in range(0, len(data), chunk_bytes):
+            writer.write(data[offset : offset + chunk_bytes])
+            await writer.drain()
+            await asyncio.sleep(chunk_delay)
+    else:
+        writer.write(data)
+        await writer.drain()
+
+
+# -------------------- circuit --------------------
+
+
+class CircuitClient:
+    """underconstrained_circuit protocol: a prompt, then the witness values."""
+
+    def __init__(self, binary):
+        plonk_circuit = _import_from("circuit", "plonk_circuit")
+        self.binary = binary
+        self.modulus = plonk_circuit.Fr_modulus
+        # Honest witness of the server's 64-bit XOR circuit, built the same way
+        circuit = plonk_circuit.PlonkCircuitBuilder()
+        left_value = random.getrandbits(64)
+        right_value = random.getrandbits(64)
+        indices = [
+            circuit.add_variable(plonk_circuit.Fr(value))
+            for value in (left_value, right_value, left_value ^ right_value)
+        ]
+        circuit.create_64_bit_xor_gate(*indices)
+        self.valid_witness = [variable.value for variable in circuit.variables]
+
+    def _encode(self, witness):
+        if self.binary:
+            return b"BINARY\n" + b"".join(
+                value.to_bytes(32, "big") for value in witness
+            )
+        return " ".join(str(value) for value in witness).encode() + b"\n"
+
+    async def session(self, reader, writer, kind, timer, args):
+        await reader.readuntil(b"> ")
+        timer.mark("prompt")
+        if kind == "invalid":
+            witness = [
+                random.randrange(self.modulus) for _ in range(len(self.valid_witness))
+            ]
+        else:
+            witness = self.valid_witness
+        await _send(
+            writer, self._encode(witness), kind, args.chunk_bytes, args.chunk_delay
+        )
+        timer.mark("submit")
+        # The verdict is the last line before the server closes the connection
+        lines = (await reader.read()).decode(errors="replace").splitlines()
+        timer.mark("verdict")
+        verdict = lines[-1] if lines else ""
+        if "not satisfied" in verdict:
+            return "unsatisfied"
+        if "xor to the output" in verdict:
+            return "satisfied"
+        if "flag" in verdict:
+            return "flag"
+        return "error: " + verdict[:40]
+
+
+# -------------------- schnorr --------------------
+
+
+class SchnorrClient:
+    """
+    weak_fiat_shamir protocol. Valid payloads are forgeries against the
+    server's A1 (the weakness the challenge is about), so they are accepted.
+    """
+
+    MAGIC = b"SCHNORR2\n"
+
+    def __init__(self, binary):
+        self.curve_backend = _import_from("schnorr", "curve_backend")
+        self.backend = self.curve_backend.Secp256k1Backend()
+        self.binary = binary
+        self.message = b"Give us the flag"
+        self.request_id = 0
+
+    def _ser(self, point):
+        x, y = point
+        return x.to_bytes(32, "big") + y.to_bytes(32, "big")
+
+    def _challenge(self, data):
+        return int.from_bytes(hashlib.sha256(data).digest(), "big") % self.backend.order
+
+    def forge(self, A1):
+        backend, order = self.backend, self.backend.order
+        R1 = backend.mul_base(random.randrange(1, order))
+        batch_challenge = self._challenge(self._ser(A1) + self._ser(R1))
+        inverse = pow(batch_challenge, -1, order)
+        a2, k2 = random.randrange(1, order), random.randrange(1, order)
+        # A2 = a2*G - A1/b and R2 = k2*G - R1/b cancel the terms in A1 and R1
+        A2 = backend.add(backend.mul_base(a2), backend.neg(backend.mul(inverse, A1)))
+        R2 = backend.add(backend.mul_base(k2), backend.neg(backend.mul(inverse, R1)))
+        e = self._challenge(
+            self._ser(A1) + self._ser(R1) + self._ser(A2) + self._ser(R2) + self.message
+        )
+        return A2, R1, R2, batch_challenge * (k2 + e * a2) % order
+
+    def _payload(self, A1, kind):
+        A2, R1, R2, s = self.forge(A1)
+        if kind == "invalid":
+            s = (s + 1) % self.backend.order
+        if self.binary:
+            self.request_id += 1
+            encode = self.curve_backend.encode_point
+            body = (
+                struct.pack(">I", self.request_id)
+                + encode(A2)
+                + encode(R1)
+                + encode(R2)
+                + s.to_bytes(32, "big")
+                + self.message
+            )
+            return struct.pack(">I", len(body)) + body
+        fields = {}
+        for name, (x, y) in (("A2", A2), ("R1", R1), ("R2", R2)):
+            fields[name + "_x"], fields[name + "_y"] = str(x), str(y)
+        fields["s"] = str(s)
+        fields["msg"] = self.message.decode("latin-1")
+        return (json.dumps(fields) + "\n").encode()
+
+    async def session(self, reader, writer, kind, timer, args):
+        intro = json.loads(await reader.readline())
+        A1 = (int(intro["A1_x"]), int(intro["A1_y"]))
+        if self.binary:
+            writer.write(self.MAGIC)
+            (length,) = struct.unpack(">I", await reader.readexactly(4))
+            A1 = self.curve_backend.decode_point(await reader.readexactly(length))
+        timer.mark("prompt")
+        payload = self._payload(A1, kind)
+        # Forging is client work, not part of the server's latency
+        timer.skip()
+        await _send(writer, payload, kind, args.chunk_bytes, args.chunk_delay)
+        timer.mark("submit")
+        if self.binary:
+            (length,) = struct.unpack(">I", await reader.readexactly(4))
+            response = await reader.readexactly(length)
+            status = response[4]
+            timer.mark("verdict")
+            if status == 2:
+                return "error: " + response[5:].decode(errors="replace")[:40]
+            return "accepted" if status == 1 else "rejected"
+        response = json.loads(await reader.readline())
+        timer.mark("verdict")
+        if "error" in response:
+            return "error: " + str(response["error"])[:40]
+        return "accepted" if response.get("ok") else "rejected"
+
+
+# -------------------- driver --------------------
+
+
+def _parse_mix(text):
+    weights = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in PAYLOAD_KINDS:
+            raise SystemExit(f"unknown payload kind {kind!r}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+async def _run(client, args):
+    kinds, weights = zip(*_parse_mix(args.mix).items())
+    samples = defaultdict(list)
+    outcomes = Counter()
+    expected = Counter()
+    remaining = [args.sessions]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            kind = random.choices(kinds, weights)[0]
+            timer = PhaseTimer()
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(args.host, args.port)
+                timer.mark("connect")
+                outcome = await asyncio.wait_for(
+                    client.session(reader, writer, kind, timer, args), args.timeout
+                )
+            except asyncio.TimeoutError:
+                outcome = "error: timeout"
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                outcome = f"error: {type(e).__name__}"
+            finally:
+                if writer is not None:
+                    writer.close()
+            outcomes[(kind, outcome)] += 1
+            expected[kind] += 1
+            if not outcome.startswith("error"):
+                for phase, duration in timer.durations.items():
+                    samples[phase].append(duration)
+            if args.think_time:
+                await asyncio.sleep(random.expovariate(1 / args.think_time))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    return samples, outcomes, elapsed
+
+
+def _spawn_server(challenge, mode, port):
+    """Start the challenge server on 127.0.0.1:port in a daemon thread."""
+    # Imported as "server" so process-pool workers can unpickle its functions
+    server = _import_from(challenge, "server")
+    if challenge == "circuit":
+        if mode == "asyncio":
+            target = lambda: asyncio.run(server.serve_asyncio("127.0.0.1", port))
+        else:
+            server.HOST, server.PORT = "127.0.0.1", port
+            target = server.serve_forever
+    else:
+        server.backend.mul_base(1)
+        if mode == "asyncio":
+            target = lambda: asyncio.run(server.serve_asyncio("127.0.0.1", port))
+        else:
+            tcp_server = server.ThreadedTCPServer(
+                ("127.0.0.1", port), server.ThreadedTCPRequestHandler
+            )
+            target = tcp_server.serve_forever
+    threading.Thread(target=target, daemon=True).start()
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def report(args, samples, outcomes, elapsed):
+    completed = sum(outcomes.values())
+    result = {
+        "challenge": args.challenge,
+        "binary": args.binary,
+        "sessions": completed,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": elapsed,
+        "sessions_per_second": completed / elapsed if elapsed else None,
+        "outcomes": {f"{kind}/{outcome}": n for (kind, outcome), n in outcomes.items()},
+        "phases": {},
+    }
+    for phase in PHASES:
+        values = sorted(samples.get(phase, ()))
+        result["phases"][phase] = {
+            "count": len(values),
+            **{f"p{p}": percentile(values, p) for p in PERCENTILES},
+        }
+
+    print(
+        f"{completed} sessions in {elapsed:.2f}s:"
+        f" {result['sessions_per_second']:.1f} sessions/s"
+    )
+    print(f"{'phase':<10}" + "".join(f"{f'p{p} ms':>12}" for p in PERCENTILES))
+    for phase, stats in result["phases"].items():
+        cells = "".join(
+            (
+                f"{stats[f'p{p}'] * 1000:>12.2f}"
+                if stats[f"p{p}"] is not None
+                else f"{'-':>12}"
+            )
+            for p in PERCENTILES
+        )
+        print(f"{phase:<10}{cells}")
+    for (kind, outcome), n in sorted(outcomes.items()):
+        print(f"  {kind:<8} {outcome:<30} {n}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load generator for the challenge servers"
+    )
+    parser.add_argument("challenge", choices=sorted(CHALLENGE_DIRS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="mean pause in seconds between a worker's sessions",
+    )
+    parser.add_argument(
+        "--mix",
+        default="valid=1,invalid=1,partial=1",
+        help="payload weights, e.g. valid=8,invalid=1,partial=1",
+    )
+    parser.add_argument("--chunk-bytes", type=int, default=64)
+    parser.add_argument("--chunk-delay", type=float, default=0.01)
+    parser.add_argument("--binary", action="store_true", help="use the binary protocol")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--spawn",
+        choices=("threaded", "asyncio"),
+        help="run the server in this process on --port (default 18000)",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    _check_loopback(args.host)
+    if args.port is None:
+        args.port = 18000 if args.spawn else DEFAULT_PORTS[args.challenge]
+    if args.spawn:
+        _spawn_server(args.challenge, args.spawn, args.port)
+    client = (CircuitClient if args.challenge == "circuit" else SchnorrClient)(
+        args.binary
+    )
+    samples, outcomes, elapsed = asyncio.run(_run(client, args))
+    result = report(args, samples, outcomes, elapsed)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
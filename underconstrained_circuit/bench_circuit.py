@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for PlonkCircuitBuilder hot paths.
+
+Builds circuits of 1 to 10,000 chained 64-bit XOR gadgets and measures build
+time, check_circuit time, print_gates time, peak memory and heap objects
+allocated per gate. Results are written as JSON so runs on different commits
+(or with different gadgets) can be compared.
+
+Usage:
+    python3 bench_circuit.py [--sizes 1,10,100] [--output results.json]
+                             [--compare previous.json] [--gadget lookup8]
+                             [--check-workers 4]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from parallel_check import ParallelChecker
+from plonk_circuit import Fr, PlonkCircuitBuilder
+
+DEFAULT_SIZES = (1, 10, 100, 1000, 10000)
+# 64-bit XOR gadgets: the 2-bit decomposition and the lookup-table variants
+GADGETS = {
+    "2bit": lambda circuit, *wires: circuit.create_64_bit_xor_gate(*wires),
+    "lookup4": lambda circuit, *wires: circuit.create_64_bit_xor_gate_lookup(
+        *wires, chunk_bits=4
+    ),
+    "lookup8": lambda circuit, *wires: circuit.create_64_bit_xor_gate_lookup(
+        *wires, chunk_bits=8
+    ),
+}
+# Metrics where a larger value is a regression
+METRICS = (
+    "build_seconds",
+    "check_seconds",
+    "parallel_first_check_seconds",
+    "parallel_check_seconds",
+    "print_seconds",
+    "peak_bytes",
+    "objects_per_gate",
+)
+
+
+def build_chained_xor(gadget_count, seed=0, gadget="2bit"):
+    """Chain gadgets so that each output is the left input of the next."""
+    create = GADGETS[gadget]
+    rng = random.Random(seed)
+    circuit = PlonkCircuitBuilder()
+    value = rng.getrandbits(64)
+    index = circuit.add_variable(Fr(value))
+    for _ in range(gadget_count):
+        right_value = rng.getrandbits(64)
+        right_index = circuit.add_variable(Fr(right_value))
+        output_value = value ^ right_value
+        output_index = circuit.add_variable(Fr(output_value))
+        create(circuit, index, right_index, output_index)
+        index, value = output_index, output_value
+    return circuit
+
+
+def bench_size(
+    gadget_count,
+    measure_print=True,
+    measure_memory=True,
+    gadget="2bit",
+    check_workers=None,
+):
+    start = time.perf_counter()
+    circuit = build_chained_xor(gadget_count, gadget=gadget)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    satisfied = circuit.check_circuit()
+    check_seconds = time.perf_counter() - start
+    assert satisfied
+
+    parallel_first_check_seconds = parallel_check_seconds = None
+    if check_workers:
+        # Pool start-up and the column copy are paid once per circuit, so
+        # only the per-witness checks are timed. The first one also decodes
+        # the whole witness in every worker, later ones only what changed.
+        with ParallelChecker(circuit, workers=check_workers) as checker:
+            witness = [variable.value for variable in circuit.variables]
+            start = time.perf_counter()
+            satisfied = checker.check_circuit(witness)
+            parallel_first_check_seconds = time.perf_counter() - start
+            assert satisfied
+            start = time.perf_counter()
+            satisfied = checker.check_circuit(witness)
+            parallel_check_seconds = time.perf_counter() - start
+        assert satisfied
+
+    print_seconds = None
+    if measure_print:
+        sink = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sink):
+            circuit.print_gates(show_values=True)
+        print_seconds = time.perf_counter() - start
+
+    gates = circuit.get_circuit_size()
+    result = {
+        "gadget": gadget,
+        "gadgets": gadget_count,
+        "gates": gates,
+        "variables": len(circuit.variables),
+        "build_seconds": build_seconds,
+        "check_seconds": check_seconds,
+        "parallel_first_check_seconds": parallel_first_check_seconds,
+        "parallel_check_seconds": parallel_check_seconds,
+        "print_seconds": print_seconds,
+        "peak_bytes": None,
+        "objects_per_gate": None,
+    }
+    del circuit
+
+    if measure_memory:
+        # Rebuild under tracing: heap blocks still alive after the build are
+        # the objects the circuit keeps per gate
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        circuit = build_chained_xor(gadget_count, gadget=gadget)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_bytes"] = peak
+        result["objects_per_gate"] = (sys.getallocatedblocks() - blocks_before) / gates
+        del circuit
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format_value(metric, value):
+    if value is None:
+        return "-"
+    if metric.endswith("_seconds"):
+        return f"{value * 1000:.1f} ms"
+    if metric == "peak_bytes":
+        return f"{value / 2**20:.1f} MiB"
+    return f"{value:.2f}"
+
+
+def print_table(results, previous=None):
+    previous_by_size = {}
+    if previous is not None:
+        previous_by_size = {entry["gadgets"]: entry for entry in previous["results"]}
+    header = f"{'gadgets':>8} {'gates':>16}" + "".join(
+        f" {metric:>22}" for metric in METRICS
+    )
+    print(header)
+    for entry in results:
+        before = previous_by_size.get(entry["gadgets"], {})
+        gates = str(entry["gates"])
+        if before.get("gates"):
+            gates += f" ({entry['gates'] / before['gates']:.2f}x)"
+        line = f"{entry['gadgets']:>8} {gates:>16}"
+        for metric in METRICS:
+            cell = _format_value(metric, entry[metric])
+            if entry[metric] and before.get(metric):
+                cell += f" ({entry[metric] / before[metric]:.2f}x)"
+            line += f" {cell:>22}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PlonkCircuitBuilder")
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma-separated numbers of chained 64-bit XOR gadgets",
+    )
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument(
+        "--compare", help="JSON results of an earlier run to compare against"
+    )
+    parser.add_argument(
+        "--max-print-gadgets",
+        type=int,
+        default=1000,
+        help="skip print_gates above this many gadgets",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the traced rebuild"
+    )
+    parser.add_argument(
+        "--gadget",
+        choices=sorted(GADGETS),
+        default="2bit",
+        help="64-bit XOR gadget to chain",
+    )
+    parser.add_argument(
+        "--check-workers",
+        type=int,
+        help="also time ParallelChecker checks with this many processes",
+    )
+    args = parser.parse_args()
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        results.append(
+            bench_size(
+                size,
+                measure_print=size <= args.max_print_gadgets,
+                measure_memory=not args.no_memory,
+                gadget=args.gadget,
+                check_workers=args.check_workers,
+            )
+        )
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+    print_table(results, previous)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark comparing the Fr field element against its former
+implementation (no __slots__, reduction on every construction).
+
+Usage: python3 bench_fr.py [--count N]
+"""
+
+import argparse
+import random
+import timeit
+import tracemalloc
+
+from plonk_circuit import Fr, Fr_modulus
+
+
+class LegacyFr:
+    def __init__(self, value):
+        if isinstance(value, LegacyFr):
+            value = value.value
+        self.value = value % Fr_modulus
+
+    def __add__(self, other):
+        return LegacyFr(self.value + other.value)
+
+    def __mul__(self, other):
+        return LegacyFr(self.value * other.value)
+
+    def __neg__(self):
+        return LegacyFr(Fr_modulus - self.value)
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _gate_expression(field, q_m, q_l, q_r, q_o, q_c, a, b, c):
+    return q_m * a * b + q_l * a + q_r * b + q_o * c + q_c == field(0)
+
+
+def _build_witness(field, count):
+    # Witness builders mostly create small limbs and bits
+    return [field(i & 3) for i in range(count)]
+
+
+def _measure_memory(function):
+    tracemalloc.start()
+    result = function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def run(count):
+    values = [random.randrange(Fr_modulus) for _ in range(3)]
+    selectors = (1, -1, 0, 0, 0)
+    results = {}
+    for name, field in (("legacy", LegacyFr), ("fr", Fr)):
+        a, b, c = (field(v) for v in values)
+        q = [field(s) for s in selectors]
+        x, y = field(values[0]), field(values[1])
+        timings = {
+            "add": timeit.timeit(lambda: x + y, number=count),
+            "sub": timeit.timeit(lambda: x - y, number=count),
+            "mul": timeit.timeit(lambda: x * y, number=count),
+            "small_constant": timeit.timeit(lambda: field(-1), number=count),
+            "gate_expression": timeit.timeit(
+                lambda: _gate_expression(field, *q, a, b, c), number=count
+            ),
+        }
+        retained, peak = _measure_memory(lambda: _build_witness(field, count))
+        results[name] = (timings, retained, peak)
+
+    print(f"{'operation':<18}{'legacy ns/op':>14}{'fr ns/op':>12}{'speedup':>10}")
+    for operation in results["legacy"][0]:
+        legacy = results["legacy"][0][operation] / count * 1e9
+        fast = results["fr"][0][operation] / count * 1e9
+        print(f"{operation:<18}{legacy:>14.1f}{fast:>12.1f}{legacy / fast:>9.2f}x")
+    print()
+    print(f"witness of {count} small values:")
+    for name, (_, retained, peak) in results.items():
+        print(
+            f"  {name:<8} retained {retained / count:7.1f} B/element,"
+            f" peak {peak / count:7.1f} B/element"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=200000)
+    run(parser.parse_args().count)
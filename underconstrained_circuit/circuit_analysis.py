@@ -0,0 +1,424 @@
+"""
+Static under-constraint analysis of PlonkCircuitBuilder circuits.
+
+Starting from the public variables, facts are propagated over the
+gate/variable graph with a worklist:
+
+  * a gate in which a single variable is still unknown, and that variable
+    appears with a fixed non-zero coefficient, determines it;
+  * a BOOLEAN gate bounds its variable to {0, 1};
+  * a linear gate whose unknown is a non-negative combination of bounded
+    variables bounds the unknown;
+  * a limb decomposition x = k*y + z with x determined, z < k and k*y + z
+    below the modulus determines both y and z;
+  * a lookup gate bounds each variable by the largest value of its table
+    column, and determines a variable that is a function of the other two
+    in the table once those are determined.
+
+Each variable changes state a bounded number of times, so the analysis runs
+in time linear in the number of gates.
+"""
+
+from collections import deque
+
+from plonk_circuit import Fr_modulus, _signed
+
+# A variable's range bound may be tightened at most this many times
+MAX_BOUND_UPDATES = 4
+
+
+class CircuitAnalysis:
+    """
+    Result of analyze_circuit().
+
+    Attributes:
+        public_variables (set): Variables treated as known inputs/outputs.
+        determined (set): Variables uniquely fixed by the public variables.
+        bounds (dict): Inclusive upper bound of range-restricted variables.
+        gate_uses (list): Number of gates referencing each variable.
+        disconnected_gates (list): Gates sharing no variable, even
+            transitively, with a public variable.
+    """
+
+    def __init__(
+        self, public_variables, determined, bounds, gate_uses, disconnected_gates
+    ):
+        self.public_variables = public_variables
+        self.determined = determined
+        self.bounds = bounds
+        self.gate_uses = gate_uses
+        self.disconnected_gates = disconnected_gates
+
+    @property
+    def free_variables(self):
+        """Used variables that the public variables do not determine."""
+        return [
+            variable
+            for variable, uses in enumerate(self.gate_uses)
+            if uses and variable not in self.determined
+        ]
+
+    @property
+    def unbounded_variables(self):
+        """Free variables without any range restriction."""
+        return [
+            variable for variable in self.free_variables if variable not in self.bounds
+        ]
+
+    @property
+    def unused_variables(self):
+        """Variables no gate constrains at all."""
+        return [
+            variable
+            for variable, uses in enumerate(self.gate_uses)
+            if not uses and variable not in self.public_variables
+        ]
+
+    @property
+    def dangling_variables(self):
+        """
+        Free, range-unbounded variables referenced by a single gate: that gate
+        can always be satisfied by choosing them, so they are never checked.
+        """
+        return [
+            variable
+            for variable in self.unbounded_variables
+            if self.gate_uses[variable] == 1
+        ]
+
+    def summary(self):
+        lines = [
+            f"variables: {len(self.gate_uses)}"
+            f" (public {len(self.public_variables)},"
+            f" determined {len(self.determined)},"
+            f" free {len(self.free_variables)},"
+            f" range-unbounded {len(self.unbounded_variables)})",
+        ]
+        for title, items in (
+            ("unused variables", self.unused_variables),
+            (
+                "dangling variables (single gate, never range-checked)",
+                self.dangling_variables,
+            ),
+            ("gates disconnected from public variables", self.disconnected_gates),
+        ):
+            if items:
+                shown = ", ".join(str(item) for item in items[:20])
+                more = f", ... ({len(items)} total)" if len(items) > 20 else ""
+                lines.append(f"{title}: {shown}{more}")
+        return "\n".join(lines)
+
+
+def _row_terms(row):
+    """Split a selector row into signed (q_m, q_c, [(wire position, q)])."""
+    q_m, q_l, q_r, q_o, q_c = row[:5]
+    linear = [
+        (position, _signed(coefficient))
+        for position, coefficient in enumerate((q_l, q_r, q_o))
+        if coefficient
+    ]
+    return _signed(q_m), _signed(q_c), linear
+
+
+def _lookup_facts(entries):
+    """
+    Return the largest value of each wire position in a lookup table and the
+    positions whose value the other two positions determine.
+    """
+    bounds = [max(column) for column in zip(*entries)] if entries else [0, 0, 0]
+    functional = []
+    for position in range(3):
+        seen = {}
+        for entry in entries:
+            key = entry[:position] + entry[position + 1 :]
+            if seen.setdefault(key, entry[position]) != entry[position]:
+                break
+        else:
+            functional.append(position)
+    return bounds, functional
+
+
+def _gate_linear_terms(row_linear, wires):
+    """Return {variable: signed coefficient} for one gate."""
+    linear = {}
+    for position, coefficient in row_linear:
+        variable = wires[position]
+        if variable in linear:
+            combined = _signed((linear[variable] + coefficient) % Fr_modulus)
+            if combined:
+                linear[variable] = combined
+            else:
+                del linear[variable]
+        else:
+            linear[variable] = coefficient
+    return linear
+
+
+def analyze_circuit(circuit, public_variables):
+    """
+    Propagate determinacy and range facts from public_variables.
+
+    Args:
+        circuit: A PlonkCircuitBuilder or CompiledCircuit.
+        public_variables: Indices of the variables the verifier knows.
+
+    Returns:
+        CircuitAnalysis
+    """
+    rows = circuit.selector_rows
+    selector_ids = circuit.selector_ids
+    w_l, w_r, w_o = circuit.w_l, circuit.w_r, circuit.w_o
+    variable_count = getattr(circuit, "variable_count", None)
+    if variable_count is None:
+        variable_count = len(circuit.variables)
+    gate_count = len(selector_ids)
+
+    # Gates referencing each variable with a non-zero selector, and the
+    # connected components of the resulting gate/variable graph
+    gates_by_variable = [[] for _ in range(variable_count)]
+    components = _UnionFind(variable_count)
+    row_terms = [_row_terms(row) for row in rows]
+    tables = circuit.lookup_tables
+    row_lookups = [
+        _lookup_facts(tables[row[5] - 1].entries) if row[5] else None for row in rows
+    ]
+    for gate in range(gate_count):
+        wires = (w_l[gate], w_r[gate], w_o[gate])
+        if row_lookups[selector_ids[gate]] is not None:
+            variables = set(wires)
+        else:
+            q_m, _, row_linear = row_terms[selector_ids[gate]]
+            linear = _gate_linear_terms(row_linear, wires)
+            variables = set(linear)
+            if q_m:
+                variables.update((w_l[gate], w_r[gate]))
+        for variable in variables:
+            gates_by_variable[variable].append(gate)
+            components.union(variable, next(iter(variables)))
+
+    public_variables = set(public_variables)
+    determined = set(public_variables)
+    bounds = {}
+    bound_updates = {}
+    worklist = deque(range(gate_count))
+    queued = bytearray([1]) * gate_count
+
+    def mark_changed(variable):
+        for gate in gates_by_variable[variable]:
+            if not queued[gate]:
+                queued[gate] = 1
+                worklist.append(gate)
+
+    def determine(variable):
+        if variable not in determined:
+            determined.add(variable)
+            mark_changed(variable)
+
+    def restrict(variable, bound):
+        if bound >= Fr_modulus - 1:
+            return
+        if variable in bounds and bounds[variable] <= bound:
+            return
+        if bound_updates.get(variable, 0) >= MAX_BOUND_UPDATES:
+            return
+        bound_updates[variable] = bound_updates.get(variable, 0) + 1
+        bounds[variable] = bound
+        mark_changed(variable)
+
+    while worklist:
+        gate = worklist.popleft()
+        queued[gate] = 0
+        left, right = w_l[gate], w_r[gate]
+        lookup = row_lookups[selector_ids[gate]]
+        if lookup is not None:
+            wires = (left, right, w_o[gate])
+            column_bounds, functional = lookup
+            for variable, bound in zip(wires, column_bounds):
+                restrict(variable, bound)
+            for position in functional:
+                if all(
+                    variable in determined
+                    for variable in wires[:position] + wires[position + 1 :]
+                ):
+                    determine(wires[position])
+            continue
+        q_m, q_c, row_linear = row_terms[selector_ids[gate]]
+        linear = _gate_linear_terms(row_linear, (left, right, w_o[gate]))
+        quadratic = (left, right) if q_m else ()
+        unknown = {v for v in linear if v not in determined}
+        unknown.update(v for v in quadratic if v not in determined)
+        if not unknown:
+            continue
+
+        if len(unknown) == 1:
+            (variable,) = unknown
+            if variable not in quadratic:
+                determine(variable)
+                continue
+            if left == right:
+                # q_m*x^2 + q_l*x == 0 only has the roots 0 and -q_l/q_m
+                if len(linear) == 1 and not q_c and linear[variable] == -q_m:
+                    restrict(variable, 1)
+                continue
+            other = right if variable == left else left
+            # Coefficient q_m*other + linear: fixed and non-zero for boolean other
+            coefficient = linear.get(variable, 0)
+            if bounds.get(other) == 1 and coefficient and coefficient + q_m:
+                determine(variable)
+            continue
+
+        if q_m:
+            continue
+        _propagate_linear_bounds(linear, q_c, determined, bounds, restrict)
+        if len(unknown) == 2 and len(linear) == 3:
+            _propagate_decomposition(linear, q_c, unknown, bounds, determine)
+
+    # Components holding no public variable but some undetermined one can be
+    # satisfied independently of the statement being proven
+    public_roots = {components.find(variable) for variable in public_variables}
+    disconnected = set()
+    for variable, gates in enumerate(gates_by_variable):
+        if (
+            gates
+            and variable not in determined
+            and components.find(variable) not in public_roots
+        ):
+            disconnected.update(gates)
+
+    return CircuitAnalysis(
+        public_variables,
+        determined,
+        bounds,
+        [len(gates) for gates in gates_by_variable],
+        sorted(disconnected),
+    )
+
+
+def _propagate_linear_bounds(linear, q_c, determined, bounds, restrict):
+    # variable = sum(-c_i / c_v * v_i) - q_c / c_v for a unit coefficient c_v
+    for variable, coefficient in linear.items():
+        if coefficient not in (1, -1) or variable in determined:
+            continue
+        total = -q_c * coefficient
+        if total < 0:
+            continue
+        for other, other_coefficient in linear.items():
+            if other == variable:
+                continue
+            scaled = -other_coefficient * coefficient
+            if scaled < 0 or other not in bounds:
+                break
+            total += scaled * bounds[other]
+        else:
+            if total < Fr_modulus:
+                restrict(variable, total)
+
+
+def _propagate_decomposition(linear, q_c, unknown, bounds, determine):
+    # x = k*y + z with x known, 0 <= z < k and k*max(y) + max(z) < p
+    if q_c:
+        return
+    (known,) = set(linear) - unknown
+    if linear[known] not in (1, -1):
+        return
+    sign = linear[known]
+    first, second = unknown
+    for high, low in ((first, second), (second, first)):
+        scale = -linear[high] * sign
+        if -linear[low] * sign != 1 or scale <= 1:
+            continue
+        if high not in bounds or low not in bounds:
+            continue
+        if bounds[low] < scale and scale * bounds[high] + bounds[low] < Fr_modulus:
+            determine(high)
+            determine(low)
+            return
+
+
+class _UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self.parent[second] = first
+
+
+# -------------------- Tests --------------------
+import unittest
+
+
+class TestAnalyzeCircuit(unittest.TestCase):
+    def test_constrained_xor_determines_output(self):
+        from plonk_circuit import Fr, PlonkCircuitBuilder
+
+        circuit = PlonkCircuitBuilder()
+        left = circuit.add_variable(Fr(1))
+        right = circuit.add_variable(Fr(0))
+        output = circuit.add_variable(Fr(1))
+        for variable in (left, right):
+            circuit.create_boolean_gate(variable)
+        circuit.create_xor_gate(left, right, output)
+        analysis = analyze_circuit(circuit, [left, right])
+        self.assertIn(output, analysis.determined)
+        self.assertEqual(analysis.free_variables, [])
+
+    def test_limb_decomposition_is_unique(self):
+        from plonk_circuit import Fr, PlonkCircuitBuilder
+
+        circuit = PlonkCircuitBuilder()
+        value = circuit.add_variable(Fr(6))
+        high = circuit.add_variable(Fr(1))
+        low = circuit.add_variable(Fr(2))
+        low_bits = [circuit.add_variable(Fr(0)), circuit.add_variable(Fr(1))]
+        for bit in [high] + low_bits:
+            circuit.create_boolean_gate(bit)
+        # low = low_bits[0] + 2*low_bits[1], value = 4*high + low
+        circuit.create_generic_gate(
+            low_bits[0], low_bits[1], low, Fr(0), Fr(1), Fr(2), Fr(-1), Fr(0)
+        )
+        circuit.create_generic_gate(
+            value, high, low, Fr(0), Fr(1), Fr(-4), Fr(-1), Fr(0)
+        )
+        analysis = analyze_circuit(circuit, [value])
+        self.assertEqual(analysis.bounds[low], 3)
+        self.assertTrue({high, low}.issubset(analysis.determined))
+
+    def test_64_bit_xor_gadget_leaves_limbs_unchecked(self):
+        from plonk_circuit import Fr, PlonkCircuitBuilder
+
+        circuit = PlonkCircuitBuilder()
+        left = circuit.add_variable(Fr(0))
+        right = circuit.add_variable(Fr(0))
+        output = circuit.add_variable(Fr(0))
+        circuit.create_64_bit_xor_gate(left, right, output)
+        analysis = analyze_circuit(circuit, [left, right, output])
+        # The last accumulators are followed by three limbs and two 2-bit XORs
+        final_accumulators = {len(circuit.variables) - 18 + i for i in range(3)}
+        self.assertTrue(final_accumulators.isdisjoint(analysis.bounds))
+        self.assertTrue(final_accumulators.issubset(analysis.dangling_variables))
+        self.assertTrue(analysis.disconnected_gates)
+
+    def test_lookup_xor_gadget_is_fully_determined(self):
+        from plonk_circuit import Fr, PlonkCircuitBuilder
+
+        circuit = PlonkCircuitBuilder()
+        left = circuit.add_variable(Fr(0))
+        right = circuit.add_variable(Fr(0))
+        output = circuit.add_variable(Fr(0))
+        circuit.create_64_bit_xor_gate_lookup(left, right, output, chunk_bits=4)
+        analysis = analyze_circuit(circuit, [left, right])
+        self.assertEqual(analysis.free_variables, [])
+        self.assertIn(output, analysis.determined)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,357 @@
+"""
+Number-theoretic transforms over the alt_bn128 scalar field, and the PLONK
+polynomials of a circuit.
+
+Fr_modulus - 1 is divisible by 2^28, so the field has multiplicative
+subgroups of every power-of-two size up to 2^28. A Domain of size n is the
+subgroup generated by a primitive n-th root of unity omega; Domain.ntt()
+evaluates a polynomial of degree below n on it and Domain.intt()
+interpolates back, both in O(n log n) with an iterative radix-2
+Cooley-Tukey transform. Values are plain integers in [0, Fr_modulus).
+
+Every butterfly stage runs as list comprehensions over slices: stages with
+few twiddles loop over the twiddles and slice with a stride, the others
+loop over the blocks, so the interpreted loop never runs more than
+sqrt(n) times per stage. A domain keeps n/2 twiddles and an n-entry
+bit-reversal table of 32-bit indices, which for n = 2^20 is about 25 MiB.
+
+circuit_polynomials() pads the gate table to a domain and interpolates the
+selector columns, the wire value columns a, b, c and the three copy
+constraint (sigma) polynomials. Wire position i of column a, b, c is
+labelled omega^i, K1 * omega^i and K2 * omega^i; sigma maps each position
+to the next position of the same variable, so a witness satisfies the copy
+constraints exactly when the permutation grand product is one.
+
+Usage:
+    domain, polynomials = circuit_polynomials(circuit)
+    domain.coset_ntt(polynomials["q_m"])
+"""
+
+from array import array
+
+from plonk_circuit import Fr, Fr_modulus
+
+TWO_ADICITY = 28
+# A quadratic non-residue, so its (Fr_modulus - 1) / 2^28-th power has order
+# exactly 2^28; also the default coset shift
+MULTIPLICATIVE_GENERATOR = 5
+# Shifts of the b and c wire labels: H, K1*H and K2*H are disjoint cosets for
+# every domain H of size up to 2^TWO_ADICITY
+K1 = 2
+K2 = 3
+
+SELECTOR_NAMES = ("q_m", "q_l", "q_r", "q_o", "q_c", "q_lookup")
+WIRE_NAMES = ("a", "b", "c")
+SIGMA_NAMES = ("sigma_a", "sigma_b", "sigma_c")
+
+
+def _field_int(value):
+    return value.value if isinstance(value, Fr) else value % Fr_modulus
+
+
+def root_of_unity(size):
+    """Return a primitive size-th root of unity; size is a power of two."""
+    if size < 1 or size & (size - 1) or size > 1 << TWO_ADICITY:
+        raise ValueError(f"no root of unity of order {size}")
+    return pow(MULTIPLICATIVE_GENERATOR, (Fr_modulus - 1) // size, Fr_modulus)
+
+
+def evaluate_polynomial(coefficients, point):
+    """Evaluate a coefficient list at point with Horner's rule."""
+    result = 0
+    for coefficient in reversed(coefficients):
+        result = (result * point + coefficient) % Fr_modulus
+    return result
+
+
+def _powers(base, count, start=1):
+    powers = [0] * count
+    value = start
+    for i in range(count):
+        powers[i] = value
+        value = value * base % Fr_modulus
+    return powers
+
+
+class Domain:
+    """
+    Multiplicative subgroup of size n = 2^k used for the transforms.
+
+    Args:
+        size: Number of elements, a power of two up to 2^TWO_ADICITY.
+    """
+
+    def __init__(self, size):
+        self.omega = root_of_unity(size)
+        self.size = size
+        self.log_size = size.bit_length() - 1
+        self.size_inverse = pow(size, Fr_modulus - 2, Fr_modulus)
+        self._twiddles = None
+        self._bit_reversal = None
+
+    @classmethod
+    def for_gates(cls, gate_count):
+        """Smallest domain holding one row per gate."""
+        return cls(1 << max(gate_count - 1, 0).bit_length())
+
+    def elements(self):
+        """omega^0 .. omega^(n-1)."""
+        return _powers(self.omega, self.size)
+
+    def _tables(self):
+        if self._twiddles is None:
+            self._twiddles = _powers(self.omega, self.size // 2)
+            bits = self.log_size
+            reversal = array("I", [0]) * self.size
+            for i in range(1, self.size):
+                reversal[i] = (reversal[i >> 1] >> 1) | ((i & 1) << (bits - 1))
+            self._bit_reversal = reversal
+        return self._twiddles, self._bit_reversal
+
+    def _values(self, values):
+        if len(values) > self.size:
+            raise ValueError(f"{len(values)} values do not fit a domain of {self.size}")
+        values = [_field_int(value) for value in values]
+        values += [0] * (self.size - len(values))
+        return values
+
+    def _transform(self, values):
+        """Radix-2 decimation-in-time transform of a natural-order list."""
+        p = Fr_modulus
+        n = self.size
+        twiddles, reversal = self._tables()
+        values = [values[i] for i in reversal]
+        half = 1
+        while half < n:
+            span = 2 * half
+            stride = n // span
+            if half <= stride:
+                # Few twiddles, many blocks: one strided slice per twiddle
+                for j in range(half):
+                    twiddle = twiddles[j * stride]
+                    even = values[j::span]
+                    odd = values[j + half :: span]
+                    if j:
+                        odd = [x * twiddle % p for x in odd]
+                    values[j::span] = [(e + o) % p for e, o in zip(even, odd)]
+                    values[j + half :: span] = [(e - o) % p for e, o in zip(even, odd)]
+            else:
+                # Few blocks, many twiddles: one contiguous slice per block
+                stage_twiddles = twiddles[::stride]
+                for start in range(0, n, span):
+                    middle = start + half
+                    even = values[start:middle]
+                    odd = [
+                        x * twiddle % p
+                        for x, twiddle in zip(
+                            values[middle : start + span], stage_twiddles
+                        )
+                    ]
+                    values[start:middle] = [(e + o) % p for e, o in zip(even, odd)]
+                    values[middle : start + span] = [
+                        (e - o) % p for e, o in zip(even, odd)
+                    ]
+            half = span
+        return values
+
+    def ntt(self, coefficients):
+        """Evaluations at omega^0 .. omega^(n-1) of a polynomial of degree < n."""
+        return self._transform(self._values(coefficients))
+
+    def intt(self, evaluations):
+        """Coefficients of the polynomial taking these values on the domain."""
+        values = self._transform(self._values(evaluations))
+        # The inverse transform is the forward one at omega^-i, i.e. with the
+        # outputs 1 .. n-1 reversed, scaled by 1/n
+        values[1:] = values[:0:-1]
+        size_inverse = self.size_inverse
+        return [value * size_inverse % Fr_modulus for value in values]
+
+    def coset_ntt(self, coefficients, shift=MULTIPLICATIVE_GENERATOR):
+        """Evaluations at shift * omega^i, for quotients that vanish on H."""
+        values = self._values(coefficients)
+        values = [
+            value * power % Fr_modulus
+            for value, power in zip(values, _powers(shift, self.size))
+        ]
+        return self._transform(values)
+
+    def coset_intt(self, evaluations, shift=MULTIPLICATIVE_GENERATOR):
+        """Inverse of coset_ntt()."""
+        shift_inverse = pow(shift, Fr_modulus - 2, Fr_modulus)
+        return [
+            value * power % Fr_modulus
+            for value, power in zip(
+                self.intt(evaluations), _powers(shift_inverse, self.size)
+            )
+        ]
+
+    def batch_ntt(self, columns):
+        """ntt() of each column, sharing the twiddle tables."""
+        return [self.ntt(column) for column in columns]
+
+    def batch_intt(self, columns):
+        """intt() of each column, sharing the twiddle tables."""
+        return [self.intt(column) for column in columns]
+
+
+def circuit_columns(circuit, witness=None, domain=None):
+    """
+    Return {name: evaluations} for the selector and wire value columns of
+    circuit, padded with zero rows to the domain size.
+
+    Args:
+        circuit: A PlonkCircuitBuilder or CompiledCircuit.
+        witness: One value per variable, defaults to the builder's variables.
+        domain: Domain to pad to, defaults to Domain.for_gates().
+    """
+    if domain is None:
+        domain = Domain.for_gates(circuit.get_circuit_size())
+    if circuit.get_circuit_size() > domain.size:
+        raise ValueError(f"{circuit.get_circuit_size()} gates do not fit the domain")
+    if witness is None:
+        witness = circuit.variables
+    values = [_field_int(value) for value in witness]
+    padding = [0] * (domain.size - circuit.get_circuit_size())
+    rows = circuit.selector_rows
+    columns = {}
+    for position, name in enumerate(SELECTOR_NAMES):
+        by_id = [row[position] for row in rows]
+        columns[name] = [by_id[i] for i in circuit.selector_ids] + padding
+    for name, wires in zip(WIRE_NAMES, (circuit.w_l, circuit.w_r, circuit.w_o)):
+        columns[name] = [values[i] for i in wires] + padding
+    return columns
+
+
+def sigma_evaluations(circuit, domain=None, k1=K1, k2=K2):
+    """
+    Return the evaluations of sigma_a, sigma_b, sigma_c on the domain.
+
+    The wire positions of each variable form one cycle; padding rows map to
+    themselves.
+    """
+    if domain is None:
+        domain = Domain.for_gates(circuit.get_circuit_size())
+    n = domain.size
+    permutation = list(range(3 * n))
+    first = {}
+    previous = {}
+    for column, wires in enumerate((circuit.w_l, circuit.w_r, circuit.w_o)):
+        offset = column * n
+        for position, variable in enumerate(wires, offset):
+            last = previous.get(variable)
+            if last is None:
+                first[variable] = position
+            else:
+                permutation[last] = position
+            previous[variable] = position
+    for variable, last in previous.items():
+        permutation[last] = first[variable]
+    elements = domain.elements()
+    labels = (
+        elements
+        + [k1 * element % Fr_modulus for element in elements]
+        + [k2 * element % Fr_modulus for element in elements]
+    )
+    sigma = [labels[position] for position in permutation]
+    return [sigma[column * n : (column + 1) * n] for column in range(3)]
+
+
+def circuit_polynomials(circuit, witness=None, domain=None):
+    """
+    Interpolate every column of circuit and its sigma polynomials.
+
+    Returns (domain, {name: coefficients}) with the names in SELECTOR_NAMES,
+    WIRE_NAMES and SIGMA_NAMES.
+    """
+    if domain is None:
+        domain = Domain.for_gates(circuit.get_circuit_size())
+    columns = circuit_columns(circuit, witness, domain)
+    columns.update(zip(SIGMA_NAMES, sigma_evaluations(circuit, domain)))
+    names = list(columns)
+    coefficients = domain.batch_intt([columns[name] for name in names])
+    return domain, dict(zip(names, coefficients))
+
+
+def permutation_product(columns, sigmas, domain, beta, gamma, k1=K1, k2=K2):
+    """
+    Return the permutation grand product over all wire positions,
+
+        prod (w + beta * id + gamma) / (w + beta * sigma + gamma),
+
+    which is one exactly when (with high probability over beta and gamma)
+    the wire values in columns satisfy the copy constraints of sigmas.
+    """
+    numerators = []
+    denominators = []
+    elements = domain.elements()
+    for wire, shift, sigma in zip(WIRE_NAMES, (1, k1, k2), sigmas):
+        for value, element, target in zip(columns[wire], elements, sigma):
+            numerators.append(Fr(value + beta * shift * element + gamma))
+            denominators.append(Fr(value + beta * target + gamma))
+    return (Fr.product(numerators) * Fr.product(Fr.batch_invert(denominators))).value
+
+
+# -------------------- Tests --------------------
+import random
+import unittest
+
+from plonk_circuit import PlonkCircuitBuilder
+
+
+class TestNTT(unittest.TestCase):
+    def test_matches_naive_evaluation(self):
+        rng = random.Random(3)
+        for size in (1, 2, 8, 64, 256):
+            domain = Domain(size)
+            coefficients = [rng.randrange(Fr_modulus) for _ in range(size)]
+            evaluations = domain.ntt(coefficients)
+            for point, value in zip(domain.elements(), evaluations):
+                self.assertEqual(evaluate_polynomial(coefficients, point), value)
+            self.assertEqual(domain.intt(evaluations), coefficients)
+            shifted = domain.coset_ntt(coefficients)
+            for element, value in zip(domain.elements(), shifted):
+                point = MULTIPLICATIVE_GENERATOR * element % Fr_modulus
+                self.assertEqual(evaluate_polynomial(coefficients, point), value)
+            self.assertEqual(domain.coset_intt(shifted), coefficients)
+
+    def test_domain_sizes(self):
+        omega = root_of_unity(1 << TWO_ADICITY)
+        self.assertEqual(pow(omega, 1 << (TWO_ADICITY - 1), Fr_modulus), Fr_modulus - 1)
+        for size in (0, 3, 1 << (TWO_ADICITY + 1)):
+            with self.assertRaises(ValueError):
+                Domain(size)
+        self.assertEqual(Domain.for_gates(5).size, 8)
+        with self.assertRaises(ValueError):
+            Domain(4).ntt([1] * 5)
+
+
+class TestCircuitPolynomials(unittest.TestCase):
+    def test_sigma_encodes_copy_constraints(self):
+        circuit = PlonkCircuitBuilder()
+        indices = [circuit.add_variable(Fr(v)) for v in (12, 10, 6)]
+        circuit.create_64_bit_xor_gate(*indices)
+        domain, polynomials = circuit_polynomials(circuit)
+        columns = circuit_columns(circuit, domain=domain)
+        sigmas = domain.batch_ntt(polynomials[name] for name in SIGMA_NAMES)
+        self.assertEqual(
+            domain.batch_ntt(polynomials[name] for name in WIRE_NAMES),
+            [columns[name] for name in WIRE_NAMES],
+        )
+        rng = random.Random(9)
+        beta, gamma = rng.randrange(Fr_modulus), rng.randrange(Fr_modulus)
+        self.assertEqual(permutation_product(columns, sigmas, domain, beta, gamma), 1)
+        # Changing one copy of a variable used by several wires breaks the
+        # permutation argument even though every gate could still hold
+        wires = list(circuit.w_l) + list(circuit.w_r) + list(circuit.w_o)
+        position = next(
+            i for i, variable in enumerate(circuit.w_l) if wires.count(variable) > 1
+        )
+        columns["a"][position] += 1
+        self.assertNotEqual(
+            permutation_product(columns, sigmas, domain, beta, gamma), 1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,373 @@
+"""
+Multi-process circuit checking over shared memory.
+
+ParallelChecker copies the gate columns of a circuit once into a
+multiprocessing.shared_memory block and starts a process pool whose workers
+attach to it, so nothing but shard bounds and results is pickled per check.
+Each check writes the witness (32-byte big-endian values) into a second
+shared block, splits the gate range into shards and merges the failing
+gates the workers report. When a limit is given, the first worker that
+reaches it sets a shared event and the others stop at their next batch.
+
+Workers keep the witness decoded between checks. Every write that changes
+it starts a new generation, and the tasks carry a short log of the indices
+each recent generation rewrote, so a worker decodes only those again. It
+decodes the whole witness when it has fallen behind the log or when a
+generation rewrote too much of it to list.
+
+Usage:
+    with ParallelChecker(circuit, workers=8) as checker:
+        checker.check_circuit(witness)
+"""
+
+import collections
+import itertools
+import multiprocessing
+import operator
+import os
+from multiprocessing import shared_memory
+
+from plonk_circuit import (
+    CHECK_BATCH_SIZE,
+    FIELD_ELEMENT_BYTES,
+    Fr,
+    Fr_modulus,
+    PlonkCircuitBuilder,
+    _evaluate_gates,
+)
+
+# Shards per worker, so that workers finishing early pick up more work
+SHARDS_PER_WORKER = 4
+# Gates evaluated between two looks at the stop event
+SHARD_BATCH_SIZE = 1 << 14
+# Generations whose changed indices are sent along with every task
+CHANGE_LOG_LENGTH = 8
+# A generation that changes more than 1/FULL_DECODE_FRACTION of the witness
+# is logged as a full rewrite
+FULL_DECODE_FRACTION = 8
+# Witness values compared at once when looking for changed ones
+DIFF_SLICE = 1 << 12
+
+_worker = None
+
+
+class _WorkerState:
+    def __init__(
+        self,
+        columns_name,
+        gate_count,
+        variable_count,
+        selector_rows,
+        lookup_tables,
+        stop,
+    ):
+        # Workers share the parent's resource tracker, so attaching here
+        # does not make the blocks outlive or die with a worker
+        self.columns_memory = shared_memory.SharedMemory(name=columns_name)
+        self.words = self.columns_memory.buf.cast(PlonkCircuitBuilder.WIRE_TYPECODE)
+        self.selector_ids, self.w_l, self.w_r, self.w_o = (
+            self.words[i * gate_count : (i + 1) * gate_count] for i in range(4)
+        )
+        self.selector_rows = selector_rows
+        self.lookup_tables = lookup_tables
+        self.stop = stop
+        self.variable_count = variable_count
+        self.witness_memory = None
+        # Decoded witness values and the generation they were decoded at
+        self.values = None
+        self.generation = 0
+
+    def witness(self, name, generation, changes):
+        """
+        Return the witness values of generation, decoding only the indices
+        that the (generation, indices) entries in changes rewrote since the
+        last call where possible.
+        """
+        if self.witness_memory is None or self.witness_memory.name != name:
+            if self.witness_memory is not None:
+                self.witness_memory.close()
+            self.witness_memory = shared_memory.SharedMemory(name=name)
+            self.values = None
+        if self.values is not None and generation == self.generation:
+            return self.values
+        buf = self.witness_memory.buf
+        from_bytes = int.from_bytes
+        width = FIELD_ELEMENT_BYTES
+        pending = [indices for logged, indices in changes if logged > self.generation]
+        if (
+            self.values is None
+            # The log no longer reaches back to this worker's generation
+            or len(pending) != generation - self.generation
+            or None in pending
+        ):
+            self.values = [
+                from_bytes(buf[offset : offset + width], "big")
+                for offset in range(0, self.variable_count * width, width)
+            ]
+        else:
+            values = self.values
+            for indices in pending:
+                for index in indices:
+                    offset = index * width
+                    values[index] = from_bytes(buf[offset : offset + width], "big")
+        self.generation = generation
+        return self.values
+
+    def close(self):
+        for view in (self.selector_ids, self.w_l, self.w_r, self.w_o, self.words):
+            view.release()
+        self.columns_memory.close()
+        if self.witness_memory is not None:
+            self.witness_memory.close()
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _WorkerState(*args)
+
+
+def _check_shard(witness_name, generation, changes, start, stop, limit):
+    """Return the sorted failing gates in [start, stop), up to limit."""
+    state = _worker
+    values = state.witness(witness_name, generation, changes)
+    failing = []
+    for batch_start in range(start, stop, SHARD_BATCH_SIZE):
+        if state.stop.is_set():
+            break
+        batch_stop = min(batch_start + SHARD_BATCH_SIZE, stop)
+        batch_failing = _evaluate_gates(
+            state.selector_rows,
+            state.selector_ids,
+            state.w_l,
+            state.w_r,
+            state.w_o,
+            values,
+            range(batch_start, batch_stop),
+            state.lookup_tables,
+        )
+        batch_failing.sort()
+        failing += batch_failing
+        if limit is not None and len(failing) >= limit:
+            state.stop.set()
+            return failing[:limit]
+    return failing
+
+
+class ParallelChecker:
+    """
+    Check witnesses of one circuit with a pool of worker processes.
+
+    Args:
+        circuit: A PlonkCircuitBuilder or CompiledCircuit; its gates are
+                 copied, later changes to it are not seen.
+        workers: Number of processes, defaults to the CPU count.
+        mp_context: multiprocessing context, defaults to the platform's.
+    """
+
+    def __init__(self, circuit, workers=None, mp_context=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.gate_count = len(circuit.selector_ids)
+        self.variable_count = getattr(circuit, "variable_count", None)
+        if self.variable_count is None:
+            self.variable_count = len(circuit.variables)
+        self._context = mp_context or multiprocessing.get_context()
+        self._columns = shared_memory.SharedMemory(
+            create=True, size=max(1, 4 * self.gate_count * 4)
+        )
+        words = self._columns.buf.cast(PlonkCircuitBuilder.WIRE_TYPECODE)
+        for i, column in enumerate(
+            (circuit.selector_ids, circuit.w_l, circuit.w_r, circuit.w_o)
+        ):
+            words[i * self.gate_count : (i + 1) * self.gate_count] = column
+        words.release()
+        self._witness = shared_memory.SharedMemory(
+            create=True, size=max(1, self.variable_count * FIELD_ELEMENT_BYTES)
+        )
+        # The witness as last written, so that a check only re-encodes the
+        # variables that changed since the previous one
+        self._written = None
+        self._generation = 0
+        # (generation, changed indices or None for all) of recent writes
+        self._changes = collections.deque(maxlen=CHANGE_LOG_LENGTH)
+        self._stop = self._context.Event()
+        self._pool = self._context.Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(
+                self._columns.name,
+                self.gate_count,
+                self.variable_count,
+                tuple(circuit.selector_rows),
+                tuple(circuit.lookup_tables),
+                self._stop,
+            ),
+        )
+
+    def _write_witness(self, witness):
+        assert len(witness) == self.variable_count
+        witness = list(witness)
+        written = self._written
+        if written is None:
+            changed = range(self.variable_count)
+        else:
+            # Compare slices first: list comparison runs in C and is cheap
+            # while nothing in the slice changed
+            changed = []
+            for start in range(0, self.variable_count, DIFF_SLICE):
+                stop = start + DIFF_SLICE
+                if witness[start:stop] != written[start:stop]:
+                    changed += itertools.compress(
+                        range(start, stop),
+                        map(operator.ne, witness[start:stop], written[start:stop]),
+                    )
+            if not changed:
+                return
+        buf = self._witness.buf
+        for index in changed:
+            value = witness[index]
+            value = value.value if isinstance(value, Fr) else value % Fr_modulus
+            offset = index * FIELD_ELEMENT_BYTES
+            buf[offset : offset + FIELD_ELEMENT_BYTES] = value.to_bytes(
+                FIELD_ELEMENT_BYTES, "big"
+            )
+        self._written = witness
+        self._generation += 1
+        if len(changed) > self.variable_count // FULL_DECODE_FRACTION:
+            changed = None
+        self._changes.append((self._generation, changed))
+
+    def find_failing_gates(self, witness, limit=None, shard_size=None):
+        """
+        Return the indices of the gates that witness violates, sorted.
+
+        With a limit the workers stop once one of them has found that many,
+        so the result holds at most limit failing gates, which are not
+        necessarily the lowest ones.
+        """
+        self._write_witness(witness)
+        self._stop.clear()
+        if shard_size is None:
+            shards = self.workers * SHARDS_PER_WORKER
+            shard_size = max(CHECK_BATCH_SIZE, -(-self.gate_count // shards))
+        changes = tuple(self._changes)
+        tasks = [
+            (
+                self._witness.name,
+                self._generation,
+                changes,
+                start,
+                min(start + shard_size, self.gate_count),
+                limit,
+            )
+            for start in range(0, self.gate_count, shard_size)
+        ]
+        failing = []
+        for shard_failing in self._pool.starmap(_check_shard, tasks):
+            failing += shard_failing
+        if limit is not None:
+            failing = failing[:limit]
+        return failing
+
+    def check_circuit(self, witness):
+        return not self.find_failing_gates(witness, limit=1)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        for memory in (self._columns, self._witness):
+            memory.close()
+            memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def check_circuit_parallel(circuit, witness=None, workers=None):
+    """One-off parallel check; witness defaults to the builder's variables."""
+    if witness is None:
+        witness = circuit.variables
+    with ParallelChecker(circuit, workers) as checker:
+        return checker.check_circuit(witness)
+
+
+# -------------------- Tests --------------------
+import unittest
+
+
+class TestParallelChecker(unittest.TestCase):
+    def test_matches_serial_check(self):
+        circuit = PlonkCircuitBuilder()
+        indices = [circuit.add_variable(Fr(v)) for v in (12, 10, 6)]
+        circuit.create_64_bit_xor_gate(*indices)
+        circuit.create_64_bit_xor_gate_lookup(*indices, chunk_bits=4)
+        witness = [variable.value for variable in circuit.variables]
+        with ParallelChecker(circuit, workers=2) as checker:
+            self.assertTrue(checker.check_circuit(witness))
+            for variable in (indices[2], len(witness) - 1):
+                broken = list(witness)
+                broken[variable] += 1
+                circuit.replace_variables([Fr(value) for value in broken])
+                expected = circuit.find_failing_gates()
+                self.assertTrue(expected)
+                self.assertEqual(
+                    checker.find_failing_gates(broken, shard_size=16), expected
+                )
+                self.assertFalse(checker.check_circuit(broken))
+                self.assertEqual(
+                    len(checker.find_failing_gates(broken, limit=1, shard_size=16)), 1
+                )
+        self.assertFalse(check_circuit_parallel(circuit, workers=1))
+
+    def test_workers_follow_witness_changes(self):
+        circuit = PlonkCircuitBuilder()
+        indices = [circuit.add_variable(Fr(v)) for v in (12, 10, 6)]
+        circuit.create_64_bit_xor_gate(*indices)
+        witness = [variable.value for variable in circuit.variables]
+        with ParallelChecker(circuit, workers=1) as checker:
+            # A worker state in this process, so that the test decides when it
+            # catches up with the checker
+            state = _WorkerState(
+                checker._columns.name,
+                checker.gate_count,
+                checker.variable_count,
+                (),
+                (),
+                None,
+            )
+
+            def write_and_catch_up(*witnesses):
+                for candidate in witnesses:
+                    checker._write_witness(candidate)
+                changes = tuple(checker._changes)
+                return state.witness(
+                    checker._witness.name, checker._generation, changes
+                )
+
+            self.assertEqual(write_and_catch_up(witness), witness)
+            broken = list(witness)
+            broken[indices[2]] += 1
+            self.assertIs(write_and_catch_up(broken), state.values)
+            self.assertEqual(state.values, broken)
+            # Fall behind the change log
+            broken = [list(witness)]
+            for step in range(CHANGE_LOG_LENGTH + 1):
+                broken.append(list(broken[-1]))
+                broken[-1][step] += 1
+            self.assertEqual(write_and_catch_up(*broken), broken[-1])
+            shifted = [value + 1 for value in witness]
+            self.assertEqual(write_and_catch_up(shifted), shifted)
+            self.assertEqual(checker._changes[-1][1], None)
+            state.close()
+            for candidate in (shifted, witness, broken[-1]):
+                circuit.replace_variables([Fr(value) for value in candidate])
+                self.assertEqual(
+                    checker.find_failing_gates(candidate, shard_size=16),
+                    circuit.find_failing_gates(),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,27 +1,100 @@
+import functools
+import mmap
+import struct
+import sys
+import tracemalloc
+from array import array
+from collections import Counter, namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 Fr_modulus = 21888242871839275222246405745257275088548364400416034343698204186575808495617  # Modulus of the scalar field of alt_bn128
 
 
+FR_CONSTANT_RANGE = 64  # Fr(-64) .. Fr(64) are shared singletons
+
+_object_new = object.__new__
+
+
 class Fr:
-    def __init__(self, value):
+    """
+    Element of the alt_bn128 scalar field.
+
+    Instances are immutable, so small constants are cached and shared, and
+    arithmetic on already reduced operands only reduces when it has to.
+    """
+
+    __slots__ = ("value",)
+
+    def __new__(cls, value):
         if isinstance(value, Fr):
-            value = value.value
-        self.value = value % Fr_modulus
+            return value
+        if -FR_CONSTANT_RANGE <= value <= FR_CONSTANT_RANGE:
+            return _FR_CONSTANTS[value]
+        value %= Fr_modulus
+        if value <= FR_CONSTANT_RANGE:
+            return _FR_CONSTANTS[value]
+        if value >= Fr_modulus - FR_CONSTANT_RANGE:
+            return _FR_CONSTANTS[value - Fr_modulus]
+        element = _object_new(Fr)
+        element.value = value
+        return element
+
+    @staticmethod
+    def _from_reduced(value):
+        """Wrap a value already in [0, Fr_modulus) without reducing it."""
+        element = _object_new(Fr)
+        element.value = value
+        return element
+
+    def __reduce__(self):
+        return (Fr, (self.value,))
 
     def __add__(self, other):
-        return Fr(self.value + other.value)
+        value = self.value + other.value
+        if value >= Fr_modulus:
+            value -= Fr_modulus
+        element = _object_new(Fr)
+        element.value = value
+        return element
 
     def __mul__(self, other):
-        return Fr(self.value * other.value)
+        element = _object_new(Fr)
+        element.value = self.value * other.value % Fr_modulus
+        return element
 
     def __neg__(self):
-        return Fr(Fr_modulus - self.value)
+        if self.value == 0:
+            return self
+        element = _object_new(Fr)
+        element.value = Fr_modulus - self.value
+        return element
 
     def __sub__(self, other):
-        return self + (-other)
+        value = self.value - other.value
+        if value < 0:
+            value += Fr_modulus
+        element = _object_new(Fr)
+        element.value = value
+        return element
+
+    def mul_add(self, left, right):
+        """Return self + left * right with a single reduction."""
+        element = _object_new(Fr)
+        element.value = (self.value + left.value * right.value) % Fr_modulus
+        return element
 
     def __eq__(self, other):
+        if not isinstance(other, Fr):
+            return NotImplemented
         return self.value == other.value
 
+    def __hash__(self):
+        return hash(self.value)
+
     def __str__(self):
         return f"Fr({self.value})"
 
@@ -34,37 +107,630 @@ class Fr:
     def __truediv__(self, other):
         return self * other.invert()
 
-    def __neg__(self):
-        return Fr(Fr_modulus - self.value)
-
     def pow(self, power):
         power = power % (Fr_modulus - 1)
+        if power == 0:
+            return _FR_CONSTANTS[1]
+        if power == 1 or self.value <= 1:
+            return self
         return Fr(pow(self.value, power, Fr_modulus))
 
     def __repr__(self):
         return self.__str__()
 
+    @staticmethod
+    def batch_invert(elements):
+        """
+        Invert every element using Montgomery's trick: one modular inverse
+        plus 3(n-1) multiplications instead of one inverse per element.
+        Zero maps to zero, as with invert().
+        """
+        values = [element.value for element in elements]
+        prefix_products = []
+        accumulator = 1
+        for value in values:
+            prefix_products.append(accumulator)
+            if value:
+                accumulator = accumulator * value % Fr_modulus
+        # accumulator skips zeros, so it always has an inverse
+        inverse = pow(accumulator, -1, Fr_modulus)
+        inverses = [None] * len(values)
+        for index in range(len(values) - 1, -1, -1):
+            value = values[index]
+            if value:
+                inverses[index] = Fr._from_reduced(
+                    inverse * prefix_products[index] % Fr_modulus
+                )
+                inverse = inverse * value % Fr_modulus
+            else:
+                inverses[index] = _FR_CONSTANTS[0]
+        return inverses
+
+    @staticmethod
+    def batch_pow(elements, power):
+        """
+        Raise every element to the same power. A negative power first inverts
+        all elements with batch_invert(), so zero maps to zero as there.
+        """
+        if power < 0:
+            elements = Fr.batch_invert(elements)
+            power = -power
+        power = power % (Fr_modulus - 1)
+        if power == 1:
+            return list(elements)
+        return [Fr(pow(element.value, power, Fr_modulus)) for element in elements]
+
+    @staticmethod
+    def product(elements):
+        """Multiply all elements together, reducing once per multiplication."""
+        accumulator = 1
+        for element in elements:
+            accumulator = accumulator * element.value % Fr_modulus
+        return Fr(accumulator)
+
+    @staticmethod
+    def sum(elements):
+        """Add all elements together with a single final reduction."""
+        return Fr(sum(element.value for element in elements))
+
+
+_FR_CONSTANTS = {
+    constant: Fr._from_reduced(constant % Fr_modulus)
+    for constant in range(-FR_CONSTANT_RANGE, FR_CONSTANT_RANGE + 1)
+}
+
+
+class _DictBackedFr:
+    """Stand-in with the per-instance layout of an Fr without __slots__."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+def _dict_backed_fr_bytes(sample=1000):
+    """Measure the heap cost of one _DictBackedFr instance with tracemalloc."""
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [_DictBackedFr(0) for _ in range(sample)]
+    allocated = tracemalloc.get_traced_memory()[0] - before - sys.getsizeof(objects)
+    del objects
+    if not was_tracing:
+        tracemalloc.stop()
+    return allocated / sample
+
+
+class _SelectorColumn:
+    """
+    Read-only per-gate view of one selector, materialized as Fr on access.
+    """
+
+    def __init__(self, circuit, position):
+        self._circuit = circuit
+        self._position = position
+
+    def __len__(self):
+        return len(self._circuit.selector_ids)
+
+    def __getitem__(self, gate_index):
+        if isinstance(gate_index, slice):
+            return [self[i] for i in range(*gate_index.indices(len(self)))]
+        row = self._circuit.selector_rows[self._circuit.selector_ids[gate_index]]
+        return Fr(row[self._position])
+
+    def __iter__(self):
+        rows = self._circuit.selector_rows
+        position = self._position
+        for selector_id in self._circuit.selector_ids:
+            yield Fr(rows[selector_id][position])
+
+
+def _selector_int(selector):
+    if isinstance(selector, Fr):
+        return selector.value
+    return selector % Fr_modulus
+
+
+CHECK_BATCH_SIZE = 1 << 16
+PRINT_CHUNK_LINES = 4096
+
+# A selector row is (q_m, q_l, q_r, q_o, q_c, q_lookup). q_lookup is 0 for
+# arithmetic gates; a lookup gate has q_lookup = table id + 1, all other
+# selectors 0, and requires (a, b, c) to be an entry of that table.
+SELECTOR_COUNT = 6
+
+# Gate kinds recognized from their selector row
+GATE_PATTERNS = {
+    (2, Fr_modulus - 1, Fr_modulus - 1, 1, 0, 0): "XOR",
+    (1, Fr_modulus - 1, 0, 0, 0, 0): "BOOLEAN",
+}
+GENERIC_GATE = "generic"
+LOOKUP_GATE = "LOOKUP"
+
+# selectors: selector row ints, wires: (a, b, c) variable indices,
+# values: witness values of the wires or None
+GateRecord = namedtuple("GateRecord", "index kind selectors wires values")
+
+# entries: frozenset of (a, b, c) tuples of field ints, hashed for membership
+LookupTable = namedtuple("LookupTable", "name entries")
+
+# Binary circuit file format, see PlonkCircuitBuilder.save()
+CIRCUIT_FILE_MAGIC = b"PLNKCIRC"
+CIRCUIT_FILE_VERSION = 2
+# magic, version, big-endian columns, has witness, gate count, variable count,
+# selector row count, lookup table count, selector table / columns / witness /
+# lookup table offsets
+CIRCUIT_FILE_HEADER = struct.Struct("<8sHBBQQQQQQQQ")
+# name length, entry count and bytes per value of a lookup table; the UTF-8
+# name and the big-endian (a, b, c) entries follow
+LOOKUP_TABLE_HEADER = struct.Struct("<HQB")
+FIELD_ELEMENT_BYTES = 32
+WIRE_BYTES = 4
+SECTION_ALIGNMENT = 64
+
+
+# Witness-generation ops, see WitnessProgram
+OP_INPUT = 0  # argument: input slot
+OP_CONST = 1  # argument: index into WitnessProgram.constants
+OP_COPY = 2  # argument: source variable
+OP_SHIFT = 3  # arguments: source variable, right shift amount
+OP_MASK = 4  # arguments: source variable, bit mask (below 2^64)
+
+
+def _align(offset):
+    return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+def _gate_kind(row):
+    return LOOKUP_GATE if row[5] else GATE_PATTERNS.get(row, GENERIC_GATE)
+
+
+def xor_table(bits):
+    """Entries (a, b, a ^ b) for all a, b below 2^bits."""
+    size = 1 << bits
+    return [(a, b, a ^ b) for a in range(size) for b in range(size)]
+
+
+def range_table(bits):
+    """Entries (v, 0, 0) for all v below 2^bits."""
+    return [(value, 0, 0) for value in range(1 << bits)]
+
+
+def _signed(value):
+    """Return the representative of value in (-p/2, p/2]."""
+    return value - Fr_modulus if value > Fr_modulus // 2 else value
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_gate_evaluator(selector_row):
+    """
+    Return a function listing the gates of a group that violate
+    q_m*a*b + q_l*a + q_r*b + q_o*c + q_c == 0 for a fixed selector row.
+
+    The selectors are bound as small signed constants and the shape of the
+    row picks a comprehension without its zero terms: linear rows skip the
+    product and BOOLEAN-like rows (only q_m and q_l) skip b and c.
+    """
+    q_m, q_l, q_r, q_o, q_c = (_signed(selector) for selector in selector_row[:5])
+    p = Fr_modulus
+    if not (q_m or q_l or q_r or q_o or q_c):
+        return lambda gate_indices, values, w_l, w_r, w_o: []
+    if not q_m:
+
+        def evaluate(gate_indices, values, w_l, w_r, w_o):
+            return [
+                i
+                for i in gate_indices
+                if (
+                    q_l * values[w_l[i]]
+                    + q_r * values[w_r[i]]
+                    + q_o * values[w_o[i]]
+                    + q_c
+                )
+                % p
+            ]
+
+    elif not (q_r or q_o or q_c):
+
+        def evaluate(gate_indices, values, w_l, w_r, w_o):
+            return [
+                i
+                for i in gate_indices
+                if (q_m * values[w_r[i]] + q_l) * values[w_l[i]] % p
+            ]
+
+    else:
+
+        def evaluate(gate_indices, values, w_l, w_r, w_o):
+            return [
+                i
+                for i in gate_indices
+                if (
+                    (q_m * values[w_r[i]] + q_l) * values[w_l[i]]
+                    + q_r * values[w_r[i]]
+                    + q_o * values[w_o[i]]
+                    + q_c
+                )
+                % p
+            ]
+
+    return evaluate
+
+
+def _evaluate_gates(
+    selector_rows, selector_ids, w_l, w_r, w_o, values, gate_indices, lookup_tables=()
+):
+    """Return the unsorted subset of gate_indices that values does not satisfy."""
+    groups = {}
+    for gate_index in gate_indices:
+        selector_id = selector_ids[gate_index]
+        group = groups.get(selector_id)
+        if group is None:
+            groups[selector_id] = group = []
+        group.append(gate_index)
+    failing = []
+    for selector_id, group in groups.items():
+        row = selector_rows[selector_id]
+        if row[5]:
+            entries = lookup_tables[row[5] - 1].entries
+            failing += [
+                i
+                for i in group
+                if (values[w_l[i]], values[w_r[i]], values[w_o[i]]) not in entries
+            ]
+        else:
+            evaluate = _compile_gate_evaluator(row)
+            failing += evaluate(group, values, w_l, w_r, w_o)
+    return failing
+
+
+def _find_failing_gates(
+    selector_rows,
+    selector_ids,
+    w_l,
+    w_r,
+    w_o,
+    values,
+    start,
+    stop,
+    limit,
+    batch_size,
+    lookup_tables=(),
+):
+    failing = []
+    for batch_start in range(start, stop, batch_size):
+        batch_stop = min(batch_start + batch_size, stop)
+        batch_failing = _evaluate_gates(
+            selector_rows,
+            selector_ids,
+            w_l,
+            w_r,
+            w_o,
+            values,
+            range(batch_start, batch_stop),
+            lookup_tables,
+        )
+        batch_failing.sort()
+        failing += batch_failing
+        if limit is not None and len(failing) >= limit:
+            return failing[:limit]
+    return failing
+
+
+class WitnessProgram:
+    """
+    How every variable of a circuit is derived from the circuit inputs.
+
+    The builder records one op per variable as gadgets add them: a value
+    read from an input slot, a constant, or a copy, right shift or mask of
+    an earlier variable. replay() then computes whole witnesses for a batch
+    of inputs without building the circuit again.
+
+    Ops are stored as three packed arrays (op code and two arguments).
+    """
+
+    def __init__(self):
+        self.ops = array("B")
+        self.first_args = array("Q")
+        self.second_args = array("Q")
+        self.constants = []
+        self.input_count = 0
+
+    def __len__(self):
+        return len(self.ops)
+
+    def record(self, derivation=None):
+        """
+        Append the op of the next variable. derivation is None for a new
+        input, or a tuple (OP_CONST, value), (OP_COPY, source),
+        (OP_SHIFT, source, amount) or (OP_MASK, source, mask).
+        """
+        if derivation is None:
+            op, first, second = OP_INPUT, self.input_count, 0
+            self.input_count += 1
+        elif derivation[0] == OP_CONST:
+            op, first, second = OP_CONST, len(self.constants), 0
+            self.constants.append(derivation[1] % Fr_modulus)
+        else:
+            op, first, second = (tuple(derivation) + (0,))[:3]
+            assert first < len(self.ops)
+        self.ops.append(op)
+        self.first_args.append(first)
+        self.second_args.append(second)
+
+    def replay(self, inputs, vectorize=None):
+        """
+        Compute the witness of every input vector in a batch.
+
+        Args:
+            inputs: One column per input slot, each a sequence holding that
+                    input for every witness in the batch.
+            vectorize: Use numpy uint64 arrays (True), plain lists of ints
+                       (False), or numpy whenever it is installed and every
+                       input and constant fits in 64 bits (None).
+
+        Returns:
+            list of columns, one per variable, in the same form: the column
+            of variable i holds its value in every witness. Copied variables
+            share the column of their source.
+        """
+        assert len(inputs) == self.input_count
+        batch = len(inputs[0]) if inputs else 0
+        if vectorize is None:
+            vectorize = numpy is not None and all(
+                constant >> 64 == 0 for constant in self.constants
+            )
+        if vectorize:
+            try:
+                inputs = [
+                    numpy.asarray(column, dtype=numpy.uint64) for column in inputs
+                ]
+            except OverflowError:
+                vectorize = False
+        columns = []
+        for op, first, second in zip(self.ops, self.first_args, self.second_args):
+            if op == OP_INPUT:
+                column = inputs[first]
+            elif op == OP_CONST:
+                constant = self.constants[first]
+                if vectorize:
+                    column = numpy.full(batch, constant, dtype=numpy.uint64)
+                else:
+                    column = [constant] * batch
+            elif op == OP_COPY:
+                column = columns[first]
+            elif op == OP_SHIFT:
+                source = columns[first]
+                if vectorize:
+                    column = source >> numpy.uint64(second)
+                else:
+                    column = [value >> second for value in source]
+            elif op == OP_MASK:
+                source = columns[first]
+                if vectorize:
+                    column = source & numpy.uint64(second)
+                else:
+                    column = [value & second for value in source]
+            else:
+                raise ValueError(f"unknown witness op {op}")
+            columns.append(column)
+        return columns
+
+    @staticmethod
+    def iter_witnesses(columns):
+        """Yield the witnesses of replay() output one at a time, as int lists."""
+        if not columns:
+            return
+        rows = zip(*columns)
+        if numpy is not None and isinstance(columns[0], numpy.ndarray):
+            rows = (list(map(int, row)) for row in rows)
+        else:
+            rows = map(list, rows)
+        yield from rows
+
 
 class PlonkCircuitBuilder:
+    # Gates are stored column-wise: the wire indices live in packed unsigned
+    # 32-bit arrays and the five selectors of a gate are replaced by an index
+    # into a table of distinct selector rows (nearly every gate reuses one of
+    # a handful of rows).
+    WIRE_TYPECODE = "I"
+
     def __init__(self):
-        self.w_l = []
-        self.w_r = []
-        self.w_o = []
-        self.q_m = []
-        self.q_l = []
-        self.q_r = []
-        self.q_o = []
-        self.q_c = []
+        self.w_l = array(self.WIRE_TYPECODE)
+        self.w_r = array(self.WIRE_TYPECODE)
+        self.w_o = array(self.WIRE_TYPECODE)
+        self.selector_ids = array(self.WIRE_TYPECODE)
+        self.selector_rows = []  # distinct selector rows, tuples of SELECTOR_COUNT ints
+        self._selector_row_index = {}
+        self.lookup_tables = []  # LookupTable by table id
+        self._lookup_table_ids = {}
         self.variables = []
-        self.zero_index = self.add_variable(Fr(0))
+        # None for circuits loaded from a file, which carry no program
+        self.witness_program = WitnessProgram()
+        # Incremental checking state, created on the first set_variable() call
+        self._gates_by_variable = None
+        self._witness_values = None
+        self._failing_gate_set = None
+        self._dirty_gates = None
+        self.zero_index = self.add_variable(Fr(0), (OP_CONST, 0))
         self.create_fixed_witness_gate(self.zero_index, Fr(0))
 
+    @property
+    def q_m(self):
+        return _SelectorColumn(self, 0)
+
+    @property
+    def q_l(self):
+        return _SelectorColumn(self, 1)
+
+    @property
+    def q_r(self):
+        return _SelectorColumn(self, 2)
+
+    @property
+    def q_o(self):
+        return _SelectorColumn(self, 3)
+
+    @property
+    def q_c(self):
+        return _SelectorColumn(self, 4)
+
+    @property
+    def q_lookup(self):
+        return _SelectorColumn(self, 5)
+
     def get_circuit_size(self):
-        return len(self.q_m)
+        return len(self.selector_ids)
 
     def replace_variables(self, new_variables):
         assert len(new_variables) == len(self.variables)
         self.variables = new_variables
+        self._failing_gate_set = None
+
+    def _intern_selector_row(self, q_m, q_l, q_r, q_o, q_c, q_lookup=0):
+        row = (
+            _selector_int(q_m),
+            _selector_int(q_l),
+            _selector_int(q_r),
+            _selector_int(q_o),
+            _selector_int(q_c),
+            q_lookup,
+        )
+        selector_id = self._selector_row_index.get(row)
+        if selector_id is None:
+            selector_id = len(self.selector_rows)
+            self.selector_rows.append(row)
+            self._selector_row_index[row] = selector_id
+        return selector_id
+
+    def _append_gate(
+        self, left_index, right_index, output_index, q_m, q_l, q_r, q_o, q_c, q_lookup=0
+    ):
+        if type(self.selector_ids) is not array:
+            self._copy_mapped_columns()
+        self.selector_ids.append(
+            self._intern_selector_row(q_m, q_l, q_r, q_o, q_c, q_lookup)
+        )
+        self.w_l.append(left_index)
+        self.w_r.append(right_index)
+        self.w_o.append(output_index)
+        if self._gates_by_variable is not None:
+            gate_index = len(self.selector_ids) - 1
+            for variable_index in {left_index, right_index, output_index}:
+                self._gates_by_variable[variable_index].append(gate_index)
+            if self._failing_gate_set is not None:
+                self._dirty_gates.add(gate_index)
+
+    def _ensure_incremental_state(self):
+        if self._gates_by_variable is None:
+            self._gates_by_variable = [[] for _ in self.variables]
+            for gate_index, wires in enumerate(zip(self.w_l, self.w_r, self.w_o)):
+                for variable_index in set(wires):
+                    self._gates_by_variable[variable_index].append(gate_index)
+        if self._failing_gate_set is None:
+            self._witness_values = [variable.value for variable in self.variables]
+            self._failing_gate_set = set(
+                _find_failing_gates(
+                    self.selector_rows,
+                    self.selector_ids,
+                    self.w_l,
+                    self.w_r,
+                    self.w_o,
+                    self._witness_values,
+                    0,
+                    self.get_circuit_size(),
+                    None,
+                    CHECK_BATCH_SIZE,
+                    self.lookup_tables,
+                )
+            )
+            self._dirty_gates = set()
+
+    def set_variable(self, variable_index, value):
+        """
+        Change one witness value and mark the gates that use it for
+        check_circuit_incremental().
+
+        The first call indexes which gates use each variable and evaluates the
+        whole circuit once; afterwards each call only touches the gates of the
+        changed variable. Witness edits made by assigning to self.variables
+        directly are not tracked.
+        """
+        self._ensure_incremental_state()
+        value = Fr(value)
+        self.variables[variable_index] = value
+        self._witness_values[variable_index] = value.value
+        self._dirty_gates.update(self._gates_by_variable[variable_index])
+
+    def check_circuit_incremental(self):
+        """
+        Re-evaluate only the gates touched since the last call and return
+        whether the circuit is satisfied.
+        """
+        self._ensure_incremental_state()
+        if self._dirty_gates:
+            dirty_gates = self._dirty_gates
+            self._dirty_gates = set()
+            self._failing_gate_set.difference_update(dirty_gates)
+            self._failing_gate_set.update(
+                _evaluate_gates(
+                    self.selector_rows,
+                    self.selector_ids,
+                    self.w_l,
+                    self.w_r,
+                    self.w_o,
+                    self._witness_values,
+                    dirty_gates,
+                    self.lookup_tables,
+                )
+            )
+        return not self._failing_gate_set
+
+    def unsatisfied_gate_count(self):
+        """Number of failing gates as of the last check_circuit_incremental()."""
+        self._ensure_incremental_state()
+        return len(self._failing_gate_set)
+
+    def memory_usage(self):
+        """
+        Report the memory taken by the gate storage.
+
+        Returns a dict with the total bytes and bytes per gate of the columnar
+        layout, next to an estimate for the former layout of eight Python lists
+        holding one Fr object per selector.
+        """
+        gate_count = max(self.get_circuit_size(), 1)
+        columnar = sum(
+            sys.getsizeof(column)
+            for column in (self.w_l, self.w_r, self.w_o, self.selector_ids)
+        )
+        columnar += sys.getsizeof(self.selector_rows) + sys.getsizeof(
+            self._selector_row_index
+        )
+        for row in self.selector_rows:
+            columnar += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+
+        # Former layout: eight list slots per gate, a dict-backed Fr object for
+        # each of the five selectors and an int object for each wire index.
+        fr_bytes = _dict_backed_fr_bytes()
+        list_layout = 8 * sys.getsizeof([]) + 8 * 8 * self.get_circuit_size()
+        for selector_id, uses in Counter(self.selector_ids).items():
+            row = self.selector_rows[selector_id]
+            list_layout += uses * sum(
+                fr_bytes + (sys.getsizeof(v) if v > 256 else 0) for v in row[:5]
+            )
+        for column in (self.w_l, self.w_r, self.w_o):
+            list_layout += sum(sys.getsizeof(i) for i in column if i > 256)
+        return {
+            "gates": self.get_circuit_size(),
+            "selector_rows": len(self.selector_rows),
+            "columnar_bytes": columnar,
+            "columnar_bytes_per_gate": columnar / gate_count,
+            "list_layout_bytes": list_layout,
+            "list_layout_bytes_per_gate": list_layout / gate_count,
+        }
 
     def _format_fr_short(self, fr_value):
         """
@@ -81,41 +747,31 @@ class PlonkCircuitBuilder:
         neg_str = "-" + str(neg)
         return neg_str if len(neg_str) < len(pos_str) else pos_str
 
-    def add_variable(self, variable_value):
+    def add_variable(self, variable_value, derivation=None):
+        """
+        Add a variable and return its index. derivation records how its value
+        follows from earlier variables (see WitnessProgram.record()); without
+        one the variable is a new circuit input.
+        """
         self.variables.append(variable_value)
+        if self.witness_program is not None:
+            self.witness_program.record(derivation)
+        if self._gates_by_variable is not None:
+            self._gates_by_variable.append([])
+            if self._failing_gate_set is not None:
+                self._witness_values.append(variable_value.value)
         return len(self.variables) - 1
 
     def create_fixed_witness_gate(self, variable_index, witness_value):
-        self.q_m.append(Fr(0))
-        self.q_l.append(Fr(-1))
-        self.q_r.append(Fr(0))
-        self.q_o.append(Fr(0))
-        self.q_c.append(Fr(witness_value))
-        self.w_l.append(variable_index)
-        self.w_r.append(0)
-        self.w_o.append(0)
+        self._append_gate(variable_index, 0, 0, 0, -1, 0, 0, witness_value)
 
     def create_boolean_gate(self, variable_index):
-        self.q_m.append(Fr(1))
-        self.q_l.append(Fr(-1))
-        self.q_r.append(Fr(0))
-        self.q_o.append(Fr(0))
-        self.q_c.append(Fr(0))
-        self.w_l.append(variable_index)
-        self.w_r.append(variable_index)
-        self.w_o.append(0)
+        self._append_gate(variable_index, variable_index, 0, 1, -1, 0, 0, 0)
 
     def create_xor_gate(self, left_index, right_index, output_index):
         # Enforce: 2ab - a - b + c = 0  where c = a XOR b
         # The witnesses are expected to have been constrained to be 0 or 1 by the caller
-        self.q_m.append(Fr(2))
-        self.q_l.append(Fr(-1))
-        self.q_r.append(Fr(-1))
-        self.q_o.append(Fr(1))
-        self.q_c.append(Fr(0))
-        self.w_l.append(left_index)
-        self.w_r.append(right_index)
-        self.w_o.append(output_index)
+        self._append_gate(left_index, right_index, output_index, 2, -1, -1, 1, 0)
 
     def create_2bit_xor_gate(self, left_index, right_index, output_index):
         assert left_index < len(self.variables)
@@ -133,12 +789,22 @@ class PlonkCircuitBuilder:
         value_right_high = value_right >> 1
         value_output_low = value_output & 1
         value_output_high = value_output >> 1
-        left_low_index = self.add_variable(Fr(value_left_low))
-        left_high_index = self.add_variable(Fr(value_left_high))
-        right_low_index = self.add_variable(Fr(value_right_low))
-        right_high_index = self.add_variable(Fr(value_right_high))
-        output_low_index = self.add_variable(Fr(value_output_low))
-        output_high_index = self.add_variable(Fr(value_output_high))
+        left_low_index = self.add_variable(Fr(value_left_low), (OP_MASK, left_index, 1))
+        left_high_index = self.add_variable(
+            Fr(value_left_high), (OP_SHIFT, left_index, 1)
+        )
+        right_low_index = self.add_variable(
+            Fr(value_right_low), (OP_MASK, right_index, 1)
+        )
+        right_high_index = self.add_variable(
+            Fr(value_right_high), (OP_SHIFT, right_index, 1)
+        )
+        output_low_index = self.add_variable(
+            Fr(value_output_low), (OP_MASK, output_index, 1)
+        )
+        output_high_index = self.add_variable(
+            Fr(value_output_high), (OP_SHIFT, output_index, 1)
+        )
         self.create_xor_gate(left_low_index, right_low_index, output_low_index)
         self.create_xor_gate(left_high_index, right_high_index, output_high_index)
         self.create_boolean_gate(output_low_index)
@@ -151,14 +817,76 @@ class PlonkCircuitBuilder:
     def create_generic_gate(
         self, left_index, right_index, output_index, q_m, q_l, q_r, q_o, q_c
     ):
-        self.q_m.append(q_m)
-        self.q_l.append(q_l)
-        self.q_r.append(q_r)
-        self.q_o.append(q_o)
-        self.q_c.append(q_c)
-        self.w_l.append(left_index)
-        self.w_r.append(right_index)
-        self.w_o.append(output_index)
+        self._append_gate(
+            left_index, right_index, output_index, q_m, q_l, q_r, q_o, q_c
+        )
+
+    def register_table(self, name, entries):
+        """
+        Add a lookup table and return its id. entries are (a, b, c) triples;
+        registering a name again returns the existing table.
+        """
+        table_id = self._lookup_table_ids.get(name)
+        if table_id is None:
+            table_id = len(self.lookup_tables)
+            self.lookup_tables.append(
+                LookupTable(
+                    name,
+                    frozenset(
+                        tuple(value % Fr_modulus for value in entry)
+                        for entry in entries
+                    ),
+                )
+            )
+            self._lookup_table_ids[name] = table_id
+        return table_id
+
+    def create_lookup_gate(self, table_id, left_index, right_index, output_index):
+        # Enforce: (a, b, c) is an entry of the table
+        assert 0 <= table_id < len(self.lookup_tables)
+        self._append_gate(
+            left_index, right_index, output_index, 0, 0, 0, 0, 0, table_id + 1
+        )
+
+    def create_64_bit_xor_gate_lookup(
+        self, left_index, right_index, output_index, chunk_bits=8
+    ):
+        """
+        64-bit XOR built on a chunk_bits-bit XOR lookup table: each operand is
+        split into chunks with accumulator gates acc = 2^chunk_bits * next +
+        chunk, and each triple of chunks is one lookup gate, which also
+        range-checks the chunks. About 4 gates per chunk instead of the 11
+        per 2 bits of create_64_bit_xor_gate().
+        """
+        assert 64 % chunk_bits == 0
+        name = f"xor{chunk_bits}"
+        table_id = self._lookup_table_ids.get(name)
+        if table_id is None:
+            table_id = self.register_table(name, xor_table(chunk_bits))
+        mask = (1 << chunk_bits) - 1
+        scale = -(1 << chunk_bits)
+        current = [left_index, right_index, output_index]
+        for value in (self.variables[index].value for index in current):
+            assert value.bit_length() <= 64
+        for _ in range(64 // chunk_bits - 1):
+            chunks = []
+            for position, index in enumerate(current):
+                value = self.variables[index].value
+                next_index = self.add_variable(
+                    Fr(value >> chunk_bits), (OP_SHIFT, index, chunk_bits)
+                )
+                chunk_index = self.add_variable(
+                    Fr(value & mask), (OP_MASK, index, mask)
+                )
+                # acc - 2^chunk_bits * next - chunk == 0
+                self.create_generic_gate(
+                    index, next_index, chunk_index, 0, 1, scale, -1, 0
+                )
+                current[position] = next_index
+                chunks.append(chunk_index)
+            self.create_lookup_gate(table_id, *chunks)
+        # The last accumulators are single chunks
+        self.create_lookup_gate(table_id, *current)
 
     def create_64_bit_xor_gate(self, left_index, right_index, output_index):
         assert left_index < len(self.variables)
@@ -189,42 +917,54 @@ class PlonkCircuitBuilder:
             new_right_accumulator = current_right_accumulator >> 2
             new_output_accumulator = current_output_accumulator >> 2
             # Add variables to the circuit
-            new_left_accumulator_index = self.add_variable(Fr(new_left_accumulator))
-            new_right_accumulator_index = self.add_variable(Fr(new_right_accumulator))
-            new_output_accumulator_index = self.add_variable(Fr(new_output_accumulator))
-            low_bits_left_index = self.add_variable(Fr(current_left_bits))
-            low_bits_right_index = self.add_variable(Fr(current_right_bits))
-            low_bits_output_index = self.add_variable(Fr(current_output_bits))
+            new_left_accumulator_index = self.add_variable(
+                Fr(new_left_accumulator), (OP_SHIFT, current_left_index, 2)
+            )
+            new_right_accumulator_index = self.add_variable(
+                Fr(new_right_accumulator), (OP_SHIFT, current_right_index, 2)
+            )
+            new_output_accumulator_index = self.add_variable(
+                Fr(new_output_accumulator), (OP_SHIFT, current_output_index, 2)
+            )
+            low_bits_left_index = self.add_variable(
+                Fr(current_left_bits), (OP_MASK, current_left_index, 3)
+            )
+            low_bits_right_index = self.add_variable(
+                Fr(current_right_bits), (OP_MASK, current_right_index, 3)
+            )
+            low_bits_output_index = self.add_variable(
+                Fr(current_output_bits), (OP_MASK, current_output_index, 3)
+            )
             # Create accumulation gates
             self.create_generic_gate(
                 current_left_index,
                 new_left_accumulator_index,
                 low_bits_left_index,
-                Fr(0),
-                Fr(1),
-                Fr(-4),
-                Fr(-1),
-                Fr(0),
+                0,
+                1,
+                -4,
+                -1,
+                0,
             )  # current_accumulator_left - 4 * new_accumulator_left - low_bits_left == 0
             self.create_generic_gate(
                 current_right_index,
                 new_right_accumulator_index,
                 low_bits_right_index,
-                Fr(0),
-                Fr(1),
-                Fr(-4),
-                Fr(-1),
-                Fr(0),
+                0,
+                1,
+                -4,
+                -1,
+                0,
             )  # current_accumulator_right - 4 * new_accumulator_right - low_bits_right == 0
             self.create_generic_gate(
                 current_output_index,
                 new_output_accumulator_index,
                 low_bits_output_index,
-                Fr(0),
-                Fr(1),
-                Fr(-4),
-                Fr(-1),
-                Fr(0),
+                0,
+                1,
+                -4,
+                -1,
+                0,
             )  # current_accumulator_output - 4 * new_accumulator_output - low_bits_output == 0
             # Create a 2bit xor gate
             self.create_2bit_xor_gate(
@@ -242,136 +982,473 @@ class PlonkCircuitBuilder:
             current_left_index, current_right_index, current_output_index
         )
 
+    def find_failing_gates(self, limit=None, batch_size=CHECK_BATCH_SIZE):
+        """
+        Return the indices of the gates that the current witness violates.
+
+        Gates are evaluated in batches on raw integers: within a batch they are
+        grouped by selector row and each group runs through an evaluator
+        compiled for that row, so no field element objects are created.
+
+        Args:
+            limit (int): Stop after finding this many failing gates.
+            batch_size (int): Number of gates evaluated per batch.
+        """
+        values = [variable.value for variable in self.variables]
+        return _find_failing_gates(
+            self.selector_rows,
+            self.selector_ids,
+            self.w_l,
+            self.w_r,
+            self.w_o,
+            values,
+            0,
+            self.get_circuit_size(),
+            limit,
+            batch_size,
+            self.lookup_tables,
+        )
+
     def check_circuit(self):
-        circuit_size = len(self.q_m)
-        for i in range(circuit_size):
-            if (
-                self.q_m[i] * self.variables[self.w_l[i]] * self.variables[self.w_r[i]]
-                + self.q_l[i] * self.variables[self.w_l[i]]
-                + self.q_r[i] * self.variables[self.w_r[i]]
-                + self.q_o[i] * self.variables[self.w_o[i]]
-                + self.q_c[i]
-            ) != Fr(0):
-                return False
-        return True
+        return not self.find_failing_gates(limit=1)
 
     def get_variables(self):
         return self.variables
 
-    def print_gates(self, show_values=False):
+    def save(self, path, include_witness=True):
         """
-        Print all gates in the circuit in a readable form.
+        Write the circuit to path in the binary circuit format.
 
-        Each gate enforces: q_m*a*b + q_l*a + q_r*b + q_o*c + q_c == 0
+        Layout (all sections start on a 64-byte boundary):
+          header            CIRCUIT_FILE_HEADER
+          selector table    SELECTOR_COUNT x 32-byte big-endian integers per
+                            distinct row
+          gate columns      selector_ids, w_l, w_r, w_o as unsigned 32-bit
+                            integers in the byte order named by the header
+          witness           optional, one 32-byte big-endian value per variable
+          lookup tables     LOOKUP_TABLE_HEADER, name and sorted entries per
+                            table, in table id order
+        """
+        gate_count = self.get_circuit_size()
+        variable_count = len(self.variables)
+        row_bytes = SELECTOR_COUNT * FIELD_ELEMENT_BYTES
+        selector_offset = _align(CIRCUIT_FILE_HEADER.size)
+        columns_offset = _align(selector_offset + len(self.selector_rows) * row_bytes)
+        witness_offset = _align(columns_offset + 4 * gate_count * WIRE_BYTES)
+        tables_offset = witness_offset
+        if include_witness:
+            tables_offset = _align(
+                witness_offset + variable_count * FIELD_ELEMENT_BYTES
+            )
+        header = CIRCUIT_FILE_HEADER.pack(
+            CIRCUIT_FILE_MAGIC,
+            CIRCUIT_FILE_VERSION,
+            sys.byteorder == "big",
+            include_witness,
+            gate_count,
+            variable_count,
+            len(self.selector_rows),
+            len(self.lookup_tables),
+            selector_offset,
+            columns_offset,
+            witness_offset if include_witness else 0,
+            tables_offset,
+        )
+        with open(path, "wb") as file:
+            file.write(header)
+            file.write(bytes(selector_offset - file.tell()))
+            for row in self.selector_rows:
+                for selector in row:
+                    file.write(selector.to_bytes(FIELD_ELEMENT_BYTES, "big"))
+            file.write(bytes(columns_offset - file.tell()))
+            for column in (self.selector_ids, self.w_l, self.w_r, self.w_o):
+                file.write(memoryview(column).cast("B"))
+            if include_witness:
+                file.write(bytes(witness_offset - file.tell()))
+                for variable in self.variables:
+                    file.write(variable.value.to_bytes(FIELD_ELEMENT_BYTES, "big"))
+            file.write(bytes(tables_offset - file.tell()))
+            for table in self.lookup_tables:
+                name = table.name.encode()
+                largest = max((max(entry) for entry in table.entries), default=0)
+                width = max(1, -(-largest.bit_length() // 8))
+                file.write(
+                    LOOKUP_TABLE_HEADER.pack(len(name), len(table.entries), width)
+                )
+                file.write(name)
+                file.write(
+                    b"".join(
+                        value.to_bytes(width, "big")
+                        for entry in sorted(table.entries)
+                        for value in entry
+                    )
+                )
 
-        Args:
-            show_values (bool): If True, also prints the witness values for a, b, c.
-                                 Defaults to False to avoid leaking witness information.
+    @classmethod
+    def load(cls, path, load_witness=True):
+        """
+        Open a circuit written by save().
+
+        The file is memory-mapped and the gate columns are read-only views of
+        the mapping, so opening costs no copy and processes loading the same
+        file share its pages. The columns are copied into memory only if a
+        gate is added afterwards. Without a stored (or loaded) witness every
+        variable is zero.
+        """
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        (
+            magic,
+            version,
+            big_endian,
+            has_witness,
+            gate_count,
+            variable_count,
+            selector_row_count,
+            lookup_table_count,
+            selector_offset,
+            columns_offset,
+            witness_offset,
+            tables_offset,
+        ) = CIRCUIT_FILE_HEADER.unpack_from(view)
+        if magic != CIRCUIT_FILE_MAGIC or version != CIRCUIT_FILE_VERSION:
+            raise ValueError(f"{path} is not a version {CIRCUIT_FILE_VERSION} circuit")
+
+        circuit = cls()
+        row_bytes = SELECTOR_COUNT * FIELD_ELEMENT_BYTES
+        circuit.selector_rows = [
+            tuple(
+                int.from_bytes(view[start : start + FIELD_ELEMENT_BYTES], "big")
+                for start in range(
+                    row_offset, row_offset + row_bytes, FIELD_ELEMENT_BYTES
+                )
+            )
+            for row_offset in range(
+                selector_offset,
+                selector_offset + selector_row_count * row_bytes,
+                row_bytes,
+            )
+        ]
+        circuit._selector_row_index = {
+            row: selector_id for selector_id, row in enumerate(circuit.selector_rows)
+        }
+        columns = []
+        column_bytes = gate_count * WIRE_BYTES
+        for index in range(4):
+            start = columns_offset + index * column_bytes
+            column = view[start : start + column_bytes].cast(cls.WIRE_TYPECODE)
+            if big_endian != (sys.byteorder == "big"):
+                column = array(cls.WIRE_TYPECODE, column)
+                column.byteswap()
+            columns.append(column)
+        circuit.selector_ids, circuit.w_l, circuit.w_r, circuit.w_o = columns
+        if has_witness and load_witness:
+            circuit.variables = [
+                Fr(int.from_bytes(view[start : start + FIELD_ELEMENT_BYTES], "big"))
+                for start in range(
+                    witness_offset,
+                    witness_offset + variable_count * FIELD_ELEMENT_BYTES,
+                    FIELD_ELEMENT_BYTES,
+                )
+            ]
+        else:
+            circuit.variables = [Fr(0)] * variable_count
+        circuit.lookup_tables = []
+        offset = tables_offset
+        for _ in range(lookup_table_count):
+            name_length, entry_count, width = LOOKUP_TABLE_HEADER.unpack_from(
+                view, offset
+            )
+            offset += LOOKUP_TABLE_HEADER.size
+            name = bytes(view[offset : offset + name_length]).decode()
+            offset += name_length
+            values = [
+                int.from_bytes(view[start : start + width], "big")
+                for start in range(offset, offset + 3 * entry_count * width, width)
+            ]
+            offset += 3 * entry_count * width
+            circuit.lookup_tables.append(
+                LookupTable(name, frozenset(zip(*[iter(values)] * 3)))
+            )
+        circuit._lookup_table_ids = {
+            table.name: table_id for table_id, table in enumerate(circuit.lookup_tables)
+        }
+        circuit.witness_program = None
+        circuit._mapping = mapping
+        return circuit
+
+    def _copy_mapped_columns(self):
+        self.selector_ids, self.w_l, self.w_r, self.w_o = (
+            array(self.WIRE_TYPECODE, column)
+            for column in (self.selector_ids, self.w_l, self.w_r, self.w_o)
+        )
+
+    def freeze(self):
+        """
+        Return an immutable CompiledCircuit with a copy of the current gates
+        and variable count, which can be shared between threads.
+        """
+        return CompiledCircuit(
+            self.selector_rows,
+            self.selector_ids,
+            self.w_l,
+            self.w_r,
+            self.w_o,
+            len(self.variables),
+            self.lookup_tables,
+        )
+
+    def _gate_templates(self):
         """
-        gate_count = len(self.q_m)
-        for gate_index in range(gate_count):
-            left_witness_index = self.w_l[gate_index]
-            right_witness_index = self.w_r[gate_index]
-            output_witness_index = self.w_o[gate_index]
-
-            qm_fr = self.q_m[gate_index]
-            ql_fr = self.q_l[gate_index]
-            qr_fr = self.q_r[gate_index]
-            qo_fr = self.q_o[gate_index]
-            qc_fr = self.q_c[gate_index]
-
-            qm_s = self._format_fr_short(qm_fr)
-            ql_s = self._format_fr_short(ql_fr)
-            qr_s = self._format_fr_short(qr_fr)
-            qo_s = self._format_fr_short(qo_fr)
-            qc_s = self._format_fr_short(qc_fr)
-
-            # Build human-readable constraint expression with omitted zero selectors
-            def add_term(coeff_str, body_str, is_first):
+        Build, once per distinct selector row, a format string rendering the
+        constraint of any gate using that row from its wire indices.
+        """
+        templates = []
+        for row in self.selector_rows:
+            if row[5]:
+                name = self.lookup_tables[row[5] - 1].name
+                name = name.replace("{", "{{").replace("}", "}}")
+                templates.append(
+                    f"(w[{{0}}], w[{{1}}], w[{{2}}]) in {name}  # {LOOKUP_GATE} gate"
+                )
+                continue
+            terms = []
+            for selector, body in zip(
+                row[:5], ("w[{0}]*w[{1}]", "w[{0}]", "w[{1}]", "w[{2}]", "")
+            ):
+                coeff_str = self._format_fr_short(selector)
                 if coeff_str == "0":
-                    return "", is_first
+                    continue
                 is_negative = coeff_str.startswith("-")
                 magnitude = coeff_str[1:] if is_negative else coeff_str
-                if is_first:
-                    prefix = "-" if is_negative else ""
-                else:
+                if terms:
                     prefix = " - " if is_negative else " + "
-                if body_str:
+                else:
+                    prefix = "-" if is_negative else ""
+                if body:
                     # Omit the explicit coefficient when it is 1 for cleaner output
-                    term = body_str if magnitude == "1" else f"{magnitude}*{body_str}"
+                    term = body if magnitude == "1" else f"{magnitude}*{body}"
                 else:
                     term = magnitude
-                return prefix + term, False
+                terms.append(prefix + term)
+            kind = GATE_PATTERNS.get(row)
+            comment = f"  # {kind} gate" if kind else ""
+            templates.append("".join(terms or ["0"]) + " == 0" + comment)
+        return templates
 
-            expr = ""
-            first = True
-            term, first = add_term(
-                qm_s, f"w[{left_witness_index}]*w[{right_witness_index}]", first
-            )
-            expr += term
-            term, first = add_term(ql_s, f"w[{left_witness_index}]", first)
-            expr += term
-            term, first = add_term(qr_s, f"w[{right_witness_index}]", first)
-            expr += term
-            term, first = add_term(qo_s, f"w[{output_witness_index}]", first)
-            expr += term
-            term, first = add_term(qc_s, "", first)
-            expr += term
-            if expr == "":
-                expr = "0"
-
-            line = f"gate {gate_index}: {expr} == 0"
-
-            # Detect known gate patterns
-            if (
-                qm_fr == Fr(2)
-                and ql_fr == Fr(-1)
-                and qr_fr == Fr(-1)
-                and qo_fr == Fr(1)
-                and qc_fr == Fr(0)
-            ):
-                line += "  # XOR gate"
-            elif (
-                qm_fr == Fr(1)
-                and ql_fr == Fr(-1)
-                and qr_fr == Fr(0)
-                and qo_fr == Fr(0)
-                and qc_fr == Fr(0)
-            ):
-                line += "  # BOOLEAN gate"
+    def iter_gates(self, show_values=False):
+        """
+        Yield a GateRecord for every gate in the circuit.
 
+        Args:
+            show_values (bool): If True, records carry the witness values for
+                                 a, b, c (None for out-of-range indices).
+        """
+        rows = self.selector_rows
+        kinds = [_gate_kind(row) for row in rows]
+        variables = self.variables
+        variable_count = len(variables)
+        no_values = (None, None, None)
+        for gate_index, (selector_id, left, right, output) in enumerate(
+            zip(self.selector_ids, self.w_l, self.w_r, self.w_o)
+        ):
             if show_values:
-                left_fr = (
-                    self.variables[left_witness_index]
-                    if left_witness_index < len(self.variables)
-                    else None
-                )
-                right_fr = (
-                    self.variables[right_witness_index]
-                    if right_witness_index < len(self.variables)
-                    else None
-                )
-                output_fr = (
-                    self.variables[output_witness_index]
-                    if output_witness_index < len(self.variables)
-                    else None
-                )
-                line += (
-                    " | a="
-                    + self._format_fr_short(left_fr)
-                    + ", b="
-                    + self._format_fr_short(right_fr)
-                    + ", c="
-                    + self._format_fr_short(output_fr)
+                values = tuple(
+                    variables[index] if index < variable_count else None
+                    for index in (left, right, output)
                 )
+            else:
+                values = no_values
+            yield GateRecord(
+                gate_index,
+                kinds[selector_id],
+                rows[selector_id],
+                (left, right, output),
+                values,
+            )
+
+    def write_gates(self, file=None, show_values=False, chunk_lines=PRINT_CHUNK_LINES):
+        """
+        Stream the readable form of all gates to a file object.
+
+        Lines are joined and written chunk_lines at a time; constraint text is
+        prepared once per selector row and witness values are formatted once
+        per variable.
 
-            print(line)
+        Args:
+            file: Text file object, defaults to sys.stdout.
+            show_values (bool): If True, also writes the witness values.
+            chunk_lines (int): Number of lines per write() call.
+        """
+        if file is None:
+            file = sys.stdout
+        templates = self._gate_templates()
+        selector_ids = self.selector_ids
+        formatted_values = {}
+        chunk = []
+        for gate_index, _, _, wires, values in self.iter_gates(show_values):
+            line = f"gate {gate_index}: " + templates[selector_ids[gate_index]]
+            line = line.format(*wires)
+            if show_values:
+                parts = []
+                for index, value in zip(wires, values):
+                    text = formatted_values.get(index)
+                    if text is None:
+                        text = formatted_values[index] = self._format_fr_short(value)
+                    parts.append(text)
+                line += " | a={}, b={}, c={}".format(*parts)
+            chunk.append(line)
+            if len(chunk) >= chunk_lines:
+                chunk.append("")
+                file.write("\n".join(chunk))
+                chunk = []
+        if chunk:
+            chunk.append("")
+            file.write("\n".join(chunk))
+
+    def gate_histogram(self):
+        """
+        Return a Counter of gate kinds ("XOR", "BOOLEAN", "LOOKUP" or
+        "generic") without rendering any gate.
+        """
+        histogram = Counter()
+        for selector_id, count in Counter(self.selector_ids).items():
+            histogram[_gate_kind(self.selector_rows[selector_id])] += count
+        return histogram
+
+    def print_gates(self, show_values=False, file=None):
+        """
+        Print all gates in the circuit in a readable form.
+
+        Arithmetic gates enforce: q_m*a*b + q_l*a + q_r*b + q_o*c + q_c == 0,
+        lookup gates that (a, b, c) is an entry of their table.
+
+        Args:
+            show_values (bool): If True, also prints the witness values for a, b, c.
+                                 Defaults to False to avoid leaking witness information.
+            file: Text file object, defaults to sys.stdout.
+        """
+        self.write_gates(file, show_values)
+
+
+class CompiledCircuit:
+    """
+    Read-only gate table of a finished circuit.
+
+    Holds the selector table, the wiring columns, the lookup tables and the
+    number of variables but no witness, so a single instance can be built once and checked
+    against many witnesses concurrently. Witnesses are plain sequences of
+    integers (or Fr) with one entry per variable.
+    """
+
+    def __init__(
+        self,
+        selector_rows,
+        selector_ids,
+        w_l,
+        w_r,
+        w_o,
+        variable_count,
+        lookup_tables=(),
+    ):
+        self.selector_rows = tuple(selector_rows)
+        self.lookup_tables = tuple(lookup_tables)
+        self.selector_ids = _readonly_column(selector_ids)
+        self.w_l = _readonly_column(w_l)
+        self.w_r = _readonly_column(w_r)
+        self.w_o = _readonly_column(w_o)
+        self.variable_count = variable_count
+
+    def get_circuit_size(self):
+        return len(self.selector_ids)
+
+    def find_failing_gates(self, witness, limit=None, batch_size=CHECK_BATCH_SIZE):
+        """Return the indices of the gates that witness violates."""
+        assert len(witness) == self.variable_count
+        values = [
+            value.value if isinstance(value, Fr) else value % Fr_modulus
+            for value in witness
+        ]
+        return _find_failing_gates(
+            self.selector_rows,
+            self.selector_ids,
+            self.w_l,
+            self.w_r,
+            self.w_o,
+            values,
+            0,
+            self.get_circuit_size(),
+            limit,
+            batch_size,
+            self.lookup_tables,
+        )
+
+    def check_circuit(self, witness):
+        return not self.find_failing_gates(witness, limit=1)
+
+
+def _readonly_column(column):
+    if isinstance(column, memoryview) and column.readonly:
+        # Already immutable, e.g. a column of a memory-mapped circuit file
+        return column
+    return memoryview(array(PlonkCircuitBuilder.WIRE_TYPECODE, column)).toreadonly()
 
 
 # -------------------- Tests --------------------
+import contextlib
+import io
 import unittest
 
 
+class TestFr(unittest.TestCase):
+    def test_arithmetic_matches_modular_integers(self):
+        import random
+
+        for _ in range(200):
+            a = random.choice([0, 1, Fr_modulus - 1, random.randrange(Fr_modulus)])
+            b = random.choice([0, 1, Fr_modulus - 1, random.randrange(Fr_modulus)])
+            self.assertEqual((Fr(a) + Fr(b)).value, (a + b) % Fr_modulus)
+            self.assertEqual((Fr(a) - Fr(b)).value, (a - b) % Fr_modulus)
+            self.assertEqual((Fr(a) * Fr(b)).value, a * b % Fr_modulus)
+            self.assertEqual((-Fr(a)).value, -a % Fr_modulus)
+            self.assertEqual(
+                Fr(a).mul_add(Fr(b), Fr(b)).value, (a + b * b) % Fr_modulus
+            )
+            if a:
+                self.assertEqual(Fr(a) * Fr(a).invert(), Fr(1))
+
+    def test_batch_helpers_match_single_element_operations(self):
+        import random
+
+        elements = [Fr(random.randrange(Fr_modulus)) for _ in range(20)]
+        elements[3] = Fr(0)
+        inverses = Fr.batch_invert(elements)
+        self.assertEqual(inverses, [element.invert() for element in elements])
+        self.assertEqual(Fr.batch_invert([]), [])
+        self.assertEqual(
+            Fr.batch_pow(elements, 5), [element.pow(5) for element in elements]
+        )
+        self.assertEqual(
+            Fr.batch_pow(elements, -3),
+            [element.invert().pow(3) for element in elements],
+        )
+        self.assertEqual(Fr.batch_pow(elements, -1), inverses)
+        expected_product = Fr(1)
+        expected_sum = Fr(0)
+        for element in elements:
+            expected_product = expected_product * element
+            expected_sum = expected_sum + element
+        self.assertEqual(Fr.product(elements), expected_product)
+        self.assertEqual(Fr.sum(elements), expected_sum)
+
+    def test_small_constants_are_shared_and_hashable(self):
+        self.assertIs(Fr(-1), Fr(Fr_modulus - 1))
+        self.assertIs(Fr(Fr_modulus + 3), Fr(3))
+        self.assertEqual({Fr(12345): "x"}[Fr(12345)], "x")
+        self.assertEqual(Fr(0).pow(0), Fr(1))
+
+
 class TestCircuitInitialization(unittest.TestCase):
     def test_check_circuit_on_fresh_circuit(self):
         circuit = PlonkCircuitBuilder()
@@ -388,10 +1465,270 @@ class TestCircuitInitialization(unittest.TestCase):
         right_index = circuit.add_variable(Fr(right_value))
         output_index = circuit.add_variable(Fr(output_value))
         circuit.create_64_bit_xor_gate(left_index, right_index, output_index)
-        circuit.print_gates(show_values=True)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            circuit.print_gates(show_values=True)
+        self.assertIn("gate 0:", output.getvalue())
         self.assertTrue(circuit.check_circuit())
         self.assertEqual(circuit.variables[output_index].value, output_value)
 
 
+class TestGatePrinter(unittest.TestCase):
+    def test_records_histogram_and_chunked_output(self):
+        circuit = PlonkCircuitBuilder()
+        left = circuit.add_variable(Fr(1))
+        right = circuit.add_variable(Fr(0))
+        output = circuit.add_variable(Fr(1))
+        circuit.create_boolean_gate(left)
+        circuit.create_xor_gate(left, right, output)
+        records = list(circuit.iter_gates(show_values=True))
+        self.assertEqual(records[2].kind, "XOR")
+        self.assertEqual(records[2].wires, (left, right, output))
+        self.assertEqual(records[2].values, (Fr(1), Fr(0), Fr(1)))
+        self.assertEqual(
+            circuit.gate_histogram(), {"generic": 1, "BOOLEAN": 1, "XOR": 1}
+        )
+
+        chunked = io.StringIO()
+        circuit.write_gates(chunked, show_values=True, chunk_lines=2)
+        self.assertEqual(
+            chunked.getvalue().splitlines()[2],
+            "gate 2: 2*w[1]*w[2] - w[1] - w[2] + w[3] == 0  # XOR gate | a=1, b=0, c=1",
+        )
+        whole = io.StringIO()
+        circuit.print_gates(show_values=True, file=whole)
+        self.assertEqual(chunked.getvalue(), whole.getvalue())
+
+
+class TestColumnarGateStore(unittest.TestCase):
+    def test_selector_rows_are_deduplicated(self):
+        circuit = PlonkCircuitBuilder()
+        left_index = circuit.add_variable(Fr(0))
+        right_index = circuit.add_variable(Fr(0))
+        output_index = circuit.add_variable(Fr(0))
+        circuit.create_64_bit_xor_gate(left_index, right_index, output_index)
+        # fixed witness, accumulator, XOR and BOOLEAN rows
+        self.assertEqual(len(circuit.selector_rows), 4)
+        self.assertEqual(len(circuit.q_m), circuit.get_circuit_size())
+        self.assertEqual(circuit.q_l[1], Fr(1))
+        self.assertEqual(circuit.q_r[1], Fr(-4))
+
+    def test_memory_usage_beats_list_layout(self):
+        circuit = PlonkCircuitBuilder()
+        for _ in range(100):
+            circuit.create_boolean_gate(circuit.add_variable(Fr(1)))
+        usage = circuit.memory_usage()
+        self.assertEqual(usage["gates"], 101)
+        self.assertLess(
+            usage["columnar_bytes_per_gate"], usage["list_layout_bytes_per_gate"]
+        )
+
+
+class TestFindFailingGates(unittest.TestCase):
+    def test_reports_every_unsatisfied_gate(self):
+        circuit = PlonkCircuitBuilder()
+        bits = [circuit.add_variable(Fr(i % 2)) for i in range(10)]
+        for bit in bits:
+            circuit.create_boolean_gate(bit)
+        self.assertEqual(circuit.find_failing_gates(), [])
+        circuit.variables[bits[2]] = Fr(2)
+        circuit.variables[bits[7]] = Fr(-1)
+        self.assertEqual(circuit.find_failing_gates(batch_size=4), [3, 8])
+        self.assertEqual(circuit.find_failing_gates(limit=1), [3])
+        self.assertFalse(circuit.check_circuit())
+
+    def test_generic_gate_with_constant(self):
+        circuit = PlonkCircuitBuilder()
+        x = circuit.add_variable(Fr(3))
+        y = circuit.add_variable(Fr(4))
+        z = circuit.add_variable(Fr(19))
+        # x*y + 2*x - y - z + 5 == 0
+        circuit.create_generic_gate(x, y, z, Fr(1), Fr(2), Fr(-1), Fr(-1), Fr(5))
+        self.assertTrue(circuit.check_circuit())
+        circuit.variables[z] = Fr(20)
+        self.assertEqual(circuit.find_failing_gates(), [1])
+
+
+class TestIncrementalCheck(unittest.TestCase):
+    def test_set_variable_rechecks_only_affected_gates(self):
+        circuit = PlonkCircuitBuilder()
+        left_index = circuit.add_variable(Fr(5))
+        right_index = circuit.add_variable(Fr(9))
+        output_index = circuit.add_variable(Fr(5 ^ 9))
+        circuit.create_64_bit_xor_gate(left_index, right_index, output_index)
+        self.assertTrue(circuit.check_circuit_incremental())
+        circuit.set_variable(output_index, 7)
+        self.assertFalse(circuit.check_circuit_incremental())
+        self.assertEqual(circuit.unsatisfied_gate_count(), 1)
+        self.assertEqual(
+            circuit.unsatisfied_gate_count(), len(circuit.find_failing_gates())
+        )
+        circuit.set_variable(output_index, 5 ^ 9)
+        self.assertTrue(circuit.check_circuit_incremental())
+
+    def test_gates_added_after_first_edit_are_tracked(self):
+        circuit = PlonkCircuitBuilder()
+        bit = circuit.add_variable(Fr(1))
+        circuit.set_variable(bit, 1)
+        circuit.create_boolean_gate(bit)
+        other = circuit.add_variable(Fr(3))
+        circuit.create_boolean_gate(other)
+        self.assertFalse(circuit.check_circuit_incremental())
+        circuit.set_variable(other, 0)
+        self.assertTrue(circuit.check_circuit_incremental())
+        circuit.replace_variables([Fr(0), Fr(2), Fr(0)])
+        self.assertFalse(circuit.check_circuit_incremental())
+
+
+class TestCompiledCircuit(unittest.TestCase):
+    def test_frozen_circuit_checks_external_witnesses(self):
+        circuit = PlonkCircuitBuilder()
+        left_index = circuit.add_variable(Fr(6))
+        right_index = circuit.add_variable(Fr(3))
+        output_index = circuit.add_variable(Fr(5))
+        circuit.create_64_bit_xor_gate(left_index, right_index, output_index)
+        compiled = circuit.freeze()
+        witness = [variable.value for variable in circuit.variables]
+        circuit.create_boolean_gate(output_index)
+        self.assertEqual(compiled.get_circuit_size(), circuit.get_circuit_size() - 1)
+        self.assertEqual(compiled.variable_count, len(witness))
+        self.assertTrue(compiled.check_circuit(witness))
+        witness[output_index] = 4
+        self.assertEqual(compiled.find_failing_gates(witness), [3])
+        with self.assertRaises(TypeError):
+            compiled.w_l[0] = 1
+
+
+class TestWitnessProgram(unittest.TestCase):
+    def _xor_circuit(self, left, right):
+        circuit = PlonkCircuitBuilder()
+        indices = [circuit.add_variable(Fr(v)) for v in (left, right, left ^ right)]
+        circuit.create_64_bit_xor_gate(*indices)
+        return circuit
+
+    def test_replay_matches_rebuilt_circuits(self):
+        import random
+
+        rng = random.Random(21)
+        program = self._xor_circuit(0, 0).witness_program
+        self.assertEqual(program.input_count, 3)
+        lefts = [rng.getrandbits(64) for _ in range(20)] + [2**64 - 1]
+        rights = [rng.getrandbits(64) for _ in range(20)] + [0]
+        outputs = [left ^ right for left, right in zip(lefts, rights)]
+        compiled = self._xor_circuit(0, 0).freeze()
+        for vectorize in (False, None):
+            columns = program.replay([lefts, rights, outputs], vectorize)
+            witnesses = list(WitnessProgram.iter_witnesses(columns))
+            for witness, left, right in zip(witnesses, lefts, rights):
+                expected = self._xor_circuit(left, right).variables
+                self.assertEqual(witness, [variable.value for variable in expected])
+                self.assertTrue(compiled.check_circuit(witness))
+
+    def test_wide_inputs_fall_back_to_lists(self):
+        program = WitnessProgram()
+        program.record((OP_CONST, -1))
+        program.record()
+        program.record((OP_SHIFT, 1, 100))
+        program.record((OP_MASK, 1, 0xFF))
+        program.record((OP_COPY, 3))
+        columns = program.replay([[2**200 + 0x1FF, 5]])
+        self.assertEqual(columns[0], [Fr_modulus - 1] * 2)
+        self.assertEqual(columns[2], [2**100, 0])
+        self.assertEqual(list(columns[4]), [0xFF, 5])
+
+
+class TestLookupGates(unittest.TestCase):
+    def _xor_circuits(self, left, right, output):
+        circuits = []
+        for create in ("create_64_bit_xor_gate", "create_64_bit_xor_gate_lookup"):
+            circuit = PlonkCircuitBuilder()
+            indices = [circuit.add_variable(Fr(v)) for v in (left, right, output)]
+            getattr(circuit, create)(*indices)
+            circuits.append(circuit)
+        return circuits
+
+    def test_lookup_xor_gadget(self):
+        plain, lookup = self._xor_circuits(
+            0xDEADBEEF, 2**64 - 1, 0xDEADBEEF ^ 2**64 - 1
+        )
+        self.assertTrue(lookup.check_circuit())
+        self.assertLess(lookup.get_circuit_size() * 10, plain.get_circuit_size())
+        self.assertEqual(lookup.gate_histogram()[LOOKUP_GATE], 8)
+        self.assertEqual(len(lookup.lookup_tables), 1)
+        # A wrong output fails the lookup of its lowest chunk
+        wrong = self._xor_circuits(1, 2, 4)[1]
+        self.assertEqual(len(wrong.find_failing_gates()), 1)
+        self.assertEqual(lookup.q_lookup[wrong.find_failing_gates()[0]], Fr(1))
+        compiled = lookup.freeze()
+        witness = [variable.value for variable in lookup.variables]
+        self.assertTrue(compiled.check_circuit(witness))
+        witness[3] += 1
+        self.assertFalse(compiled.check_circuit(witness))
+
+    def test_tables_and_incremental_check(self):
+        circuit = PlonkCircuitBuilder()
+        table_id = circuit.register_table("range4", range_table(4))
+        self.assertEqual(circuit.register_table("range4", []), table_id)
+        value = circuit.add_variable(Fr(9))
+        circuit.create_lookup_gate(table_id, value, 0, 0)
+        self.assertTrue(circuit.check_circuit_incremental())
+        circuit.set_variable(value, 16)
+        self.assertFalse(circuit.check_circuit_incremental())
+        output = io.StringIO()
+        circuit.print_gates(file=output)
+        self.assertIn(
+            "gate 1: (w[1], w[0], w[0]) in range4  # LOOKUP gate", output.getvalue()
+        )
+
+
+class TestCircuitFile(unittest.TestCase):
+    def test_save_and_load_round_trip(self):
+        import os
+        import tempfile
+
+        circuit = PlonkCircuitBuilder()
+        left_index = circuit.add_variable(Fr(12))
+        right_index = circuit.add_variable(Fr(10))
+        output_index = circuit.add_variable(Fr(6))
+        circuit.create_64_bit_xor_gate(left_index, right_index, output_index)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "xor.circuit")
+            circuit.save(path)
+            loaded = PlonkCircuitBuilder.load(path)
+            self.assertIsInstance(loaded.w_l, memoryview)
+            self.assertEqual(loaded.get_circuit_size(), circuit.get_circuit_size())
+            self.assertEqual(loaded.selector_rows, circuit.selector_rows)
+            self.assertEqual(list(loaded.w_o), list(circuit.w_o))
+            self.assertEqual(loaded.variables, circuit.variables)
+            self.assertTrue(loaded.check_circuit())
+            self.assertTrue(loaded.freeze().check_circuit(loaded.variables))
+            # Adding gates copies the mapped columns first
+            loaded.create_boolean_gate(loaded.add_variable(Fr(1)))
+            self.assertEqual(loaded.get_circuit_size(), circuit.get_circuit_size() + 1)
+
+            circuit.save(path, include_witness=False)
+            structure_only = PlonkCircuitBuilder.load(path)
+            self.assertEqual(len(structure_only.variables), len(circuit.variables))
+            self.assertEqual(set(structure_only.variables), {Fr(0)})
+
+    def test_lookup_tables_round_trip(self):
+        import os
+        import tempfile
+
+        circuit = PlonkCircuitBuilder()
+        indices = [circuit.add_variable(Fr(v)) for v in (12, 10, 6)]
+        circuit.create_64_bit_xor_gate_lookup(*indices, chunk_bits=4)
+        circuit.register_table("wide", [(Fr_modulus - 1, 2**70, 0)])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "xor.circuit")
+            for include_witness in (True, False):
+                circuit.save(path, include_witness)
+                loaded = PlonkCircuitBuilder.load(path)
+                self.assertEqual(loaded.lookup_tables, circuit.lookup_tables)
+                self.assertEqual(loaded.selector_rows, circuit.selector_rows)
+            loaded = PlonkCircuitBuilder.load(path, load_witness=False)
+            self.assertTrue(loaded.freeze().check_circuit(circuit.variables))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,18 +1,33 @@
 #!/usr/bin/env python3
+import asyncio
+import os
 import socket
+import sys
 import threading
 import logging
+import multiprocessing
 import re
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import List, Tuple
 
-from plonk_circuit import PlonkCircuitBuilder, Fr
+# Shared by both challenge servers; the container images copy it next to
+# this file
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+)
+import metrics
+from plonk_circuit import PlonkCircuitBuilder, Fr, Fr_modulus
 from flag import flag
 
-
 HOST = "0.0.0.0"
 PORT = 1337
 RECV_BUF = 4096
 SOCKET_TIMEOUT_SECONDS = 600
+# asyncio mode (SERVER_MODE=asyncio)
+MAX_CONNECTIONS = 4096
+LISTEN_BACKLOG = 1024
+CHECK_WORKERS = os.cpu_count() or 1
 
 PROMPT = "> "
 START_MESSAGE = "Please send me the variables for the 64-bit xor circuit"
@@ -22,6 +37,13 @@ DECODE_ERROR = "Error decoding message. Please send ASCII text containing intege
 CIRCUIT_UNSAT = "Circuit is not satisfied. Try again."
 SUCCESS_MESSAGE = "Congratulations! Here is your flag: {flag}"
 FAIL_MESSAGE = "Inputs xor to the output. This does not break the circuit. Try again."
+SERVER_BUSY = "Too many connections. Try again later."
+# Sending this first switches the session to binary witness submission
+BINARY_MODE_MAGIC = b"BINARY\n"
+BINARY_ELEMENT_SIZE = 32
+BINARY_MODE_READY = (
+    "Binary mode. Send {size} bytes: one 32-byte big-endian value per variable."
+)
 
 
 def build_xor_circuit():
@@ -30,27 +52,212 @@ def build_xor_circuit():
     right_index = circuit.add_variable(Fr(0))
     output_index = circuit.add_variable(Fr(0))
     circuit.create_64_bit_xor_gate(left_index, right_index, output_index)
-    return circuit, left_index, right_index, output_index
+    return circuit.freeze(), left_index, right_index, output_index
+
+
+# The circuit never changes between sessions, so it is compiled once and shared
+# read-only by all handlers; each session only holds its own witness.
+with metrics.span("build"):
+    XOR_CIRCUIT, LEFT_INDEX, RIGHT_INDEX, OUTPUT_INDEX = build_xor_circuit()
 
 
 def parse_ints_from_buffer(buffer: str) -> List[int]:
     return [int(x) for x in re.findall(r"[-+]?\d+", buffer)]
 
 
+class IntTokenizer:
+    """
+    Incremental equivalent of parse_ints_from_buffer.
+
+    Chunks are scanned once each; a number (or lone sign) cut off at the end
+    of a chunk is kept aside and completed by the next chunk.
+    """
+
+    _TOKEN = re.compile(r"[-+]?\d+")
+    _DIGITS = re.compile(r"\d+")
+
+    def __init__(self):
+        self.values: List[int] = []
+        self._pending: List[str] = []
+
+    def feed(self, text: str):
+        if not text:
+            return
+        start = 0
+        if self._pending:
+            match = self._DIGITS.match(text)
+            if match:
+                self._pending.append(match.group())
+                start = match.end()
+                if start == len(text):
+                    return
+            self._flush_pending()
+        last = None
+        for match in self._TOKEN.finditer(text, start):
+            if last is not None:
+                self.values.append(int(last))
+            last = match.group()
+            last_end = match.end()
+        if last is not None:
+            if last_end == len(text):
+                self._pending.append(last)
+            else:
+                self.values.append(int(last))
+        if not self._pending and text[-1] in "+-":
+            self._pending.append(text[-1])
+
+    def count(self) -> int:
+        """Number of values seen so far, counting a number cut off at the end."""
+        has_digits = bool(self._pending) and self._pending[-1][-1:].isdigit()
+        return len(self.values) + has_digits
+
+    def finish(self) -> List[int]:
+        """Treat the end of the last chunk as the end of the input."""
+        self._flush_pending()
+        return self.values
+
+    def _flush_pending(self):
+        token = "".join(self._pending)
+        self._pending = []
+        if token[-1:].isdigit():
+            self.values.append(int(token))
+
+
+class WitnessSession:
+    """
+    Protocol state of one client, independent of how bytes are transported.
+
+    The client is greeted, then sends integers as ASCII text in as many
+    chunks as it likes until there is one per circuit variable. A client
+    that starts with BINARY_MODE_MAGIC instead sends the witness as
+    fixed-width big-endian field elements.
+    """
+
+    def __init__(self, var_count: int):
+        self.var_count = var_count
+        self.binary = None  # undecided until the first bytes arrive
+        self._head = b""
+        self._tokenizer = IntTokenizer()
+        self._binary_witness = None
+        self._binary_received = 0
+
+    def greeting(self) -> bytes:
+        return (
+            START_MESSAGE + f" (send {self.var_count} integers)\n" + PROMPT
+        ).encode()
+
+    def feed(self, data: bytes) -> Tuple[bytes, bool]:
+        """
+        Consume one received chunk. Returns the reply to send and whether
+        enough values have arrived.
+        """
+        if self.binary is None:
+            self._head += data
+            head = self._head
+            if len(head) < len(BINARY_MODE_MAGIC) and BINARY_MODE_MAGIC.startswith(
+                head
+            ):
+                return b"", False
+            if head.startswith(BINARY_MODE_MAGIC):
+                self.binary = True
+                self._binary_witness = bytearray(self.var_count * BINARY_ELEMENT_SIZE)
+                size = len(self._binary_witness)
+                ready = (BINARY_MODE_READY.format(size=size) + "\n").encode()
+                _, complete = self._feed_binary(head[len(BINARY_MODE_MAGIC) :])
+                return ready, complete
+            self.binary = False
+            data, self._head = self._head, b""
+        if self.binary:
+            return self._feed_binary(data)
+        return self._feed_text(data)
+
+    def _feed_text(self, data: bytes) -> Tuple[bytes, bool]:
+        try:
+            chunk = data.decode()
+        except UnicodeDecodeError:
+            return (DECODE_ERROR + "\n" + PROMPT).encode(), False
+        self._tokenizer.feed(chunk)
+        count = self._tokenizer.count()
+        if count < self.var_count:
+            # Ask for more until we have enough
+            remaining = self.var_count - count
+            return (f"Need {remaining} more integers...\n" + PROMPT).encode(), False
+        return b"", True
+
+    def _feed_binary(self, data: bytes) -> Tuple[bytes, bool]:
+        # Bytes past the last element are ignored
+        take = min(len(data), len(self._binary_witness) - self._binary_received)
+        end = self._binary_received + take
+        self._binary_witness[self._binary_received : end] = data[:take]
+        self._binary_received = end
+        return b"", end == len(self._binary_witness)
+
+    def take_witness(self) -> Tuple[bytes, List[int]]:
+        """Return the notice to send (if any) and the witness, reduced into the field."""
+        if self.binary:
+            view = memoryview(self._binary_witness)
+            return b"", [
+                int.from_bytes(view[offset : offset + BINARY_ELEMENT_SIZE], "big")
+                % Fr_modulus
+                for offset in range(0, len(view), BINARY_ELEMENT_SIZE)
+            ]
+        values = self._tokenizer.finish()
+        notice = b""
+        if len(values) > self.var_count:
+            notice = (
+                TOO_MANY_VALUES.format(expected=self.var_count, got=len(values)) + "\n"
+            ).encode()
+            values = values[: self.var_count]
+        # Reduce into the field like Fr would
+        return notice, [v % Fr_modulus for v in values]
+
+
+def check_witness(witness: List[int]) -> Tuple[bytes, bool, float]:
+    """
+    Return the verdict on witness, whether it satisfies the circuit and the
+    seconds the circuit check took. Nothing is recorded here, so the result
+    can come back from a pool worker.
+    """
+    # Check circuit satisfaction
+    start = perf_counter()
+    satisfied = XOR_CIRCUIT.check_circuit(witness)
+    check_seconds = perf_counter() - start
+    if not satisfied:
+        return (CIRCUIT_UNSAT + "\n").encode(), satisfied, check_seconds
+
+    # Check that inputs do NOT xor to output
+    left_val = witness[LEFT_INDEX]
+    right_val = witness[RIGHT_INDEX]
+    out_val = witness[OUTPUT_INDEX]
+
+    if (left_val ^ right_val) != out_val:
+        verdict = SUCCESS_MESSAGE.format(flag=flag) + "\n"
+    else:
+        verdict = FAIL_MESSAGE + "\n"
+    return verdict.encode(), satisfied, check_seconds
+
+
+def record_check(verdict: bytes, satisfied: bool, check_seconds: float) -> bytes:
+    """Record a check_witness() result and return the verdict."""
+    metrics.observe("check", check_seconds)
+    metrics.inc("sessions_accepted" if satisfied else "sessions_rejected")
+    return verdict
+
+
+def judge_witness(witness: List[int]) -> bytes:
+    return record_check(*check_witness(witness))
+
+
 def handle_client(conn: socket.socket, addr):
+    metrics.inc("sessions")
+    metrics.gauge_add("sessions_active", 1)
     try:
         conn.settimeout(SOCKET_TIMEOUT_SECONDS)
-        # Build circuit and determine variable count
-        circuit, left_idx, right_idx, out_idx = build_xor_circuit()
-        var_count = len(circuit.variables)
+        session = WitnessSession(XOR_CIRCUIT.variable_count)
 
         # Send initial prompt
-        conn.sendall(
-            (START_MESSAGE + f" (send {var_count} integers)\n" + PROMPT).encode()
-        )
+        conn.sendall(session.greeting())
 
-        buffer = ""
-        values: List[int] = []
         while True:
             try:
                 data = conn.recv(RECV_BUF)
@@ -58,52 +265,25 @@ def handle_client(conn: socket.socket, addr):
                 return
             if not data:
                 return
-            try:
-                chunk = data.decode()
-            except UnicodeDecodeError:
-                conn.sendall((DECODE_ERROR + "\n" + PROMPT).encode())
-                continue
-            buffer += chunk
-            values = parse_ints_from_buffer(buffer)
-            if len(values) < var_count:
-                # Ask for more until we have enough
-                remaining = var_count - len(values)
-                conn.sendall((f"Need {remaining} more integers...\n" + PROMPT).encode())
-                continue
-            break
-
-        if len(values) > var_count:
-            conn.sendall(
-                (
-                    TOO_MANY_VALUES.format(expected=var_count, got=len(values)) + "\n"
-                ).encode()
-            )
-            values = values[:var_count]
-
-        # Replace variables
-        new_variables = [Fr(v) for v in values]
-        circuit.replace_variables(new_variables)
-
-        # Check circuit satisfaction
-        if not circuit.check_circuit():
-            conn.sendall((CIRCUIT_UNSAT + "\n").encode())
-            return
-
-        # Check that inputs do NOT xor to output
-        left_val = circuit.variables[left_idx].value
-        right_val = circuit.variables[right_idx].value
-        out_val = circuit.variables[out_idx].value
+            with metrics.span("parse"):
+                reply, complete = session.feed(data)
+            if reply:
+                conn.sendall(reply)
+            if complete:
+                break
 
-        if (left_val ^ right_val) != out_val:
-            conn.sendall((SUCCESS_MESSAGE.format(flag=flag) + "\n").encode())
-        else:
-            conn.sendall((FAIL_MESSAGE + "\n").encode())
+        with metrics.span("parse"):
+            notice, witness = session.take_witness()
+        if notice:
+            conn.sendall(notice)
+        conn.sendall(judge_witness(witness))
     finally:
         try:
             conn.shutdown(socket.SHUT_RDWR)
         except Exception:
             pass
         conn.close()
+        metrics.gauge_add("sessions_active", -1)
 
 
 def serve_forever():
@@ -124,8 +304,207 @@ def serve_forever():
                 break
 
 
+async def _serve_session(reader, writer, check_executor):
+    session = WitnessSession(XOR_CIRCUIT.variable_count)
+    writer.write(session.greeting())
+    await writer.drain()
+    while True:
+        data = await reader.read(RECV_BUF)
+        if not data:
+            return
+        with metrics.span("parse"):
+            reply, complete = session.feed(data)
+        if reply:
+            writer.write(reply)
+            await writer.drain()
+        if complete:
+            break
+
+    with metrics.span("parse"):
+        notice, witness = session.take_witness()
+    if notice:
+        writer.write(notice)
+    loop = asyncio.get_running_loop()
+    # Includes waiting for a worker. Metrics recorded in a worker are never
+    # exported, so the worker returns its result for this process to record
+    with metrics.span("judge"):
+        result = await loop.run_in_executor(check_executor, check_witness, witness)
+    writer.write(record_check(*result))
+    await writer.drain()
+
+
+async def _handle_client_async(reader, writer, connection_slots, check_executor):
+    metrics.inc("sessions")
+    metrics.gauge_add("sessions_active", 1)
+    try:
+        if connection_slots.locked():
+            metrics.inc("sessions_busy")
+            writer.write((SERVER_BUSY + "\n").encode())
+            await writer.drain()
+            return
+        async with connection_slots:
+            logging.info(
+                f"Accepted connection from {writer.get_extra_info('peername')}"
+            )
+            await asyncio.wait_for(
+                _serve_session(reader, writer, check_executor), SOCKET_TIMEOUT_SECONDS
+            )
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+        metrics.gauge_add("sessions_active", -1)
+
+
+async def serve_asyncio(
+    host: str = HOST,
+    port: int = PORT,
+    max_connections: int = MAX_CONNECTIONS,
+    backlog: int = LISTEN_BACKLOG,
+    check_workers: int = CHECK_WORKERS,
+):
+    """
+    Serve the same line protocol from one event loop.
+
+    At most max_connections sessions run at once (others are told the server
+    is busy), every session must finish within SOCKET_TIMEOUT_SECONDS, and
+    circuit checks run in a pool of check_workers processes so the loop is
+    never blocked by them.
+    """
+    connection_slots = asyncio.Semaphore(max_connections)
+    # Workers come from a fork server so they never inherit client sockets,
+    # which would keep connections open after the session closes them.
+    with ProcessPoolExecutor(
+        max_workers=check_workers, mp_context=multiprocessing.get_context("forkserver")
+    ) as check_executor:
+        server = await asyncio.start_server(
+            lambda reader, writer: _handle_client_async(
+                reader, writer, connection_slots, check_executor
+            ),
+            host,
+            port,
+            backlog=backlog,
+        )
+        logging.info(f"Listening on {host}:{port} (asyncio)")
+        async with server:
+            await server.serve_forever()
+
+
+# -------------------- Tests --------------------
+import random
+import unittest
+
+
+class TestIntTokenizer(unittest.TestCase):
+    def feed_chunks(self, chunks):
+        tokenizer = IntTokenizer()
+        received = ""
+        for chunk in chunks:
+            tokenizer.feed(chunk)
+            received += chunk
+            self.assertEqual(
+                tokenizer.count(), len(parse_ints_from_buffer(received)), chunks
+            )
+        return tokenizer.finish()
+
+    def test_random_chunkings_match_full_parse(self):
+        rng = random.Random(8)
+        alphabet = "0123456789" * 3 + "+-  ,x\n"
+        for _ in range(300):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randrange(60)))
+            cuts = sorted(rng.randrange(len(text) + 1) for _ in range(rng.randrange(8)))
+            chunks = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+            self.assertEqual(
+                self.feed_chunks(chunks), parse_ints_from_buffer(text), chunks
+            )
+
+    def test_signs_and_digits_split_across_chunks(self):
+        cases = [
+            (["-", "5"], [-5]),
+            (["1", "2", "3"], [123]),
+            (["5-", "3"], [5, -3]),
+            (["+", "+3"], [3]),
+            (["-", "", "-", "7 8"], [-7, 8]),
+            (["12", " ", "-"], [12]),
+        ]
+        for chunks, expected in cases:
+            self.assertEqual(self.feed_chunks(chunks), expected, chunks)
+
+
+class TestWitnessSession(unittest.TestCase):
+    def test_text_witness_in_chunks(self):
+        session = WitnessSession(3)
+        reply, complete = session.feed(b"1 -")
+        self.assertEqual(reply, b"Need 2 more integers...\n" + PROMPT.encode())
+        self.assertFalse(complete)
+        self.assertEqual(session.feed(b"2 3"), (b"", True))
+        self.assertEqual(session.take_witness(), (b"", [1, Fr_modulus - 2, 3]))
+
+    def test_undecodable_bytes_are_reported(self):
+        session = WitnessSession(2)
+        reply, complete = session.feed(b"1 \xff")
+        self.assertEqual(reply, (DECODE_ERROR + "\n" + PROMPT).encode())
+        self.assertFalse(complete)
+        self.assertEqual(session.feed(b"1 2"), (b"", True))
+        self.assertEqual(session.take_witness(), (b"", [1, 2]))
+
+    def test_excess_values_are_dropped_with_a_notice(self):
+        session = WitnessSession(2)
+        self.assertEqual(session.feed(b"1 2 3 4"), (b"", True))
+        notice, witness = session.take_witness()
+        self.assertEqual(
+            notice, (TOO_MANY_VALUES.format(expected=2, got=4) + "\n").encode()
+        )
+        self.assertEqual(witness, [1, 2])
+
+    def test_binary_witness(self):
+        session = WitnessSession(2)
+        values = [7, Fr_modulus + 1]
+        data = b"".join(value.to_bytes(BINARY_ELEMENT_SIZE, "big") for value in values)
+        self.assertEqual(session.feed(BINARY_MODE_MAGIC[:3]), (b"", False))
+        reply, complete = session.feed(BINARY_MODE_MAGIC[3:] + data[:40])
+        self.assertEqual(reply, (BINARY_MODE_READY.format(size=64) + "\n").encode())
+        self.assertFalse(complete)
+        # Bytes past the last element are ignored
+        self.assertEqual(session.feed(data[40:] + b"extra"), (b"", True))
+        self.assertEqual(session.take_witness(), (b"", [7, 1]))
+
+    def test_truncated_binary_witness_is_not_complete(self):
+        session = WitnessSession(2)
+        reply, complete = session.feed(BINARY_MODE_MAGIC + bytes(63))
+        self.assertTrue(reply)
+        self.assertFalse(complete)
+        self.assertEqual(session.feed(b""), (b"", False))
+
+    def test_magic_prefix_falls_back_to_text(self):
+        session = WitnessSession(2)
+        self.assertEqual(session.feed(b"BIN"), (b"", False))
+        self.assertEqual(session.feed(b" 4 5"), (b"", True))
+        self.assertFalse(session.binary)
+        self.assertEqual(session.take_witness(), (b"", [4, 5]))
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
     )
-    serve_forever()
+    metrics.start_exporter("circuit")
+    if os.environ.get("SERVER_MODE", "threaded") == "asyncio":
+        try:
+            asyncio.run(
+                serve_asyncio(
+                    max_connections=int(
+                        os.environ.get("MAX_CONNECTIONS", MAX_CONNECTIONS)
+                    ),
+                    backlog=int(os.environ.get("LISTEN_BACKLOG", LISTEN_BACKLOG)),
+                    check_workers=int(os.environ.get("CHECK_WORKERS", CHECK_WORKERS)),
+                )
+            )
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve_forever()
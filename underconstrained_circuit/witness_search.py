@@ -0,0 +1,311 @@
+"""
+Randomized search for alternative witnesses of under-constrained circuits.
+
+A Walker starts from a satisfying witness of a PlonkCircuitBuilder circuit
+and makes gate-local moves: it perturbs one variable, then re-solves the
+gates that the change broke. Each broken gate is solved for one of its
+other wires, provided that wire appears in it linearly, and the change is
+propagated from there. After each move only the touched gates are
+re-evaluated, through set_variable() and check_circuit_incremental(). A
+move that breaks more gates than it started with is undone, except with
+the Metropolis probability exp(-added / temperature).
+
+The walk stops at a witness that satisfies every gate and the goal. By
+default the goal is that some output variable differs from the starting
+witness; xor_broken() builds the goal of the 64-bit XOR challenge.
+
+search() runs independent walkers in a process pool. The first walker
+that succeeds sets a shared event and the others stop. The result reports
+the moves made per second across all walkers, for sizing search budgets.
+
+Usage:
+    result = search(circuit, [output], xor_broken(left, right, output))
+    result.witness, result.moves_per_second
+"""
+
+import copy
+import functools
+import math
+import multiprocessing
+import os
+import random
+from collections import namedtuple
+from time import perf_counter
+
+from plonk_circuit import Fr, Fr_modulus
+
+# Gates re-solved per move at most, so that propagation cannot run away
+MAX_PROPAGATION = 256
+# Probability that a move perturbs an output variable rather than any variable
+OUTPUT_MOVE_PROBABILITY = 0.5
+# Moves between two looks at the stop event
+STOP_CHECK_MOVES = 1024
+
+
+class SearchResult(namedtuple("SearchResult", "witness walker moves seconds")):
+    """witness is None when no walker succeeded within its budget."""
+
+    __slots__ = ()
+
+    @property
+    def moves_per_second(self):
+        return self.moves / self.seconds if self.seconds else 0.0
+
+
+def _xor_broken(left, right, output, values):
+    return values[left] ^ values[right] != values[output]
+
+
+def xor_broken(left, right, output):
+    """Goal of the XOR challenge; picklable, unlike a lambda."""
+    return functools.partial(_xor_broken, left, right, output)
+
+
+def _gate_holds(row, a, b, c, lookup_tables):
+    if row[5]:
+        return (a, b, c) in lookup_tables[row[5] - 1].entries
+    q_m, q_l, q_r, q_o, q_c = row[:5]
+    return (q_m * a * b + q_l * a + q_r * b + q_o * c + q_c) % Fr_modulus == 0
+
+
+def _wire_equation(row, wires, values, position):
+    """
+    Return (coefficient, rest) such that the arithmetic gate holds when the
+    wire at position is -rest / coefficient with the other wires fixed, or
+    None if it does not appear linearly.
+    """
+    if row[5] or wires.count(wires[position]) > 1:
+        return None
+    q_m, q_l, q_r, q_o, q_c = row[:5]
+    a, b, c = (values[variable] for variable in wires)
+    if position == 0:
+        coefficient, rest = q_m * b + q_l, q_r * b + q_o * c + q_c
+    elif position == 1:
+        coefficient, rest = q_m * a + q_r, q_l * a + q_o * c + q_c
+    else:
+        coefficient, rest = q_o, q_m * a * b + q_l * a + q_r * b + q_c
+    coefficient %= Fr_modulus
+    if not coefficient:
+        return None
+    return coefficient, rest
+
+
+class Walker:
+    """
+    One random walk over the witnesses of circuit.
+
+    Args:
+        circuit: A PlonkCircuitBuilder whose witness satisfies it; the walk
+                 edits that witness in place.
+        outputs: Variable indices the goal is about; moves favour them.
+        goal: Function of the list of witness values, true once the witness
+              is an alternative one. Defaults to an output differing from
+              the starting witness.
+        seed: Seed of the walk.
+        temperature: Willingness to accept moves that break more gates.
+    """
+
+    def __init__(self, circuit, outputs, goal=None, seed=0, temperature=0.5):
+        if not circuit.check_circuit():
+            raise ValueError("the starting witness does not satisfy the circuit")
+        self.circuit = circuit
+        self.outputs = list(outputs)
+        self.temperature = temperature
+        self.rng = random.Random(seed)
+        self.values = [variable.value for variable in circuit.variables]
+        if goal is None:
+            start = [self.values[output] for output in self.outputs]
+            goal = lambda values: [values[i] for i in self.outputs] != start
+        self.goal = goal
+        self.gates_by_variable = [[] for _ in self.values]
+        for gate_index, wires in enumerate(zip(circuit.w_l, circuit.w_r, circuit.w_o)):
+            for variable in set(wires):
+                self.gates_by_variable[variable].append(gate_index)
+        circuit.check_circuit_incremental()
+        self.failing = 0
+        self.moves = 0
+
+    def _set(self, variable, value, previous):
+        if variable not in previous:
+            previous[variable] = self.values[variable]
+        self.values[variable] = value
+        self.circuit.set_variable(variable, value)
+
+    def _perturb(self, value):
+        rng = self.rng
+        kind = rng.randrange(4)
+        if kind == 0:
+            return (value + (rng.choice((-1, 1)) << rng.randrange(64))) % Fr_modulus
+        if kind == 1:
+            # Flipping a low bit of a value near the modulus can leave the field
+            return (value ^ (1 << rng.randrange(64))) % Fr_modulus
+        if kind == 2:
+            return rng.getrandbits(64)
+        return rng.randrange(Fr_modulus)
+
+    def _propagate(self, variable, previous):
+        circuit = self.circuit
+        rows = circuit.selector_rows
+        lookup_tables = circuit.lookup_tables
+        values = self.values
+        queue = [variable]
+        budget = MAX_PROPAGATION
+        while queue and budget:
+            # The gates the popped variable broke are solved together, with
+            # one batched inversion. A solution that is stale because another
+            # one in the batch set a wire of its gate gets fixed when that
+            # wire is popped in turn.
+            solved = []
+            coefficients = []
+            rests = []
+            for gate_index in self.gates_by_variable[queue.pop()]:
+                row = rows[circuit.selector_ids[gate_index]]
+                wires = (
+                    circuit.w_l[gate_index],
+                    circuit.w_r[gate_index],
+                    circuit.w_o[gate_index],
+                )
+                if _gate_holds(row, *(values[i] for i in wires), lookup_tables):
+                    continue
+                budget -= 1
+                # Prefer wires this move has not set yet
+                positions = [i for i in range(3) if wires[i] not in previous]
+                self.rng.shuffle(positions)
+                for position in positions:
+                    equation = _wire_equation(row, wires, values, position)
+                    if equation is not None:
+                        solved.append(wires[position])
+                        coefficients.append(Fr._from_reduced(equation[0]))
+                        rests.append(equation[1])
+                        break
+                if not budget:
+                    break
+            if not solved:
+                continue
+            inverses = Fr.batch_pow(coefficients, -1)
+            for wire, rest, inverse in zip(solved, rests, inverses):
+                self._set(wire, -rest * inverse.value % Fr_modulus, previous)
+                queue.append(wire)
+
+    def step(self):
+        """Make one move; return True if the witness now reaches the goal."""
+        rng = self.rng
+        self.moves += 1
+        if self.outputs and rng.random() < OUTPUT_MOVE_PROBABILITY:
+            variable = rng.choice(self.outputs)
+        else:
+            variable = rng.randrange(len(self.values))
+        previous = {}
+        self._set(variable, self._perturb(self.values[variable]), previous)
+        self._propagate(variable, previous)
+        self.circuit.check_circuit_incremental()
+        failing = self.circuit.unsatisfied_gate_count()
+        added = failing - self.failing
+        if added > 0 and (
+            not self.temperature or rng.random() >= math.exp(-added / self.temperature)
+        ):
+            for variable, value in previous.items():
+                self._set(variable, value, {})
+            return False
+        self.failing = failing
+        return not failing and self.goal(self.values)
+
+    def run(self, moves, stop=None):
+        """Walk up to moves moves; return the alternative witness or None."""
+        for move in range(moves):
+            if stop is not None and not move % STOP_CHECK_MOVES and stop.is_set():
+                break
+            if self.step():
+                if stop is not None:
+                    stop.set()
+                return list(self.values)
+        return None
+
+
+_search = None
+
+
+def _init_search(*args):
+    global _search
+    _search = args
+
+
+def _walk(seed, moves, temperature):
+    circuit, outputs, goal, stop = _search
+    walker = Walker(copy.deepcopy(circuit), outputs, goal, seed, temperature)
+    start = perf_counter()
+    witness = walker.run(moves, stop)
+    return witness, walker.moves, perf_counter() - start
+
+
+def search(
+    circuit,
+    outputs,
+    goal=None,
+    walkers=None,
+    moves=100000,
+    seed=0,
+    temperature=0.5,
+    mp_context=None,
+):
+    """
+    Run walkers independent walks of up to moves moves each in a process
+    pool and return a SearchResult.
+
+    goal and circuit are handed to the workers as initializer arguments, so
+    with a non-fork mp_context they have to be picklable (see xor_broken()).
+    """
+    walkers = walkers or os.cpu_count() or 1
+    context = mp_context or multiprocessing.get_context()
+    stop = context.Event()
+    start = perf_counter()
+    with context.Pool(
+        min(walkers, os.cpu_count() or 1),
+        initializer=_init_search,
+        initargs=(circuit, outputs, goal, stop),
+    ) as pool:
+        runs = pool.starmap(
+            _walk, [(seed + walker, moves, temperature) for walker in range(walkers)]
+        )
+    seconds = perf_counter() - start
+    total_moves = sum(run[1] for run in runs)
+    for walker, (witness, _, _) in enumerate(runs):
+        if witness is not None:
+            return SearchResult(witness, walker, total_moves, seconds)
+    return SearchResult(None, None, total_moves, seconds)
+
+
+# -------------------- Tests --------------------
+import unittest
+
+from plonk_circuit import PlonkCircuitBuilder
+
+
+class TestWitnessSearch(unittest.TestCase):
+    def test_finds_broken_xor_witness(self):
+        circuit = PlonkCircuitBuilder()
+        left, right, output = (circuit.add_variable(Fr(v)) for v in (12, 10, 6))
+        circuit.create_64_bit_xor_gate(left, right, output)
+        result = search(
+            circuit, [output], xor_broken(left, right, output), walkers=2, moves=5000
+        )
+        self.assertIsNotNone(result.witness)
+        self.assertGreater(result.moves_per_second, 0)
+        witness = result.witness
+        self.assertNotEqual(witness[left] ^ witness[right], witness[output])
+        circuit.replace_variables([Fr(value) for value in witness])
+        self.assertTrue(circuit.check_circuit())
+
+    def test_constrained_output_is_not_changed(self):
+        circuit = PlonkCircuitBuilder()
+        output = circuit.add_variable(Fr(5))
+        circuit.create_fixed_witness_gate(output, Fr(5))
+        walker = Walker(circuit, [output], seed=1, temperature=0)
+        self.assertIsNone(walker.run(2000))
+        self.assertEqual(walker.moves, 2000)
+        self.assertTrue(circuit.check_circuit_incremental())
+        self.assertEqual(circuit.variables[output], Fr(5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,226 @@
+"""
+Bulk verification of batched Schnorr proofs.
+
+A proof is a tuple (A1, A2, R1, R2, s, msg) of the scheme checked by
+server.py: s*G == R1 + e*A1 + b*(R2 + e*A2) with b = H(A1 || R1) and
+e = H(A1 || R1 || A2 || R2 || msg). Points are affine (x, y) int tuples or
+objects with .x/.y (e.g. ecpy points). As in the server, coordinates are
+taken modulo the field prime, and the point at infinity is rejected.
+
+verify_many() multiplies the equation of proof i by a random 128-bit weight
+w_i and checks the sum of all of them with one multi-scalar multiplication.
+If any proof is invalid the sum is non-zero except with probability about
+2^-128; the failing batch is then bisected to locate the invalid proofs.
+
+Usage: python3 batch_verify.py log.jsonl
+    where each line holds the server's A1_x, A1_y, A2_x, ..., s, msg fields.
+"""
+
+import json
+import secrets
+import sys
+
+from msm import G, N, P, is_on_curve, sums_to_identity
+from transcript import Transcript
+
+WEIGHT_BITS = 128
+
+
+def _affine(point):
+    """Return the coordinates of point reduced mod P, or None at infinity."""
+    if point is None:
+        return None
+    if isinstance(point, tuple):
+        x, y = point
+    elif point.is_infinity:
+        # ecpy raises on .x of the point at infinity
+        return None
+    else:
+        x, y = point.x, point.y
+    return (int(x) % P, int(y) % P)
+
+
+def proof_challenges(A1, R1, A2, R2, msg):
+    """Return (batch_challenge, e) exactly as the server derives them."""
+    transcript = Transcript(N)
+    transcript.absorb_point("A1", A1)
+    transcript.absorb_point("R1", R1)
+    batch_challenge = transcript.challenge("batch_challenge")
+    transcript.absorb_point("A2", A2)
+    transcript.absorb_point("R2", R2)
+    transcript.absorb("msg", msg)
+    return batch_challenge, transcript.challenge("e")
+
+
+def _prepare(proof):
+    """
+    Return (s, [(scalar, point)] of the right-hand side) for the equation
+    s*G - R1 - e*A1 - b*R2 - b*e*A2 == O, or None for malformed proofs
+    (a point off the curve or at infinity).
+    """
+    A1, A2, R1, R2, s, msg = proof
+    points = [_affine(point) for point in (A1, A2, R1, R2)]
+    if not all(point is not None and is_on_curve(point) for point in points):
+        return None
+    A1, A2, R1, R2 = points
+    if isinstance(msg, str):
+        msg = msg.encode("latin-1")
+    batch_challenge, e = proof_challenges(A1, R1, A2, R2, msg)
+    terms = [
+        (1, R1),
+        (e, A1),
+        (batch_challenge, R2),
+        (batch_challenge * e % N, A2),
+    ]
+    return int(s) % N, terms
+
+
+def _combined_check(prepared, weighted=True):
+    # sum_i w_i * (s_i*G - rhs_i) == O, with all G terms merged into one
+    g_scalar = 0
+    scalars = []
+    points = []
+    for s, terms in prepared:
+        weight = secrets.randbits(WEIGHT_BITS) | 1 if weighted else 1
+        g_scalar += weight * s
+        for scalar, point in terms:
+            scalars.append(-weight * scalar % N)
+            points.append(point)
+    scalars.append(g_scalar % N)
+    points.append(G)
+    return sums_to_identity(scalars, points)
+
+
+def _bisect(prepared, indices, results):
+    if len(indices) == 1:
+        results[indices[0]] = _combined_check([prepared[indices[0]]], weighted=False)
+        return
+    half = len(indices) // 2
+    for part in (indices[:half], indices[half:]):
+        if _combined_check([prepared[i] for i in part]):
+            for i in part:
+                results[i] = True
+        else:
+            _bisect(prepared, part, results)
+
+
+def verify_many(proofs):
+    """
+    Verify many batched Schnorr proofs at once.
+
+    Args:
+        proofs: Iterable of (A1, A2, R1, R2, s, msg) tuples.
+
+    Returns:
+        list of bool, True for each proof that satisfies the equation.
+    """
+    prepared = [_prepare(proof) for proof in proofs]
+    results = [False] * len(prepared)
+    candidates = [i for i, entry in enumerate(prepared) if entry is not None]
+    if not candidates:
+        return results
+    if _combined_check([prepared[i] for i in candidates]):
+        for i in candidates:
+            results[i] = True
+    else:
+        _bisect(prepared, candidates, results)
+    return results
+
+
+def _log_point(obj, name):
+    return (int(obj[name + "_x"]), int(obj[name + "_y"]))
+
+
+def _read_log(path):
+    proofs = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            obj = json.loads(line)
+            proofs.append(
+                (
+                    _log_point(obj, "A1"),
+                    _log_point(obj, "A2"),
+                    _log_point(obj, "R1"),
+                    _log_point(obj, "R2"),
+                    int(obj["s"]),
+                    obj.get("msg", ""),
+                )
+            )
+    return proofs
+
+
+# -------------------- Tests --------------------
+import unittest
+
+try:
+    import ecpy
+except ImportError:
+    ecpy = None
+
+
+class TestVerifyMany(unittest.TestCase):
+    def _proof(self, rng, valid=True):
+        from msm import multi_scalar_mul, to_affine
+
+        def mul(k):
+            return to_affine(multi_scalar_mul([k], [G]))
+
+        a1, a2, k1, k2 = (rng.randrange(1, N) for _ in range(4))
+        A1, A2, R1, R2 = mul(a1), mul(a2), mul(k1), mul(k2)
+        msg = b"hello schnorr batching"
+        b, e = proof_challenges(A1, R1, A2, R2, msg)
+        s = (k1 + e * a1 + b * (k2 + e * a2)) % N
+        return (A1, A2, R1, R2, s if valid else s + 1, msg)
+
+    def test_all_valid(self):
+        import random
+
+        rng = random.Random(3)
+        self.assertEqual(verify_many([self._proof(rng) for _ in range(5)]), [True] * 5)
+        self.assertEqual(verify_many([]), [])
+
+    def test_bisection_finds_invalid_and_malformed_proofs(self):
+        import random
+
+        rng = random.Random(4)
+        proofs = [self._proof(rng, valid=i not in (2, 5)) for i in range(7)]
+        A1, A2, R1, R2, s, msg = proofs[0]
+        proofs.append((A1, A2, (R1[0], R1[1] + 1), R2, s, msg))
+        expected = [i not in (2, 5, 7) for i in range(8)]
+        self.assertEqual(verify_many(proofs), expected)
+
+    def test_coordinates_are_reduced_like_the_server(self):
+        import random
+
+        rng = random.Random(5)
+        A1, A2, R1, R2, s, msg = self._proof(rng)
+        shifted = (A1[0] + P, A1[1] - P)
+        self.assertEqual(verify_many([(shifted, A2, R1, R2, s, msg)]), [True])
+        self.assertEqual(verify_many([(A1, A2, None, R2, s, msg)]), [False])
+
+    @unittest.skipIf(ecpy is None, "ecpy is not installed")
+    def test_ecpy_points(self):
+        import random
+
+        from ecpy.curves import Curve, Point
+
+        curve = Curve.get_curve("secp256k1")
+        rng = random.Random(6)
+        A1, A2, R1, R2, s, msg = self._proof(rng)
+        A1 = Point(*A1, curve)
+        self.assertEqual(verify_many([(A1, A2, R1, R2, s, msg)]), [True])
+        infinity = curve.generator * N
+        self.assertEqual(verify_many([(A1, A2, infinity, R2, s, msg)]), [False])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and not sys.argv[1].startswith("-"):
+        results = verify_many(_read_log(sys.argv[1]))
+        invalid = [i for i, ok in enumerate(results) if not ok]
+        print(f"{len(results) - len(invalid)}/{len(results)} proofs valid")
+        if invalid:
+            print("invalid:", ", ".join(str(i) for i in invalid))
+    else:
+        unittest.main()
@@ -0,0 +1,302 @@
+"""
+Pluggable secp256k1 backends for the Schnorr server.
+
+A backend hides the point representation behind a small interface: build
+and validate points from coordinates, read coordinates back, add, negate,
+and multiply (variable base, fixed base G, and multi-scalar).
+
+  * "secp256k1": pure-Python arithmetic specialized for the curve (Jacobian
+    coordinates with mixed addition, wNAF, GLV scalar splitting, and a
+    precomputed table of multiples of G). Points are affine (x, y) tuples,
+    None is the point at infinity.
+  * "ecpy": the generic ecpy implementation, kept as the reference.
+
+The backend is selected with get_backend(name) or the CURVE_BACKEND
+environment variable.
+"""
+
+import os
+
+import msm
+
+BASE_TABLE_WINDOW = 8
+SEC1_COMPRESSED_BYTES = 33
+
+
+def encode_point(xy):
+    """SEC1 compressed encoding of affine coordinates."""
+    x, y = xy
+    return bytes([2 | (y & 1)]) + x.to_bytes(32, "big")
+
+
+def decode_point(data):
+    """
+    Return the affine coordinates of a SEC1 compressed point; raise
+    ValueError if data is not one.
+    """
+    if len(data) != SEC1_COMPRESSED_BYTES or data[0] not in (2, 3):
+        raise ValueError("not a compressed point")
+    x = int.from_bytes(data[1:], "big")
+    if x >= msm.P:
+        raise ValueError("not a compressed point")
+    y_squared = (x * x * x + 7) % msm.P
+    # P = 3 (mod 4), so a square root is a power
+    y = pow(y_squared, (msm.P + 1) // 4, msm.P)
+    if y * y % msm.P != y_squared:
+        raise ValueError("Point not on curve")
+    if (y & 1) != (data[0] & 1):
+        y = msm.P - y
+    return (x, y)
+
+
+class CurveBackend:
+    """Interface implemented by every curve backend."""
+
+    name = None
+    order = msm.N
+    field = msm.P
+
+    def generator(self):
+        raise NotImplementedError
+
+    def point(self, x, y):
+        """Return the point (x, y); raise ValueError if it is not on the curve."""
+        raise NotImplementedError
+
+    def xy(self, point):
+        """Return the affine coordinates of point, or None at infinity."""
+        raise NotImplementedError
+
+    def add(self, first, second):
+        raise NotImplementedError
+
+    def neg(self, point):
+        raise NotImplementedError
+
+    def mul(self, scalar, point):
+        raise NotImplementedError
+
+    def mul_base(self, scalar):
+        return self.mul(scalar, self.generator())
+
+    def multi_scalar_mul(self, scalars, points):
+        total = None
+        for scalar, point in zip(scalars, points):
+            term = self.mul(scalar, point)
+            total = term if total is None else self.add(total, term)
+        return total
+
+    def sums_to_identity(self, scalars, points):
+        return self.xy(self.multi_scalar_mul(scalars, points)) is None
+
+    def equal(self, first, second):
+        return self.xy(first) == self.xy(second)
+
+
+class Secp256k1Backend(CurveBackend):
+    name = "secp256k1"
+
+    def __init__(self):
+        self._base_table = None
+
+    def generator(self):
+        return msm.G
+
+    def point(self, x, y):
+        # Coordinates are taken modulo the field prime, as ecpy does
+        point = (int(x) % msm.P, int(y) % msm.P)
+        if not msm.is_on_curve(point):
+            raise ValueError("Point not on curve")
+        return point
+
+    def xy(self, point):
+        return point
+
+    def add(self, first, second):
+        if first is None:
+            return second
+        return msm.to_affine(msm.jacobian_add_affine((first[0], first[1], 1), second))
+
+    def neg(self, point):
+        return msm.negate(point)
+
+    def mul(self, scalar, point):
+        terms = msm._normalize_terms([scalar], [point])
+        if not terms:
+            return None
+        return msm.to_affine(msm.straus(terms))
+
+    def _get_base_table(self):
+        """
+        Rows i = 0, 1, ... hold j * 2^(w*i) * G for j = 1 .. 2^w - 1, so that
+        k*G is one table lookup and mixed addition per w-bit digit of k.
+        """
+        if self._base_table is None:
+            table = []
+            base = msm.G
+            size = (1 << BASE_TABLE_WINDOW) - 1
+            for _ in range(-(-msm.N.bit_length() // BASE_TABLE_WINDOW)):
+                current = (base[0], base[1], 1)
+                row = [current]
+                for _ in range(size - 1):
+                    current = msm.jacobian_add_affine(current, base)
+                    row.append(current)
+                row = msm.batch_to_affine(row)
+                table.append(row)
+                base = msm.to_affine(msm.jacobian_add_affine(current, base))
+            self._base_table = table
+        return self._base_table
+
+    def mul_base(self, scalar):
+        table = self._get_base_table()
+        scalar %= msm.N
+        mask = (1 << BASE_TABLE_WINDOW) - 1
+        accumulator = msm.INFINITY
+        row = 0
+        while scalar:
+            digit = scalar & mask
+            if digit:
+                accumulator = msm.jacobian_add_affine(
+                    accumulator, table[row][digit - 1]
+                )
+            scalar >>= BASE_TABLE_WINDOW
+            row += 1
+        return msm.to_affine(accumulator)
+
+    def multi_scalar_mul(self, scalars, points):
+        return msm.to_affine(msm.multi_scalar_mul(scalars, points))
+
+    def sums_to_identity(self, scalars, points):
+        return msm.sums_to_identity(scalars, points)
+
+
+class EcpyBackend(CurveBackend):
+    name = "ecpy"
+
+    def __init__(self):
+        from ecpy.curves import Curve, Point
+
+        self._curve = Curve.get_curve("secp256k1")
+        self._point_type = Point
+
+    def generator(self):
+        return self._curve.generator
+
+    def point(self, x, y):
+        try:
+            return self._point_type(int(x), int(y), self._curve)
+        except Exception as e:
+            # str() of ECPyException itself raises in ecpy 1.2.5
+            raise ValueError("Point not on curve") from e
+
+    def xy(self, point):
+        if point.is_infinity:
+            return None
+        return (point.x % msm.P, point.y % msm.P)
+
+    def add(self, first, second):
+        return first + second
+
+    def neg(self, point):
+        return -point
+
+    def mul(self, scalar, point):
+        return (scalar % msm.N) * point
+
+
+BACKENDS = {
+    Secp256k1Backend.name: Secp256k1Backend,
+    EcpyBackend.name: EcpyBackend,
+}
+DEFAULT_BACKEND = Secp256k1Backend.name
+
+
+def get_backend(name=None):
+    if name is None:
+        name = os.environ.get("CURVE_BACKEND", DEFAULT_BACKEND)
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"unknown curve backend {name!r}")
+
+
+# -------------------- Tests --------------------
+import unittest
+
+try:
+    import ecpy
+except ImportError:
+    ecpy = None
+
+
+@unittest.skipIf(ecpy is None, "ecpy is not installed")
+class TestBackendsAgree(unittest.TestCase):
+    def setUp(self):
+        import random
+
+        self.rng = random.Random(11)
+        self.fast = Secp256k1Backend()
+        self.reference = EcpyBackend()
+
+    def _pair(self):
+        k = self.rng.randrange(1, msm.N)
+        return self.fast.mul_base(k), self.reference.mul_base(k)
+
+    def test_scalar_multiplication(self):
+        fast_point, reference_point = self._pair()
+        scalars = [0, 1, 2, msm.N - 1, msm.LAMBDA, 2**128 + 1]
+        scalars += [self.rng.randrange(msm.N) for _ in range(20)]
+        for scalar in scalars:
+            self.assertEqual(
+                self.fast.xy(self.fast.mul(scalar, fast_point)),
+                self.reference.xy(self.reference.mul(scalar, reference_point)),
+            )
+            self.assertEqual(
+                self.fast.xy(self.fast.mul_base(scalar)),
+                self.reference.xy(self.reference.mul_base(scalar)),
+            )
+
+    def test_addition_and_multi_scalar_multiplication(self):
+        pairs = [self._pair() for _ in range(4)]
+        for backend, a in zip((self.fast, self.reference), pairs[0]):
+            self.assertTrue(backend.equal(backend.add(a, a), backend.mul(2, a)))
+            self.assertIsNone(backend.xy(backend.add(a, backend.neg(a))))
+        scalars = [self.rng.randrange(msm.N) for _ in pairs]
+        self.assertEqual(
+            self.fast.xy(
+                self.fast.multi_scalar_mul(scalars, [fast for fast, _ in pairs])
+            ),
+            self.reference.xy(
+                self.reference.multi_scalar_mul(scalars, [ref for _, ref in pairs])
+            ),
+        )
+
+    def test_compressed_encoding(self):
+        point = self.fast.xy(self._pair()[0])
+        encoded = encode_point(point)
+        self.assertEqual(
+            encoded,
+            bytes(
+                self.reference._curve.encode_point(
+                    self.reference.point(*point), compressed=True
+                )
+            ),
+        )
+        self.assertEqual(decode_point(encoded), point)
+        self.assertEqual(
+            decode_point(encode_point(msm.negate(point))), msm.negate(point)
+        )
+        with self.assertRaises(ValueError):
+            decode_point(b"\x04" + encoded[1:])
+
+    def test_point_validation(self):
+        x, y = self.fast.xy(self._pair()[0])
+        self.assertEqual(self.fast.point(x + msm.P, y), (x, y))
+        for backend in (self.fast, self.reference):
+            backend.point(x, y)
+            with self.assertRaises(ValueError):
+                backend.point(x, y + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
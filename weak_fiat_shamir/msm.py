@@ -0,0 +1,344 @@
+"""
+Multi-scalar multiplication on secp256k1.
+
+Computes sum(k_i * P_i) with one shared doubling chain instead of one scalar
+multiplication per term. Points are handled in Jacobian coordinates
+(X, Y, Z) <-> (X/Z^2, Y/Z^3) so no field inversion happens until the end.
+
+Affine points are (x, y) tuples of ints and None is the point at infinity.
+Inputs are assumed to be on the curve; callers validate untrusted points.
+"""
+
+# secp256k1: y^2 = x^3 + 7 over GF(P), generator G of prime order N
+P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (
+    0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+    0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8,
+)
+
+INFINITY = (1, 1, 0)
+
+# GLV endomorphism: (x, y) -> (BETA * x, y) equals multiplication by LAMBDA
+BETA = 0x7AE96A2B657C07106E64479EAC3434E99CF0497512F58995C1396C28719501EE
+LAMBDA = 0x5363AD4CC05C30E0A5261C028812645A122E22EA20816678DF02967C1B23BD72
+# Short basis of the lattice {(x, y) : x + y * LAMBDA == 0 (mod N)}
+GLV_A1 = 0x3086D221A7D46BCDE86C90E49284EB15
+GLV_B1 = -0xE4437ED6010E88286F547FA90ABFE4C3
+GLV_A2 = 0x114CA50F7A8E2F3F657C1108D9D44CFD8
+GLV_B2 = GLV_A1
+
+WNAF_WIDTH = 5
+# Below this many terms Straus' interleaved wNAF beats Pippenger's buckets
+PIPPENGER_THRESHOLD = 96
+
+
+def is_on_curve(point):
+    if point is None:
+        return True
+    x, y = point
+    return 0 <= x < P and 0 <= y < P and (y * y - x * x * x - 7) % P == 0
+
+
+def negate(point):
+    if point is None:
+        return None
+    return (point[0], -point[1] % P)
+
+
+def jacobian_double(point):
+    x, y, z = point
+    if not z or not y:
+        return INFINITY
+    a = x * x % P
+    b = y * y % P
+    c = b * b % P
+    d = 2 * ((x + b) ** 2 - a - c) % P
+    e = 3 * a % P
+    x3 = (e * e - 2 * d) % P
+    return (x3, (e * (d - x3) - 8 * c) % P, 2 * y * z % P)
+
+
+def jacobian_add(first, second):
+    x1, y1, z1 = first
+    x2, y2, z2 = second
+    if not z1:
+        return second
+    if not z2:
+        return first
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+    h = (u2 - u1) % P
+    r = (s2 - s1) % P
+    if not h:
+        return jacobian_double(first) if not r else INFINITY
+    hh = h * h % P
+    hhh = h * hh % P
+    v = u1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    return (x3, (r * (v - x3) - s1 * hhh) % P, z1 * z2 * h % P)
+
+
+def jacobian_add_affine(first, point):
+    """Mixed addition of a Jacobian point and an affine point (Z = 1)."""
+    if point is None:
+        return first
+    x1, y1, z1 = first
+    x2, y2 = point
+    if not z1:
+        return (x2, y2, 1)
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+    h = (u2 - x1) % P
+    r = (s2 - y1) % P
+    if not h:
+        return jacobian_double(first) if not r else INFINITY
+    hh = h * h % P
+    hhh = h * hh % P
+    v = x1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    return (x3, (r * (v - x3) - y1 * hhh) % P, z1 * h % P)
+
+
+def to_affine(point):
+    x, y, z = point
+    if not z:
+        return None
+    z_inv = pow(z, -1, P)
+    z_inv2 = z_inv * z_inv % P
+    return (x * z_inv2 % P, y * z_inv2 * z_inv % P)
+
+
+def batch_to_affine(points):
+    """Convert Jacobian points to affine with a single field inversion."""
+    prefix = []
+    accumulator = 1
+    for _, _, z in points:
+        prefix.append(accumulator)
+        if z:
+            accumulator = accumulator * z % P
+    inverse = pow(accumulator, -1, P)
+    result = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        x, y, z = points[i]
+        if not z:
+            continue
+        z_inv = inverse * prefix[i] % P
+        inverse = inverse * z % P
+        z_inv2 = z_inv * z_inv % P
+        result[i] = (x * z_inv2 % P, y * z_inv2 * z_inv % P)
+    return result
+
+
+def _normalize_terms(scalars, points):
+    # Drop trivial terms and use N - k with -P when that shortens the scalar
+    terms = []
+    for scalar, point in zip(scalars, points):
+        scalar %= N
+        if not scalar or point is None:
+            continue
+        if scalar > N >> 1:
+            scalar, point = N - scalar, negate(point)
+        terms.append((scalar, point))
+    return terms
+
+
+def glv_split(scalar):
+    """
+    Split scalar into signed halves (k1, k2) of about 128 bits with
+    scalar == k1 + k2 * LAMBDA (mod N), using the short lattice basis
+    (a1, b1), (a2, b2) of the GLV endomorphism.
+    """
+    c1 = (GLV_B2 * scalar + N // 2) // N
+    c2 = (-GLV_B1 * scalar + N // 2) // N
+    return (
+        scalar - c1 * GLV_A1 - c2 * GLV_A2,
+        -c1 * GLV_B1 - c2 * GLV_B2,
+    )
+
+
+def endomorphism(point):
+    """LAMBDA * point, computed as (BETA * x, y)."""
+    if point is None:
+        return None
+    return (BETA * point[0] % P, point[1])
+
+
+def wnaf(scalar, width=WNAF_WIDTH):
+    """
+    Width-w non-adjacent form of a non-negative scalar, least significant
+    digit first: every non-zero digit is odd, below 2^(w-1) in absolute
+    value, and followed by at least w-1 zeros.
+    """
+    digits = []
+    modulus = 1 << width
+    half = modulus >> 1
+    while scalar:
+        if scalar & 1:
+            digit = scalar & (modulus - 1)
+            if digit >= half:
+                digit -= modulus
+            scalar -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        scalar >>= 1
+    return digits
+
+
+def odd_multiples(points, width=WNAF_WIDTH):
+    """
+    Return, for each affine point, the affine multiples 1, 3, ...,
+    2^(w-1) - 1 times the point, normalized with a single inversion.
+    """
+    count = 1 << (width - 2)
+    multiples = []
+    for x, y in points:
+        current = (x, y, 1)
+        multiples.append(current)
+        if count > 1:
+            double = to_affine(jacobian_double(current))
+            for _ in range(count - 1):
+                current = jacobian_add_affine(current, double)
+                multiples.append(current)
+    affine = batch_to_affine(multiples)
+    return [affine[i : i + count] for i in range(0, len(affine), count)]
+
+
+def straus(terms, width=WNAF_WIDTH):
+    """
+    Interleaved wNAF multiplication of (scalar, affine point) terms.
+
+    Every scalar is split with glv_split() so the shared doubling chain
+    covers about 128 bits; the tables for LAMBDA * point come from those of
+    point through endomorphism(). Each term adds one table entry per
+    non-zero wNAF digit.
+    """
+    tables = odd_multiples([point for _, point in terms], width)
+    recoded = []
+    for (scalar, _), table in zip(terms, tables):
+        for half, half_table in zip(
+            glv_split(scalar), (table, [endomorphism(entry) for entry in table])
+        ):
+            if not half:
+                continue
+            if half < 0:
+                half, half_table = -half, [negate(entry) for entry in half_table]
+            negated = [negate(entry) for entry in half_table]
+            recoded.append((wnaf(half, width), half_table, negated))
+
+    accumulator = INFINITY
+    for position in range(max(len(digits) for digits, _, _ in recoded) - 1, -1, -1):
+        accumulator = jacobian_double(accumulator)
+        for digits, positive, negative in recoded:
+            if position < len(digits):
+                digit = digits[position]
+                if digit > 0:
+                    accumulator = jacobian_add_affine(accumulator, positive[digit >> 1])
+                elif digit < 0:
+                    accumulator = jacobian_add_affine(
+                        accumulator, negative[-digit >> 1]
+                    )
+    return accumulator
+
+
+def pippenger_window(term_count):
+    return max(2, term_count.bit_length() - 3)
+
+
+def pippenger(terms, window=None):
+    """
+    Bucket method: per window, points are added into the bucket of their
+    digit and the buckets are combined with a running sum.
+    """
+    if window is None:
+        window = pippenger_window(len(terms))
+    bits = max(scalar.bit_length() for scalar, _ in terms)
+    mask = (1 << window) - 1
+    accumulator = INFINITY
+    for shift in range((bits - 1) // window * window, -1, -window):
+        for _ in range(window):
+            accumulator = jacobian_double(accumulator)
+        buckets = [INFINITY] * (mask + 1)
+        for scalar, point in terms:
+            digit = (scalar >> shift) & mask
+            if digit:
+                buckets[digit] = jacobian_add_affine(buckets[digit], point)
+        running = INFINITY
+        window_sum = INFINITY
+        for digit in range(mask, 0, -1):
+            running = jacobian_add(running, buckets[digit])
+            window_sum = jacobian_add(window_sum, running)
+        accumulator = jacobian_add(accumulator, window_sum)
+    return accumulator
+
+
+def multi_scalar_mul(scalars, points):
+    """
+    Return sum(scalars[i] * points[i]) as a Jacobian point.
+
+    Args:
+        scalars: Integers, taken modulo N.
+        points: Affine (x, y) points or None.
+    """
+    terms = _normalize_terms(scalars, points)
+    if not terms:
+        return INFINITY
+    if len(terms) < PIPPENGER_THRESHOLD:
+        return straus(terms)
+    return pippenger(terms)
+
+
+def sums_to_identity(scalars, points):
+    """Check sum(scalars[i] * points[i]) == O."""
+    return not multi_scalar_mul(scalars, points)[2]
+
+
+# -------------------- Tests --------------------
+import unittest
+
+
+class TestMultiScalarMul(unittest.TestCase):
+    def _reference(self, scalars, points):
+        from ecpy.curves import Curve, Point
+
+        curve = Curve.get_curve("secp256k1")
+        total = None
+        for scalar, (x, y) in zip(scalars, points):
+            term = scalar * Point(x, y, curve)
+            total = term if total is None else total + term
+        if total.is_infinity:
+            return None
+        return (total.x, total.y)
+
+    def test_matches_ecpy_for_both_algorithms(self):
+        import random
+
+        rng = random.Random(7)
+        points = [
+            to_affine(multi_scalar_mul([rng.randrange(N)], [G])) for _ in range(5)
+        ]
+        scalars = [rng.randrange(N) for _ in points]
+        expected = self._reference(scalars, points)
+        terms = _normalize_terms(scalars, points)
+        self.assertEqual(to_affine(straus(terms)), expected)
+        self.assertEqual(to_affine(pippenger(terms, window=3)), expected)
+        self.assertTrue(all(map(is_on_curve, points)))
+
+    def test_identity_and_edge_cases(self):
+        self.assertEqual(to_affine(multi_scalar_mul([N - 1, 1], [G, G])), None)
+        self.assertEqual(
+            to_affine(multi_scalar_mul([1, 1], [G, G])), self._reference([2], [G])
+        )
+        self.assertTrue(sums_to_identity([0, 5], [G, None]))
+        self.assertTrue(sums_to_identity([3, 2, N - 5], [G, G, G]))
+        self.assertFalse(sums_to_identity([3, 2, N - 4], [G, G, G]))
+
+
+if __name__ == "__main__":
+    unittest.main()
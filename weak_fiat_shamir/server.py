@@ -1,37 +1,339 @@
 import os
+import asyncio
 import json
 import base64
+import multiprocessing
+import re
 import socket
+import sys
 import socketserver
+import struct
 import time
-from hashlib import sha256
+from concurrent.futures import ProcessPoolExecutor
 from secrets import randbelow
-from typing import Tuple, Optional
+from time import perf_counter
+from typing import List, Tuple, Optional
 
-from ecpy.curves import Curve, Point
+# Shared by both challenge servers; the container images copy it next to
+# this file
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common")
+)
+import metrics
+from curve_backend import decode_point, encode_point, get_backend
+from transcript import Transcript
 from flag import flag
 
-
-# Curve params (secp256k1)
-curve = Curve.get_curve("secp256k1")
-G: Point = curve.generator
-q: int = curve.order
-FIELD = curve.field
+# Curve params (secp256k1), arithmetic from the backend named by CURVE_BACKEND
+backend = get_backend()
+G = backend.generator()
+q: int = backend.order
+FIELD = backend.field
 
 N_BYTES = 32
 PT_BYTES = 64
 
+# With TRANSCRIPT_TRACE set, every verification checks which of these each
+# Fiat-Shamir challenge was derived from and counts the challenges that miss
+# some (metric unbound_challenges)
+TRACE_TRANSCRIPTS = bool(os.environ.get("TRANSCRIPT_TRACE"))
+PROVER_MESSAGES = ("A1", "R1", "A2", "R2", "msg")
+
+SESSION_TIMEOUT_SECONDS = 600
+# asyncio mode (SERVER_MODE=asyncio)
+VERIFY_WORKERS = os.cpu_count() or 1
+MAX_PENDING_JOBS = 1024
+MAX_CONNECTIONS = 4096
+MAX_REQUEST_BYTES = 1 << 20
+RECV_BUF = 4096
+
+# Binary protocol: a client sends this magic instead of a JSON request and
+# receives a frame holding A1 as a SEC1 compressed point. It then sends any
+# number of request frames without waiting; each response frame carries the
+# request id it answers. A frame is a 4-byte big-endian length and a payload.
+BINARY_PROTOCOL_MAGIC = b"SCHNORR2\n"
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_BYTES = 1 << 16
+# request id, A2, R1, R2 (compressed), s (big-endian); msg takes the rest
+REQUEST_HEADER = struct.Struct(">I33s33s33s32s")
+# request id, status; the flag or an error message takes the rest
+RESPONSE_HEADER = struct.Struct(">IB")
+STATUS_REJECTED = 0
+STATUS_ACCEPTED = 1
+STATUS_ERROR = 2
+
+
+def new_key_pair():
+    """Generate the per-connection A1 like in the notebook's LocalVerifier."""
+    a1 = randbelow(q - 1) + 1
+    A1 = backend.mul_base(a1)
+    A1_x, A1_y = backend.xy(A1)
+    intro = {
+        "message": "Notebook-scheme batched Schnorr verify. Use A1 below.",
+        "curve": "secp256k1",
+        "A1_x": str(A1_x),
+        "A1_y": str(A1_y),
+    }
+    return A1, (json.dumps(intro) + "\n").encode()
+
+
+def parse_submission(obj):
+    """Return (A2, R1, R2, s, msg) from the client's JSON object."""
+    A2_x = int(obj.get("A2_x", "0"))
+    A2_y = int(obj.get("A2_y", "0"))
+    A2 = backend.point(A2_x, A2_y)
+    R1_x = int(obj.get("R1_x", "0"))
+    R1_y = int(obj.get("R1_y", "0"))
+    R1 = backend.point(R1_x, R1_y)
+    R2_x = int(obj.get("R2_x", "0"))
+    R2_y = int(obj.get("R2_y", "0"))
+    R2 = backend.point(R2_x, R2_y)
+    s_val = int(obj.get("s", "0")) % q
+    msg = obj.get("msg", "")
+    return A2, R1, R2, s_val, msg
+
+
+def check_proof(A1, A2, R1, R2, s_val, msg):
+    """
+    Verify using the exact notebook scheme. Returns (ok, hash_seconds,
+    msm_seconds, unbound) where unbound is the number of challenges not
+    derived from all of PROVER_MESSAGES absorbed before them, or None without
+    TRANSCRIPT_TRACE. Nothing is recorded here, so the result can come back
+    from a pool worker.
+    """
+    start = perf_counter()
+    transcript = Transcript(q, trace=TRACE_TRANSCRIPTS)
+    transcript.absorb_point("A1", backend.xy(A1))
+    transcript.absorb_point("R1", backend.xy(R1))
+    batch_challenge = transcript.challenge("batch_challenge")
+    transcript.absorb_point("A2", backend.xy(A2))
+    transcript.absorb_point("R2", backend.xy(R2))
+    transcript.absorb("msg", msg.encode("latin-1"))
+    e = transcript.challenge("e")
+    hashed = perf_counter()
+    unbound = None
+    if TRACE_TRANSCRIPTS:
+        unbound = len(transcript.unbound(PROVER_MESSAGES))
+    msm_start = perf_counter()
+
+    # s*G == R1 + e*A1 + b*(R2 + e*A2), checked as a single
+    # multi-scalar multiplication s*G - R1 - e*A1 - b*R2 - b*e*A2 == O
+    ok = backend.sums_to_identity(
+        [
+            s_val,
+            q - 1,
+            -e % q,
+            -batch_challenge % q,
+            -batch_challenge * e % q,
+        ],
+        [G, R1, A1, R2, A2],
+    )
+    return ok, hashed - start, perf_counter() - msm_start, unbound
+
+
+def record_check(ok, hash_seconds, msm_seconds, unbound) -> bool:
+    """Record the timings of a check_proof() result and return ok."""
+    metrics.observe("hash", hash_seconds)
+    metrics.observe("msm", msm_seconds)
+    if unbound is not None:
+        metrics.inc("unbound_challenges", unbound)
+    return ok
+
+
+def verify_proof(A1, A2, R1, R2, s_val, msg) -> bool:
+    return record_check(*check_proof(A1, A2, R1, R2, s_val, msg))
+
+
+def result_response(ok: bool) -> bytes:
+    metrics.inc("proofs_accepted" if ok else "proofs_rejected")
+    resp = {
+        "ok": bool(ok),
+    }
+    if ok:
+        resp["flag"] = flag
+    return (json.dumps(resp) + "\n").encode()
+
+
+def error_response(error: str) -> bytes:
+    return (json.dumps({"ok": False, "error": error}) + "\n").encode()
+
+
+def encode_frame(payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Split a byte stream into frame payloads, whatever the chunking."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self._buffer += data
+        payloads = []
+        offset = 0
+        buffer = self._buffer
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(buffer, offset)
+            if length > MAX_FRAME_BYTES:
+                raise ValueError("frame too large")
+            end = offset + FRAME_HEADER.size + length
+            if len(buffer) < end:
+                break
+            payloads.append(bytes(buffer[offset + FRAME_HEADER.size : end]))
+            offset = end
+        del buffer[:offset]
+        return payloads
+
+
+def binary_hello(A1) -> bytes:
+    return encode_frame(encode_point(backend.xy(A1)))
+
+
+def parse_binary_request(payload: bytes):
+    """
+    Return (request_id, (A2, R1, R2, s, msg)); the submission is None when
+    the fields are invalid.
+    """
+    if len(payload) < REQUEST_HEADER.size:
+        request_id = int.from_bytes(payload[:4].ljust(4, b"\0"), "big")
+        return request_id, None
+    request_id, A2, R1, R2, s_bytes = REQUEST_HEADER.unpack_from(payload)
+    try:
+        A2, R1, R2 = (backend.point(*decode_point(P)) for P in (A2, R1, R2))
+    except ValueError:
+        return request_id, None
+    s_val = int.from_bytes(s_bytes, "big") % q
+    # latin-1 maps bytes to str one to one, as in the JSON protocol
+    msg = payload[REQUEST_HEADER.size :].decode("latin-1")
+    return request_id, (A2, R1, R2, s_val, msg)
+
+
+def binary_response(request_id: int, ok: bool) -> bytes:
+    metrics.inc("proofs_accepted" if ok else "proofs_rejected")
+    if ok:
+        return encode_frame(
+            RESPONSE_HEADER.pack(request_id, STATUS_ACCEPTED) + flag.encode()
+        )
+    return encode_frame(RESPONSE_HEADER.pack(request_id, STATUS_REJECTED))
+
+
+def binary_error(request_id: int, error: str) -> bytes:
+    return encode_frame(RESPONSE_HEADER.pack(request_id, STATUS_ERROR) + error.encode())
+
+
+def handle_binary_request(A1, payload: bytes) -> bytes:
+    with metrics.span("parse"):
+        request_id, submission = parse_binary_request(payload)
+    if submission is None:
+        return binary_error(request_id, "invalid fields")
+    return binary_response(request_id, verify_proof(A1, *submission))
+
+
+# Bytes that can end a request or change the JSON nesting
+_REQUEST_SPECIAL = re.compile(rb'[\n"\\{}\[\]]')
+
+
+class RequestAssembler:
+    """
+    Collect the client's first message from received chunks: a line, or a
+    JSON object without a newline, which is complete once its closing brace
+    arrives. String state and nesting depth are carried from chunk to
+    chunk, so every byte is scanned once.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._depth = 0
+        self._in_string = False
+        # The chunk ended on a backslash inside a string
+        self._escaped = False
+
+    def feed(self, chunk: bytes) -> Optional[Tuple[bytes, bytes]]:
+        """
+        Consume one chunk, empty at the end of the stream. Return (message,
+        bytes received after it) once the message is complete, else None.
+        """
+        buffer = self._buffer
+        if not chunk:
+            return bytes(buffer), b""
+        position = len(buffer)
+        buffer += chunk
+        if self._escaped:
+            self._escaped = False
+            position += 1
+        while True:
+            match = _REQUEST_SPECIAL.search(buffer, position)
+            if match is None:
+                break
+            position = match.end()
+            byte = buffer[match.start()]
+            if byte == 0x0A:  # \n
+                return bytes(buffer[: match.start()]), bytes(buffer[position:])
+            if self._in_string:
+                if byte == 0x22:  # "
+                    self._in_string = False
+                elif byte == 0x5C:  # \
+                    if position == len(buffer):
+                        self._escaped = True
+                        break
+                    position += 1
+            elif byte == 0x22:
+                self._in_string = True
+            elif byte in b"{[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth <= 0:
+                    return bytes(buffer[:position]), bytes(buffer[position:])
+        if len(buffer) > MAX_REQUEST_BYTES:
+            raise ValueError("request too large")
+        return None
 
-def _i2b32(x: int) -> bytes:
-    return int(x % FIELD).to_bytes(N_BYTES, "big")
 
+def _recv_request(sock, ensure_deadline):
+    """Read the client's first message, see RequestAssembler."""
+    assembler = RequestAssembler()
+    while True:
+        chunk = sock.recv(RECV_BUF)
+        ensure_deadline()
+        request = assembler.feed(chunk)
+        if request is not None:
+            return request
 
-def _ser_point(P: Point) -> bytes:
-    return _i2b32(P.x) + _i2b32(P.y)
+
+async def _read_request(reader):
+    """Asyncio counterpart of _recv_request()."""
+    assembler = RequestAssembler()
+    while True:
+        request = assembler.feed(await reader.read(RECV_BUF))
+        if request is not None:
+            return request
+
+
+class _PrefixedReader:
+    """A StreamReader whose readexactly() first returns prefix."""
+
+    def __init__(self, prefix: bytes, reader):
+        self._prefix = prefix
+        self._reader = reader
+
+    async def readexactly(self, n: int) -> bytes:
+        if not self._prefix:
+            return await self._reader.readexactly(n)
+        head, self._prefix = self._prefix[:n], self._prefix[n:]
+        if len(head) == n:
+            return head
+        try:
+            return head + await self._reader.readexactly(n - len(head))
+        except asyncio.IncompleteReadError as e:
+            raise asyncio.IncompleteReadError(head + e.partial, n)
 
 
 class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
     def handle(self):
+        metrics.inc("sessions")
+        metrics.gauge_add("sessions_active", 1)
         try:
             try:
                 self.request.settimeout(600)
@@ -43,55 +345,27 @@ class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
                 if time.monotonic() - start_time > 600:
                     raise TimeoutError("connection processing timed out")
 
-            # Generate per-connection A1 like in the notebook's LocalVerifier
-            a1 = randbelow(q - 1) + 1
-            A1 = a1 * G
-
-            intro = {
-                "message": "Notebook-scheme batched Schnorr verify. Use A1 below.",
-                "curve": "secp256k1",
-                "A1_x": str(A1.x),
-                "A1_y": str(A1.y),
-            }
-            self.request.sendall((json.dumps(intro) + "\n").encode())
+            with metrics.span("keygen"):
+                A1, intro = new_key_pair()
+            self.request.sendall(intro)
 
-            data = self.request.recv(1 << 20)
-            ensure_deadline()
-            obj = json.loads(data.decode().strip())
-
-            try:
-                A2_x = int(obj.get("A2_x", "0"))
-                A2_y = int(obj.get("A2_y", "0"))
-                A2 = Point(A2_x, A2_y, curve)
-                R1_x = int(obj.get("R1_x", "0"))
-                R1_y = int(obj.get("R1_y", "0"))
-                R1 = Point(R1_x, R1_y, curve)
-                R2_x = int(obj.get("R2_x", "0"))
-                R2_y = int(obj.get("R2_y", "0"))
-                R2 = Point(R2_x, R2_y, curve)
-                s_val = int(obj.get("s", "0")) % q
-                msg = obj.get("msg", "")
-            except Exception:
-                self.request.sendall(b'{"ok":false,"error":"invalid fields"}\n')
+            with metrics.span("receive"):
+                data, rest = _recv_request(self.request, ensure_deadline)
+            if data + b"\n" == BINARY_PROTOCOL_MAGIC:
+                self.serve_binary(A1, rest, ensure_deadline)
                 return
+            with metrics.span("parse"):
+                obj = json.loads(data.decode().strip())
+                try:
+                    A2, R1, R2, s_val, msg = parse_submission(obj)
+                except Exception:
+                    self.request.sendall(b'{"ok":false,"error":"invalid fields"}\n')
+                    return
 
-            # Verify using the exact notebook scheme
-            data_bytes = _ser_point(A1) + _ser_point(R1)
-            batch_challenge = int.from_bytes(sha256(data_bytes).digest(), "big") % q
-            data_bytes += _ser_point(A2) + _ser_point(R2) + msg.encode("latin-1")
-            e = int.from_bytes(sha256(data_bytes).digest(), "big") % q
-
-            lhs = (s_val % q) * G
-            rhs = R1 + e * A1 + batch_challenge * (R2 + e * A2)
-            ok = lhs == rhs
+            ok = verify_proof(A1, A2, R1, R2, s_val, msg)
             ensure_deadline()
 
-            resp = {
-                "ok": bool(ok),
-            }
-            if ok:
-                resp["flag"] = flag
-            self.request.sendall((json.dumps(resp) + "\n").encode())
+            self.request.sendall(result_response(ok))
         except socket.timeout:
             try:
                 self.request.sendall(b'{"ok":false,"error":"timeout"}\n')
@@ -99,11 +373,27 @@ class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
                 pass
         except Exception as e:
             try:
-                self.request.sendall(
-                    (json.dumps({"ok": False, "error": str(e)}) + "\n").encode()
-                )
+                self.request.sendall(error_response(str(e)))
             except Exception:
                 pass
+        finally:
+            metrics.gauge_add("sessions_active", -1)
+
+    def serve_binary(self, A1, data, ensure_deadline):
+        self.request.sendall(binary_hello(A1))
+        decoder = FrameDecoder()
+        while True:
+            try:
+                payloads = decoder.feed(data)
+            except ValueError as e:
+                self.request.sendall(binary_error(0, str(e)))
+                return
+            for payload in payloads:
+                self.request.sendall(handle_binary_request(A1, payload))
+                ensure_deadline()
+            data = self.request.recv(RECV_BUF)
+            if not data:
+                return
 
 
 class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
@@ -111,13 +401,203 @@ class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     allow_reuse_address = True
 
 
+def verify_job(job):
+    """
+    Process-pool entry point: job holds coordinates, not backend points.
+    Returns the check_proof() result for the event loop process to record,
+    as metrics recorded in a worker are never exported.
+    """
+    A1_xy, A2_xy, R1_xy, R2_xy, s_val, msg = job
+    A1, A2, R1, R2 = (backend.point(*xy) for xy in (A1_xy, A2_xy, R1_xy, R2_xy))
+    return check_proof(A1, A2, R1, R2, s_val, msg)
+
+
+async def _serve_session(reader, writer, verify_executor, job_slots):
+    with metrics.span("keygen"):
+        A1, intro = new_key_pair()
+    writer.write(intro)
+    await writer.drain()
+
+    with metrics.span("receive"):
+        data, rest = await _read_request(reader)
+    if data + b"\n" == BINARY_PROTOCOL_MAGIC:
+        await _serve_binary_session(
+            _PrefixedReader(rest, reader), writer, A1, verify_executor, job_slots
+        )
+        return
+    with metrics.span("parse"):
+        obj = json.loads(data.decode().strip())
+        try:
+            A2, R1, R2, s_val, msg = parse_submission(obj)
+        except Exception:
+            writer.write(b'{"ok":false,"error":"invalid fields"}\n')
+            return
+
+    if job_slots.locked():
+        metrics.inc("proofs_busy")
+        writer.write(error_response("server busy"))
+        return
+    async with job_slots:
+        ok = await _verify_in_pool(verify_executor, A1, A2, R1, R2, s_val, msg)
+    writer.write(result_response(ok))
+
+
+async def _verify_in_pool(verify_executor, A1, *submission):
+    A2, R1, R2, s_val, msg = submission
+    job = tuple(backend.xy(P) for P in (A1, A2, R1, R2)) + (s_val, msg)
+    loop = asyncio.get_running_loop()
+    # Includes waiting for a worker
+    with metrics.span("verify"):
+        result = await loop.run_in_executor(verify_executor, verify_job, job)
+    return record_check(*result)
+
+
+async def _serve_binary_session(reader, writer, A1, verify_executor, job_slots):
+    """
+    Read request frames as they arrive and verify them concurrently in the
+    pool; responses are written in completion order.
+    """
+
+    async def verify_and_reply(request_id, submission):
+        ok = await _verify_in_pool(verify_executor, A1, *submission)
+        writer.write(binary_response(request_id, ok))
+
+    writer.write(binary_hello(A1))
+    pending = set()
+    try:
+        while True:
+            # A stream that ends mid-frame is closed without a reply: the
+            # generic error handler would answer in JSON
+            try:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                (length,) = FRAME_HEADER.unpack(header)
+                if length > MAX_FRAME_BYTES:
+                    writer.write(binary_error(0, "frame too large"))
+                    break
+                payload = await reader.readexactly(length)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                break
+            with metrics.span("parse"):
+                request_id, submission = parse_binary_request(payload)
+            if submission is None:
+                writer.write(binary_error(request_id, "invalid fields"))
+            elif job_slots.locked():
+                metrics.inc("proofs_busy")
+                writer.write(binary_error(request_id, "server busy"))
+            else:
+                await job_slots.acquire()
+                task = asyncio.ensure_future(verify_and_reply(request_id, submission))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                # Runs even if the task is cancelled before it starts
+                task.add_done_callback(lambda _: job_slots.release())
+            await writer.drain()
+        if pending:
+            await asyncio.gather(*pending)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _handle_client_async(reader, writer, connection_slots, *session_args):
+    metrics.inc("sessions")
+    metrics.gauge_add("sessions_active", 1)
+    try:
+        if connection_slots.locked():
+            metrics.inc("sessions_busy")
+            writer.write(error_response("server busy"))
+            return
+        async with connection_slots:
+            await asyncio.wait_for(
+                _serve_session(reader, writer, *session_args), SESSION_TIMEOUT_SECONDS
+            )
+    except asyncio.TimeoutError:
+        writer.write(b'{"ok":false,"error":"timeout"}\n')
+    except ConnectionError:
+        pass
+    except Exception as e:
+        writer.write(error_response(str(e)))
+    finally:
+        try:
+            await writer.drain()
+        except Exception:
+            pass
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+        metrics.gauge_add("sessions_active", -1)
+
+
+async def serve_asyncio(
+    host: str,
+    port: int,
+    verify_workers: int = VERIFY_WORKERS,
+    max_pending_jobs: int = MAX_PENDING_JOBS,
+    max_connections: int = MAX_CONNECTIONS,
+):
+    """
+    Serve the same protocol from one event loop.
+
+    Network I/O stays on the loop; decoded proofs are verified by a pool of
+    verify_workers processes, so verification uses every core. At most
+    max_pending_jobs proofs wait for or run in the pool and at most
+    max_connections sessions are open; beyond that clients are told the
+    server is busy. Each session, its verification job included, must finish
+    within SESSION_TIMEOUT_SECONDS.
+    """
+    connection_slots = asyncio.Semaphore(max_connections)
+    job_slots = asyncio.Semaphore(max_pending_jobs)
+    # Workers come from a fork server so they never inherit client sockets
+    with ProcessPoolExecutor(
+        max_workers=verify_workers,
+        mp_context=multiprocessing.get_context("forkserver"),
+    ) as verify_executor:
+        server = await asyncio.start_server(
+            lambda reader, writer: _handle_client_async(
+                reader, writer, connection_slots, verify_executor, job_slots
+            ),
+            host,
+            port,
+            limit=MAX_REQUEST_BYTES,
+            reuse_address=True,
+        )
+        async with server:
+            await server.serve_forever()
+
+
 if __name__ == "__main__":
     if os.environ.get("RUN_SCHNORR_SERVER"):
         host = os.environ.get("CHAL_HOST", "0.0.0.0")
         port = int(os.environ.get("CHAL_PORT", "1337"))
         print(f"Starting Schnorr batching server on {host}:{port} ...")
-        with ThreadedTCPServer((host, port), ThreadedTCPRequestHandler) as server:
+        # Build the fixed-base table of G before the first connection needs it
+        with metrics.span("base_table"):
+            backend.mul_base(1)
+        metrics.start_exporter("schnorr")
+        if os.environ.get("SERVER_MODE", "threaded") == "asyncio":
             try:
-                server.serve_forever()
+                asyncio.run(
+                    serve_asyncio(
+                        host,
+                        port,
+                        verify_workers=int(
+                            os.environ.get("VERIFY_WORKERS", VERIFY_WORKERS)
+                        ),
+                        max_pending_jobs=int(
+                            os.environ.get("MAX_PENDING_JOBS", MAX_PENDING_JOBS)
+                        ),
+                        max_connections=int(
+                            os.environ.get("MAX_CONNECTIONS", MAX_CONNECTIONS)
+                        ),
+                    )
+                )
             except KeyboardInterrupt:
                 print("Shutting down server...")
+        else:
+            with ThreadedTCPServer((host, port), ThreadedTCPRequestHandler) as server:
+                try:
+                    server.serve_forever()
+                except KeyboardInterrupt:
+                    print("Shutting down server...")
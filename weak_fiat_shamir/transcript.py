@@ -0,0 +1,131 @@
+"""
+Incremental Fiat–Shamir transcript.
+
+Prover messages are absorbed into one running SHA-256 state; a challenge is
+the digest of a copy of that state, reduced modulo the group order, so the
+prefix is never hashed twice and no byte strings are concatenated. The
+challenge itself is not absorbed and labels are not hashed: this reproduces
+the challenges of the notebook's scheme byte for byte.
+
+With trace=True the transcript also records, for each challenge, the labels
+of the values absorbed before it. unbound() compares that with the values a
+challenge has to depend on, which is how a weak Fiat–Shamir transform shows
+up: in the batched scheme, batch_challenge = H(A1 || R1) is derived before
+A2, R2 and msg are absorbed.
+"""
+
+from collections import namedtuple
+from hashlib import sha256
+
+ChallengeTrace = namedtuple("ChallengeTrace", "label absorbed value")
+
+
+class Transcript:
+    __slots__ = ("modulus", "trace", "_state", "_absorbed")
+
+    def __init__(self, modulus, trace=False):
+        self.modulus = modulus
+        self._state = sha256()
+        # Labels absorbed so far and one ChallengeTrace per challenge
+        self._absorbed = [] if trace else None
+        self.trace = [] if trace else None
+
+    def absorb(self, label, data):
+        self._state.update(data)
+        if self._absorbed is not None:
+            self._absorbed.append(label)
+
+    def absorb_point(self, label, point):
+        """Absorb affine (x, y) coordinates as two 32-byte big-endian integers."""
+        update = self._state.update
+        update(point[0].to_bytes(32, "big"))
+        update(point[1].to_bytes(32, "big"))
+        if self._absorbed is not None:
+            self._absorbed.append(label)
+
+    def challenge(self, label):
+        """Return H(everything absorbed so far) mod modulus."""
+        value = int.from_bytes(self._state.copy().digest(), "big") % self.modulus
+        if self.trace is not None:
+            self.trace.append(ChallengeTrace(label, tuple(self._absorbed), value))
+        return value
+
+    def copy(self):
+        """Return an independent transcript with the same absorbed prefix."""
+        other = Transcript.__new__(Transcript)
+        other.modulus = self.modulus
+        other._state = self._state.copy()
+        other._absorbed = None if self._absorbed is None else list(self._absorbed)
+        other.trace = None if self.trace is None else list(self.trace)
+        return other
+
+    def unbound(self, required):
+        """
+        Return {challenge label: labels in required absorbed after it} for
+        every traced challenge that does not bind all of required.
+        """
+        if self.trace is None:
+            raise ValueError("transcript was created without trace=True")
+        missing = {}
+        for entry in self.trace:
+            absent = [label for label in required if label not in entry.absorbed]
+            if absent:
+                missing[entry.label] = absent
+        return missing
+
+
+# -------------------- Tests --------------------
+import unittest
+
+
+class TestTranscript(unittest.TestCase):
+    ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+    def _points(self):
+        import random
+
+        rng = random.Random(5)
+        return [(rng.getrandbits(256), rng.getrandbits(256)) for _ in range(4)]
+
+    def test_matches_concatenated_hashing(self):
+        A1, R1, A2, R2 = self._points()
+        msg = b"hello schnorr batching"
+
+        def ser(point):
+            return point[0].to_bytes(32, "big") + point[1].to_bytes(32, "big")
+
+        data = ser(A1) + ser(R1)
+        expected_b = int.from_bytes(sha256(data).digest(), "big") % self.ORDER
+        data += ser(A2) + ser(R2) + msg
+        expected_e = int.from_bytes(sha256(data).digest(), "big") % self.ORDER
+
+        for trace in (False, True):
+            transcript = Transcript(self.ORDER, trace=trace)
+            transcript.absorb_point("A1", A1)
+            transcript.absorb_point("R1", R1)
+            self.assertEqual(transcript.challenge("b"), expected_b)
+            transcript.absorb_point("A2", A2)
+            transcript.absorb_point("R2", R2)
+            transcript.absorb("msg", msg)
+            self.assertEqual(transcript.challenge("e"), expected_e)
+
+    def test_trace_flags_unbound_challenges(self):
+        A1, R1, A2, R2 = self._points()
+        transcript = Transcript(self.ORDER, trace=True)
+        transcript.absorb_point("A1", A1)
+        transcript.absorb_point("R1", R1)
+        transcript.challenge("b")
+        fork = transcript.copy()
+        transcript.absorb_point("A2", A2)
+        transcript.absorb_point("R2", R2)
+        transcript.challenge("e")
+        self.assertEqual(
+            transcript.unbound(["A1", "R1", "A2", "R2"]), {"b": ["A2", "R2"]}
+        )
+        self.assertEqual([entry.label for entry in fork.trace], ["b"])
+        with self.assertRaises(ValueError):
+            Transcript(self.ORDER).unbound(["A1"])
+
+
+if __name__ == "__main__":
+    unittest.main()